@@ -0,0 +1,81 @@
+import math
+import random
+
+from collections import deque
+
+from lefci.model import Config
+
+PROGRAMS = ['sshd', 'cron', 'sudo', 'kernel', 'postfix', 'nginx', 'haproxy', 'systemd', 'dhcpd', 'named']
+WORDS = ['failed', 'accepted', 'error', 'warning', 'session', 'connection', 'timeout', 'user', 'root', 'disk']
+
+
+def create_filter(rng, field, complexity):
+    """
+    :param complexity: 'literal' for plain text, 'anchored' for literals anchored at the start, 'regex' for
+                       character classes and quantifiers, 'complex' for alternations, groups and lazy quantifiers
+    :return: the filter and a value it matches
+    :rtype: tuple(dict, str)
+    """
+    word = rng.choice(PROGRAMS if field == 'program' else WORDS)
+    number = rng.randrange(1000)
+    value = f'{word}{number} {rng.choice(WORDS)}'
+    if complexity == 'literal':
+        pattern = f'{word}{number}'
+    elif complexity == 'anchored':
+        pattern = f'^{word}{number}'
+    elif complexity == 'regex':
+        pattern = rf'{word}\d*{number}\s?'
+    else:
+        pattern = rf'^(?:{word}|{rng.choice(WORDS)})[-_]?\d{{1,3}}.*?{number}(?:\s|$)'
+        value = f'{word}-1 {number}'
+    return {'field': field, 'pattern': pattern}, value
+
+
+def create_node(rng, index, filters_per_node, complexity):
+    filters = []
+    example = {}
+    # one filter per field, so the example of the node can match all of its filters
+    for field in rng.sample(['message', 'host', 'program'], min(filters_per_node, 3)):
+        filter, example[field] = create_filter(rng, field, complexity)
+        filters.append(filter)
+    return {
+        'id': f'node-{index}',
+        'title': f'node {index}',
+        'filters': filters,
+        'actions': [{'action': 'file', 'filepath': f'/var/log/lefci/node-{index}.log'}],
+        'example': example,
+        'children': [],
+    }
+
+
+def generate_config(size, depth=None, fan_out=4, filters_per_node=2, complexity='regex', seed=0):
+    """
+    Generates a config with trees filled breadth first.
+    :param size: number of nodes
+    :type size: int
+    :param depth: maximum depth of the trees, the fan-out is raised to fit all nodes if given
+    :type depth: int
+    :param fan_out: children per node
+    :type fan_out: int
+    :param filters_per_node: filters of every node, at most one per field
+    :type filters_per_node: int
+    :param complexity: complexity of the patterns, see create_pattern
+    :type complexity: str
+    :param seed: seed of the random generator, the same arguments generate the same config
+    :type seed: int
+    :rtype: Config
+    """
+    rng = random.Random(seed)
+    if depth:
+        fan_out = max(fan_out, math.ceil(size ** (1 / depth)))
+    roots = [create_node(rng, index, filters_per_node, complexity) for index in range(min(size, fan_out))]
+    queue = deque(roots)
+    index = len(roots)
+    while index < size:
+        parent = queue.popleft()
+        for _ in range(min(fan_out, size - index)):
+            child = create_node(rng, index, filters_per_node, complexity)
+            parent['children'].append(child)
+            queue.append(child)
+            index += 1
+    return Config(name=f'benchmark-{size}', log_trees=roots, server=['relay.example.com'])
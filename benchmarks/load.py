@@ -0,0 +1,337 @@
+"""
+Drives the v1 REST API with concurrent editors and reports throughput, latency percentiles per endpoint and the
+consistency problems it saw.
+
+    python -m benchmarks.load                      # in-process against the Flask app
+    python -m benchmarks.load --gunicorn 4         # against 4 local gunicorn workers
+    python -m benchmarks.load --url http://127.0.0.1:5000
+
+Every editor adds, updates and deletes its own nodes of one shared config, reads its updates back and fetches full
+trees and the config list. Afterwards the config is fetched again and compared with the successful writes.
+
+--gunicorn starts the workers with the gunicorn of requirements.txt, which has to be installed in the running
+interpreter.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_NAME = 'load-test'
+OPERATIONS = [('add', 20), ('update', 35), ('delete', 10), ('get_config', 15), ('get_tree', 10), ('list', 10)]
+
+
+class InProcessClient:
+    """
+    Sends requests through the test client of the Flask app, every thread gets its own client.
+    """
+
+    def __init__(self):
+        from lefci import app
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """
+    Sends requests over HTTP with one keep-alive connection per thread.
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            connection.request(method, path, data, headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.problems = {'stale_reads': 0, 'lost_nodes': 0, 'resurrected_nodes': 0, 'lost_updates': 0}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, latency, status):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            if status >= 400:
+                key = f'{endpoint} {status}'
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def add_problem(self, problem, count=1):
+        with self._lock:
+            self.problems[problem] += count
+
+    def summarize(self, duration):
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'throughput': len(latencies) / duration,
+                'p50': get_percentile(latencies, 0.5),
+                'p95': get_percentile(latencies, 0.95),
+                'p99': get_percentile(latencies, 0.99),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            'duration': duration,
+            'requests': total,
+            'throughput': total / duration,
+            'endpoints': endpoints,
+            'errors': self.errors,
+            'problems': self.problems,
+        }
+
+
+def get_percentile(sorted_values, percentile):
+    return sorted_values[max(0, math.ceil(percentile * len(sorted_values)) - 1)]
+
+
+class Editor(threading.Thread):
+    """
+    One concurrent user of the API, it only changes the nodes it added itself.
+    """
+
+    def __init__(self, number, client, recorder, seed_ids, deadline, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self.number = number
+        self.client = client
+        self.recorder = recorder
+        self.seed_ids = seed_ids
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.nodes = {}
+        self.deleted = set()
+        self.edits = 0
+
+    def request(self, endpoint, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, data = self.client.request(method, path, body)
+        except (http.client.HTTPException, OSError):
+            status, data = 599, b''
+        self.recorder.record(endpoint, time.perf_counter() - start, status)
+        return status, data
+
+    def run(self):
+        operations, weights = zip(*OPERATIONS)
+        while time.monotonic() < self.deadline:
+            operation = self.rng.choices(operations, weights)[0]
+            if operation in ('update', 'delete') and not self.nodes:
+                operation = 'add'
+            getattr(self, operation)()
+
+    def add(self):
+        uuid = str(uuid4())
+        title = f'editor {self.number} node {self.edits}'
+        self.edits += 1
+        body = {'id': uuid, 'title': title, 'filters': [{'field': 'program', 'pattern': f'^editor{self.number}$'}],
+                'example': {'program': f'editor{self.number}'}}
+        parent = self.rng.choice(self.seed_ids)
+        status, _ = self.request('POST trees', 'POST', f'/v1/configs/{CONFIG_NAME}/trees/{parent}', body)
+        if status == 200:
+            self.nodes[uuid] = title
+
+    def update(self):
+        uuid = self.rng.choice(list(self.nodes))
+        title = f'editor {self.number} node {self.edits}'
+        self.edits += 1
+        status, _ = self.request('PUT trees', 'PUT', f'/v1/configs/{CONFIG_NAME}/trees/{uuid}', {'title': title})
+        if status != 200:
+            return
+        self.nodes[uuid] = title
+        # the next request may be answered by another worker, which has to see the write
+        status, data = self.request('GET trees/<uuid>', 'GET', f'/v1/configs/{CONFIG_NAME}/trees/{uuid}')
+        if status != 200 or json.loads(data).get('title') != title:
+            self.recorder.add_problem('stale_reads')
+
+    def delete(self):
+        uuid = self.rng.choice(list(self.nodes))
+        status, _ = self.request('DELETE trees', 'DELETE', f'/v1/configs/{CONFIG_NAME}/trees/{uuid}')
+        if status == 200:
+            del self.nodes[uuid]
+            self.deleted.add(uuid)
+
+    def get_config(self):
+        self.request('GET configs/<name>', 'GET', f'/v1/configs/{CONFIG_NAME}')
+
+    def get_tree(self):
+        self.request('GET trees/<uuid>', 'GET', f'/v1/configs/{CONFIG_NAME}/trees/{self.rng.choice(self.seed_ids)}')
+
+    def list(self):
+        self.request('GET configs', 'GET', '/v1/configs')
+
+
+def get_titles(trees):
+    titles = {}
+    stack = list(trees)
+    while stack:
+        node = stack.pop()
+        titles[node['id']] = node['title']
+        stack += node['children']
+    return titles
+
+
+def check_consistency(client, editors, recorder, reads):
+    """
+    Fetches the config several times, so every worker is asked, and compares it with the successful writes. Every
+    node is counted once, however many fetches show the problem.
+    """
+    problems = {'lost_nodes': set(), 'lost_updates': set(), 'resurrected_nodes': set()}
+    for _ in range(reads):
+        status, data = client.request('GET', f'/v1/configs/{CONFIG_NAME}')
+        if status != 200:
+            continue
+        titles = get_titles(json.loads(data)['log_trees'])
+        for editor in editors:
+            for uuid, title in editor.nodes.items():
+                if uuid not in titles:
+                    problems['lost_nodes'].add(uuid)
+                elif titles[uuid] != title:
+                    problems['lost_updates'].add(uuid)
+            problems['resurrected_nodes'].update(editor.deleted & titles.keys())
+    for problem, uuids in problems.items():
+        recorder.add_problem(problem, len(uuids))
+
+
+def run(client, args):
+    # importing lefci creates the store of the app, so it's imported once the working directory is set
+    from benchmarks.generator import generate_config
+
+    config = generate_config(args.nodes, fan_out=args.fan_out, seed=args.seed)
+    config.name = CONFIG_NAME
+    status, data = client.request('POST', '/v1/configs', {'config': config.encode()})
+    if status != 200:
+        raise RuntimeError(f'Saving the config failed with {status}: {data[:200]}')
+    seed_ids = [f'node-{index}' for index in range(args.nodes)]
+
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    editors = [Editor(number, client, recorder, seed_ids, deadline, args.seed + number)
+               for number in range(args.editors)]
+    start = time.monotonic()
+    for editor in editors:
+        editor.start()
+    for editor in editors:
+        editor.join()
+    duration = time.monotonic() - start
+    check_consistency(client, editors, recorder, args.reads)
+    return recorder.summarize(duration)
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Nothing listens on {host}:{port} after {timeout} seconds')
+
+
+def start_gunicorn(workers, directory):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                                '--bind', f'127.0.0.1:{port}', '--pythonpath', REPOSITORY, 'run:app'], cwd=directory)
+    try:
+        wait_for_port('127.0.0.1', port, 30)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process, f'http://127.0.0.1:{port}'
+
+
+def print_summary(summary):
+    print(f"{summary['requests']} requests in {summary['duration']:.1f} s, {summary['throughput']:.1f} requests/s")
+    print(f"{'endpoint':<20} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"{endpoint:<20} {stats['requests']:>9} {stats['throughput']:>8.1f} {stats['p50'] * 1000:>9.2f} "
+              f"{stats['p95'] * 1000:>9.2f} {stats['p99'] * 1000:>9.2f}")
+    for error, count in sorted(summary['errors'].items()):
+        print(f'error {error}: {count}')
+    for problem, count in summary['problems'].items():
+        if count:
+            print(f'{problem.replace("_", " ")}: {count}')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Load tests the lefci REST API with concurrent editors.')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='base URL of a running lefci, default is in-process')
+    target.add_argument('--gunicorn', type=int, metavar='WORKERS', help='start gunicorn with this many workers')
+    parser.add_argument('--editors', type=int, default=8, help='concurrent editors')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--nodes', type=int, default=200, help='nodes of the shared config')
+    parser.add_argument('--fan-out', type=int, default=4, help='children per node of the shared config')
+    parser.add_argument('--reads', type=int, default=8, help='fetches of the config for the consistency check')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the config and the workload')
+    parser.add_argument('--output', help='file to write the summary to as JSON')
+    args = parser.parse_args(args)
+    output = os.path.abspath(args.output) if args.output else None
+
+    process = None
+    with tempfile.TemporaryDirectory(prefix='lefci-load-') as directory:
+        try:
+            if args.url:
+                client = HttpClient(args.url)
+            elif args.gunicorn:
+                process, url = start_gunicorn(args.gunicorn, directory)
+                client = HttpClient(url)
+            else:
+                # the app keeps its configs relative to the working directory
+                os.chdir(directory)
+                client = InProcessClient()
+            summary = run(client, args)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+
+    print_summary(summary)
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(summary, output_file, indent=2)
+    return 1 if any(summary['problems'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
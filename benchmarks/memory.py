@@ -0,0 +1,60 @@
+"""
+Measures the memory a loaded config takes per node.
+
+    python -m benchmarks.memory --size 100000
+
+The config is loaded from its JSON like the stores do. Caches of fixed size, e.g. of compiled patterns, fill up for
+both sizes measured, so the difference between a config and one of half its size is what every node costs.
+"""
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+
+from lefci.model import Config
+
+from benchmarks.generator import generate_config
+
+
+def measure_load(text):
+    """
+    :return: bytes allocated and still used after loading the config and the number of its nodes
+    :rtype: tuple(int, int)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        config = Config(**json.loads(text))
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0], len(config._index)
+    finally:
+        tracemalloc.stop()
+
+
+def measure_memory(size, fan_out=4, filters_per_node=2, complexity='regex', seed=0):
+    """
+    :return: bytes per node
+    :rtype: float
+    """
+    half, _ = measure_load(generate_config(size // 2, None, fan_out, filters_per_node, complexity, seed).to_json())
+    full, nodes = measure_load(generate_config(size, None, fan_out, filters_per_node, complexity, seed).to_json())
+    return (full - half) / (nodes - size // 2)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Measures the memory per node of a loaded lefci config.')
+    parser.add_argument('--size', type=int, default=100000, help='number of nodes')
+    parser.add_argument('--fan-out', type=int, default=4, help='children per node')
+    parser.add_argument('--filters', type=int, default=2, help='filters per node')
+    parser.add_argument('--complexity', default='regex', choices=['literal', 'anchored', 'regex', 'complex'],
+                        help='complexity of the patterns')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated config')
+    args = parser.parse_args(args)
+
+    per_node = measure_memory(args.size, args.fan_out, args.filters, args.complexity, args.seed)
+    print(f'{per_node:.0f} bytes per node')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Times the hot paths of lefci on generated configs and compares the results with a stored baseline.
+
+    python -m benchmarks.run --sizes 100 1000 10000 --output results.json
+    python -m benchmarks.run --update-baseline
+
+Baselines depend on the machine, store one per machine the comparison runs on.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from lefci import deploy
+from lefci.model import ApiConfig, JsonStore, State
+from lefci.sqlite_store import SqliteStore
+
+from benchmarks.generator import generate_config
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def measure(function, repeat):
+    """
+    :return: median and minimum of the wall clock times in seconds
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'median': statistics.median(times), 'min': min(times), 'repeat': repeat}
+
+
+def benchmark_size(size, repeat, args, directory):
+    config = generate_config(size, args.depth, args.fan_out, args.filters, args.complexity, args.seed)
+    rng = random.Random(args.seed)
+    nodes = [config.find_tree(f'node-{index}') for index in range(size)]
+    sample = rng.sample(nodes, min(size, 100))
+    results = {}
+
+    examples = {node.id: node.example for node in sample}
+    edits = iter(range(sys.maxsize))
+
+    def verify_node():
+        # a new example, so the result matrix can't answer everything
+        node = rng.choice(sample)
+        edit = next(edits)
+        node.update_config(example={field: f'{value} {edit}' for field, value in examples[node.id].items()})
+        config.verify_node(node)
+
+    def find_tree():
+        for node in sample:
+            config.find_tree(node.id)
+
+    def render():
+        # a fresh render cache, so the config is rendered every time
+        ApiConfig.render_cache = tempfile.mkdtemp(dir=directory)
+        deploy.transform_config(config)
+
+    config.verify_node(sample[0])
+    results['verify_node'] = measure(verify_node, repeat)
+    results['find_tree'] = measure(find_tree, repeat)
+    results['encode'] = measure(config.encode, repeat)
+    results['to_json'] = measure(config.to_json, repeat)
+    results['transform_config'] = measure(render, repeat)
+
+    for store_name, store in [('json', JsonStore(os.path.join(directory, 'configs'))),
+                              ('sqlite', SqliteStore(os.path.join(directory, 'lefci.db')))]:
+        state = State(store)
+        results[f'save_config/{store_name}'] = measure(lambda: state.save_config(config), repeat)
+        results[f'load_config/{store_name}'] = measure(lambda: state.load_config(config.name), repeat)
+    return results
+
+
+def run(args):
+    results = {}
+    render_cache = ApiConfig.render_cache
+    directory = tempfile.mkdtemp(prefix='lefci-benchmark-')
+    try:
+        for size in args.sizes:
+            # large configs are timed less often, so a run over all sizes stays in minutes
+            repeat = args.repeat or max(3, min(50, 100000 // (size * 10)))
+            for name, result in benchmark_size(size, repeat, args, directory).items():
+                results[f'{name}/{size}'] = result
+                print(f"{name + '/' + str(size):<28} {result['median'] * 1000:>12.3f} ms", file=sys.stderr)
+    finally:
+        ApiConfig.render_cache = render_cache
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+            'arguments': {'depth': args.depth, 'fan_out': args.fan_out, 'filters': args.filters,
+                          'complexity': args.complexity, 'seed': args.seed},
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    :param threshold: allowed slowdown of the median, 0.25 allows 25 % more time
+    :type threshold: float
+    :return: benchmarks slower than the baseline allows, with the ratio of their medians
+    :rtype: dict
+    """
+    regressions = {}
+    for name, result in results['results'].items():
+        reference = baseline['results'].get(name)
+        if reference and reference['median'] > 0:
+            ratio = result['median'] / reference['median']
+            if ratio > 1 + threshold:
+                regressions[name] = ratio
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks lefci on generated configs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000], help='numbers of nodes')
+    parser.add_argument('--depth', type=int, default=None, help='maximum depth of the trees')
+    parser.add_argument('--fan-out', type=int, default=4, help='children per node')
+    parser.add_argument('--filters', type=int, default=2, help='filters per node')
+    parser.add_argument('--complexity', default='regex', choices=['literal', 'anchored', 'regex', 'complex'],
+                        help='complexity of the patterns')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated configs')
+    parser.add_argument('--repeat', type=int, default=None, help='repetitions per benchmark')
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--baseline', default=BASELINE, help='results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown against the baseline')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as baseline')
+    args = parser.parse_args(args)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        return 0
+    if not os.path.isfile(args.baseline):
+        return 0
+
+    with open(args.baseline, 'r') as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.threshold)
+    for name, ratio in sorted(regressions.items()):
+        print(f'{name} is {ratio:.2f} times slower than the baseline', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
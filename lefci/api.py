@@ -1,11 +1,63 @@
+import os
+import time
+import zlib
+
+from contextlib import ExitStack
+from functools import wraps
 from http import HTTPStatus
+from tempfile import NamedTemporaryFile
+from flask import Response, g, send_file, stream_with_context
 from flask_restful import Api, Resource, request
 
-from lefci import app, model
-from lefci.deploy import deploy
+from lefci import app, metrics, model
+from lefci.deploy import render_config
+from lefci.jobs import Job, JobQueue
+from lefci.replay import Simulator, parse_line, read_lines
+from lefci.sqlite_store import SqliteStore
+from lefci.stats import StatsStore, collect_stats, map_counters, parse_stats
 
 api = Api(app)
-state = model.State()
+state = model.State(SqliteStore(model.ApiConfig.database) if model.ApiConfig.store == 'sqlite' else None)
+jobs = JobQueue()
+stats_store = StatsStore(model.ApiConfig.stats_path)
+metrics.flush_at_exit(model.ApiConfig.metrics_dir)
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    if 'request_start' in g:
+        metrics.observe('lefci_request_duration_seconds', time.perf_counter() - g.request_start,
+                        resource=request.endpoint or 'none', method=request.method)
+    # other workers see the values of this one once they are flushed
+    metrics.default_registry.flush(model.ApiConfig.metrics_dir, model.ApiConfig.metrics_flush_interval)
+    return response
+
+
+def locked(write=False):
+    """
+    Runs a handler of a config under State.lock, so requests don't change the cached config under each other.
+    Requests of configs, which aren't saved, are answered with 404 without a lock.
+    :param write: the handler changes and saves the config
+    :type write: bool
+    """
+    def decorator(method):
+        @wraps(method)
+        def handle(self, name=None, *args, **kwargs):
+            if name is None:
+                return method(self, name, *args, **kwargs)
+            with ExitStack() as stack:
+                try:
+                    stack.enter_context(state.lock(name, write))
+                except KeyError as e:
+                    return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+                return method(self, name, *args, **kwargs)
+        return handle
+    return decorator
 
 
 def create_report(message, status=model.Status.OK):
@@ -18,32 +70,154 @@ def error_report(message):
     return create_report(message, model.Status.ERROR)
 
 
+def get_flag(name):
+    return request.args.get(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+def get_int(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not value.isdigit():
+        raise ValueError(f'{name} must be a number of at least 0')
+    return int(value)
+
+
+def get_projection():
+    """
+    Reads the depth, offset, limit and fields arguments of a tree fetch.
+    :return: the arguments of LogTree.project or None, if the whole trees are requested
+    :rtype: dict
+    :raises ValueError: if an argument is invalid
+    """
+    if not any(name in request.args for name in ('depth', 'offset', 'limit', 'fields')):
+        return None
+    fields = None
+    if 'fields' in request.args:
+        fields = [field for field in request.args['fields'].split(',') if field]
+        unknown = set(fields) - set(model.LogTree.projected_fields)
+        if unknown:
+            raise ValueError(f'Unknown fields {", ".join(sorted(unknown))}')
+    return {'fields': fields, 'depth': get_int('depth'), 'offset': get_int('offset', 0), 'limit': get_int('limit')}
+
+
+def get_etag_headers(name):
+    # weak, the gzip and the identity body of a version share the tag
+    # no-cache makes browsers revalidate with If-None-Match instead of using a stale copy
+    return {'ETag': f'W/"{state.get_version(name)}"', 'Cache-Control': 'no-cache'}
+
+
+def is_not_modified(name):
+    return request.if_none_match.contains_weak(state.get_version(name))
+
+
+def get_hits(name, data=None):
+    order = (data or {}).get('order_by_hits', get_flag('order_by_hits') or model.ApiConfig.order_by_hits)
+    return stats_store.get_hit_rates(name) if order else None
+
+
+def add_stats(tree, summary):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if 'id' in node:
+            node['stats'] = summary.get(node['id'])
+        stack += node.get('children', ())
+    return tree
+
+
+def stream_json(chunks, headers=None, name=None):
+    """
+    Sends JSON chunks as a chunked response, gzip compressed if the client accepts it.
+    :type chunks: iterable(str)
+    :type headers: dict
+    :param name: config the chunks are encoded from, it is locked while they are streamed
+    :type name: str
+    :rtype: Response
+    """
+    headers = dict(headers or {})
+    body = buffer_chunks(chunks if name is None else lock_chunks(name, chunks))
+    if model.ApiConfig.gzip_responses and 'gzip' in request.accept_encodings:
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+        body = gzip_chunks(body)
+    return Response(stream_with_context(body), headers=headers, mimetype='application/json')
+
+
+def lock_chunks(name, chunks):
+    # the handler released the lock when it returned, the config is encoded while the response is sent
+    # the cached config is still sent if it was deleted since
+    with state.lock(name, create=True):
+        yield from chunks
+
+
+def buffer_chunks(chunks):
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= model.ApiConfig.stream_chunk_size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 class Configs(Resource):
 
+    @locked()
     def get(self, name=None):
         if name:
-            return state.get_config(name).encode()
+            try:
+                config = state.get_config(name)
+            except Exception as e:
+                return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+            if is_not_modified(name):
+                return '', HTTPStatus.NOT_MODIFIED.value, get_etag_headers(name)
+            return stream_json(config.iter_json(), get_etag_headers(name), name)
         else:
             return state.saved_configs
 
     def post(self):
         config_raw = request.get_json()['config']
         try:
+            model.screen_trees(config_raw.get('log_trees') or ())
             config = model.Config(**config_raw)
-            state.save_config(config)
+            with state.lock(config.name, write=True, create=True):
+                state.save_config(config)
         except Exception as e:
             return error_report(str(e)), HTTPStatus.BAD_REQUEST.value
 
         return create_report('Current configuration saved'), HTTPStatus.OK.value
 
+    @locked()
     def put(self, name):
         try:
             config = state.get_config(name)
         except Exception as e:
             return error_report(str(e)), HTTPStatus.NOT_FOUND.value
-        data = request.get_json()
-        deploy(config, data['server'])
+        data = request.get_json() or {}
+        servers = data.get('server') or config.server
+        if isinstance(servers, str):
+            servers = [servers]
+        if not servers:
+            return error_report(f'No server to deploy {name} to'), HTTPStatus.BAD_REQUEST.value
+
+        job = jobs.submit(config, servers, data.get('timeout'), bool(data.get('force')), get_hits(name, data))
+        return {'job': job.id}, HTTPStatus.ACCEPTED.value, {'Location': f'/v1/jobs/{job.id}'}
 
+    @locked(write=True)
     def delete(self, name):
         try:
             state.delete_config(name)
@@ -55,18 +229,43 @@ class Configs(Resource):
 
 class Trees(Resource):
 
+    @locked()
     def get(self, name, uuid=None):
         try:
             config = state.get_config(name)
         except Exception as e:
             return error_report(str(e)), HTTPStatus.NOT_FOUND.value
 
+        try:
+            projection = get_projection()
+        except ValueError as e:
+            return error_report(str(e)), HTTPStatus.BAD_REQUEST.value
+        if is_not_modified(name):
+            return '', HTTPStatus.NOT_MODIFIED.value, get_etag_headers(name)
+        tree = None
         if uuid:
             tree = config.find_tree(uuid)
-            return tree.encode(), HTTPStatus.OK.value
+            if not tree:
+                return error_report(f'No node with {uuid} found!'), HTTPStatus.NOT_FOUND.value
+        if projection is not None:
+            encoded = tree.project(**projection) if tree else model.project_trees(config.log_trees, **projection)
+        if get_flag('stats'):
+            # hit counters change without the config, so they are neither streamed nor cached
+            summary = stats_store.get_summary(name)
+            if projection is None:
+                encoded = tree.encode() if tree else [node.encode() for node in config.log_trees]
+            trees = [encoded] if tree else encoded
+            for node in trees:
+                add_stats(node, summary)
+            return encoded, HTTPStatus.OK.value
+        if projection is not None:
+            return stream_json(model.compact_encoder.iterencode(encoded), get_etag_headers(name))
+        if tree:
+            return stream_json(tree.iter_json(), get_etag_headers(name), name)
         else:
-            return [tree.encode() for tree in config.log_trees]
+            return stream_json(model.iter_json_list(config.log_trees), get_etag_headers(name), name)
 
+    @locked(write=True)
     def put(self, name, uuid):
         try:
             config = state.get_config(name)
@@ -76,12 +275,20 @@ class Trees(Resource):
         node = config.find_tree(uuid)
         if node:
             data = request.get_json()
-            node.update_config(**data)
-            verify_reports = config.verify_node(node)
+            if data.get('id', uuid) != uuid and config.find_tree(data['id']):
+                return error_report(f'Node id {data["id"]} is already used'), HTTPStatus.BAD_REQUEST.value
+            try:
+                model.screen_trees([data])
+                node.update_config(**data)
+            except (model.FilterException, model.SampleException) as e:
+                return error_report(str(e)), HTTPStatus.BAD_REQUEST.value
+            verify_reports = config.verify_node(node, delta=get_flag('delta'))
+            state.save_node(config, node, subtree='children' in data, previous_id=uuid)
             return verify_reports.encode(), HTTPStatus.OK.value
         else:
             return error_report(f'No node with {uuid} found!'), HTTPStatus.NOT_FOUND.value
 
+    @locked(write=True)
     def post(self, name, uuid=None):
         try:
             config = state.get_config(name)
@@ -89,15 +296,50 @@ class Trees(Resource):
             return error_report(str(e)), HTTPStatus.NOT_FOUND.value
 
         parent = config.find_tree(uuid)
-        child = model.LogTree(parent=parent, **request.get_json())
+        try:
+            model.screen_trees([request.get_json()])
+            child = model.LogTree(parent=parent, **request.get_json())
+        except (model.FilterException, model.SampleException) as e:
+            return error_report(str(e)), HTTPStatus.BAD_REQUEST.value
+        nodes = [child]
+        while nodes:
+            node = nodes.pop()
+            if config.find_tree(node.id):
+                return error_report(f'Node id {node.id} is already used'), HTTPStatus.BAD_REQUEST.value
+            nodes += node.children
         if parent:
             parent.add_tree(child)
         else:
             config.add_tree(child)
-        verify_reports = config.verify_node(child)
-        state.save_config(config)
+        verify_reports = config.verify_node(child, delta=get_flag('delta'))
+        state.save_node(config, child)
         return verify_reports.encode(), HTTPStatus.OK.value
 
+    @locked(write=True)
+    def patch(self, name, uuid=None):
+        try:
+            config = state.get_config(name)
+        except Exception as e:
+            return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+        if uuid:
+            return error_report('Operations are applied to the trees of a config'), HTTPStatus.METHOD_NOT_ALLOWED.value
+
+        operations = (request.get_json() or {}).get('operations')
+        if not isinstance(operations, list):
+            return error_report('A list of operations is required'), HTTPStatus.BAD_REQUEST.value
+        try:
+            changes = config.apply_operations(operations)
+        except model.OperationException as e:
+            return error_report(str(e)), HTTPStatus.BAD_REQUEST.value
+
+        state.save_changes(config, changes)
+        delta = get_flag('delta')
+        verify_reports = model.ReportBySource()
+        for node in changes.get_affected_nodes(config):
+            verify_reports += config.verify_node(node, delta=delta)
+        return {'created': changes.created, 'reports': verify_reports.encode()}, HTTPStatus.OK.value
+
+    @locked(write=True)
     def delete(self, name, uuid):
         try:
             config = state.get_config(name)
@@ -111,14 +353,182 @@ class Trees(Resource):
         parent = tree.parent
         if parent:
             parent.remove_tree(tree)
-            state.save_config(config)
+            state.delete_node(config, tree)
             return create_report(f'Removed tree {uuid} from {parent.id}'), HTTPStatus.OK.value
         else:
             config.remove_tree(tree)
-            state.save_config(config)
+            state.delete_node(config, tree)
             return create_report(f'Removed tree {uuid} from config'), HTTPStatus.OK.value
 
 
+class Verify(Resource):
+
+    @locked()
+    def get(self, name):
+        try:
+            config = state.get_config(name)
+        except Exception as e:
+            return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+
+        reports = config.verify_all(fail_fast=get_flag('fail_fast'))
+        if get_flag('summary'):
+            status = reports.get_highest_status_code()
+            summary = {
+                'status': model.Status(status).name if status else None,
+                'counts': reports.count_status_codes(),
+            }
+            return summary, HTTPStatus.OK.value
+        return reports.encode(), HTTPStatus.OK.value
+
+
+class Preview(Resource):
+
+    @locked()
+    def get(self, name):
+        try:
+            config = state.get_config(name)
+        except Exception as e:
+            return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+
+        # the cached render is named by its content hash, which makes it a strong ETag
+        filepath = render_config(config, get_hits(name))
+        digest = os.path.splitext(os.path.basename(filepath))[0]
+        return send_file(filepath, mimetype='text/plain', conditional=True, etag=digest)
+
+
+class Jobs(Resource):
+
+    def get(self, job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return error_report(f'No job {job_id} found'), HTTPStatus.NOT_FOUND.value
+        if isinstance(job, Job):
+            return job.encode(), HTTPStatus.OK.value
+        job.pop('events')
+        return job, HTTPStatus.OK.value
+
+
+class JobEvents(Resource):
+
+    def get(self, job_id):
+        if jobs.get(job_id) is None:
+            return error_report(f'No job {job_id} found'), HTTPStatus.NOT_FOUND.value
+
+        def stream_events():
+            for event in jobs.iter_events(job_id):
+                if event is None:
+                    # comments keep proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'data: {model.compact_encoder.encode(event)}\n\n'
+            yield 'event: done\ndata: {}\n\n'
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(stream_events()), headers=headers, mimetype='text/event-stream')
+
+
+class Stats(Resource):
+
+    def get(self, name):
+        return stats_store.get_summary(name), HTTPStatus.OK.value
+
+    def post(self, name):
+        try:
+            with state.lock(name):
+                # a copy, so reading the counters doesn't hold up the requests changing the config
+                config = model.Config(**state.get_config(name).encode())
+        except Exception as e:
+            return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+
+        if 'stats' in request.files:
+            server = request.form.get('server')
+            if not server:
+                return error_report('No server given for the stats'), HTTPStatus.BAD_REQUEST.value
+            text = request.files['stats'].read().decode('utf-8', 'replace')
+            hits = map_counters(config, parse_stats(text))
+            stats_store.add_sample(name, server, hits)
+            return create_report(f'Imported the counters of {len(hits)} nodes from {server}'), HTTPStatus.OK.value
+
+        data = request.get_json(silent=True) or {}
+        servers = data.get('server') or config.server
+        if isinstance(servers, str):
+            servers = [servers]
+        if not servers:
+            return error_report(f'No server to read the stats of {name} from'), HTTPStatus.BAD_REQUEST.value
+        return collect_stats(config, stats_store, servers, data.get('timeout')).encode(), HTTPStatus.OK.value
+
+
+class Metrics(Resource):
+
+    def get(self):
+        text = metrics.collect(model.ApiConfig.metrics_dir)
+        return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+class Replay(Resource):
+
+    def post(self, name):
+        try:
+            with state.lock(name):
+                # a copy, so the replay doesn't hold up the requests changing the config
+                config = model.Config(**state.get_config(name).encode())
+        except Exception as e:
+            return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+
+        if 'log' not in request.files:
+            return error_report('No log file uploaded'), HTTPStatus.BAD_REQUEST.value
+
+        # the upload is spooled to disk, so it can be replayed through a memory map
+        with NamedTemporaryFile(prefix='lefci-replay-') as log_file:
+            request.files['log'].save(log_file)
+            log_file.flush()
+            result = Simulator(config).replay_file(log_file.name)
+        return result.encode(), HTTPStatus.OK.value
+
+
+class Samples(Resource):
+
+    @locked(write=True)
+    def post(self, name, uuid):
+        try:
+            config = state.get_config(name)
+        except Exception as e:
+            return error_report(str(e)), HTTPStatus.NOT_FOUND.value
+
+        node = config.find_tree(uuid)
+        if not node:
+            return error_report(f'No node with {uuid} found!'), HTTPStatus.NOT_FOUND.value
+        if 'log' not in request.files:
+            return error_report('No log file uploaded'), HTTPStatus.BAD_REQUEST.value
+
+        append = get_flag('append')
+        size = model.ApiConfig.max_samples - (len(node.samples) if append else 0)
+        records = []
+        # the upload is spooled to disk, so it can be read through a memory map
+        with NamedTemporaryFile(prefix='lefci-samples-') as log_file:
+            request.files['log'].save(log_file)
+            log_file.flush()
+            for line in read_lines(log_file.name):
+                if len(records) >= size:
+                    break
+                records.append(parse_line(line))
+        try:
+            samples = model.Samples.from_records(records)
+            node.update_config(samples=(node.samples.concat(samples) if append else samples).encode())
+        except model.SampleException as e:
+            return error_report(str(e)), HTTPStatus.BAD_REQUEST.value
+        state.save_node(config, node, subtree=False)
+        return config.verify_node(node).encode(), HTTPStatus.OK.value
+
+
 api.add_resource(Configs, '/v1/configs', '/v1/configs/<string:name>')
 api.add_resource(Trees, '/v1/configs/<string:name>/trees', '/v1/configs/<string:name>/trees/<string:uuid>')
+api.add_resource(Samples, '/v1/configs/<string:name>/trees/<string:uuid>/samples')
+api.add_resource(Verify, '/v1/configs/<string:name>/verify')
+api.add_resource(Preview, '/v1/configs/<string:name>/preview')
+api.add_resource(Stats, '/v1/configs/<string:name>/stats')
+api.add_resource(Replay, '/v1/configs/<string:name>/replay')
+api.add_resource(Jobs, '/v1/jobs/<string:job_id>')
+api.add_resource(JobEvents, '/v1/jobs/<string:job_id>/events')
+api.add_resource(Metrics, '/v1/metrics')
 
@@ -1,7 +1,22 @@
+import abc
+import difflib
+import hashlib
+import shlex
+import shutil
 import subprocess
 import os
+import signal
+import tempfile
+import threading
+import time
 import jinja2
 
+from concurrent.futures import ThreadPoolExecutor
+
+from lefci import metrics
+from lefci.model import ApiConfig, Report, ReportBySource, Status, compact_encoder
+from lefci.optimize import create_plan, render_expression
+
 
 class CommandException(Exception):
     def __init__(self, *args, **kwargs):
@@ -13,57 +28,368 @@ class ConfigException(CommandException):
         CommandException.__init__(self, *args, **kwargs)
 
 
+module_path = os.path.dirname(__file__)
+template_environment = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(searchpath=os.path.join(module_path, 'templates')),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+)
+template_environment.filters['expression'] = render_expression
+
+
+def get_render_path(config, hits=None):
+    """
+    Returns the path of the rendered syslog-ng config in the render cache, the file name is the SHA-256 of the
+    encoded config, so the path changes with every change of the config.
+    :param hits: messages per node id to order the log paths by
+    :type hits: dict
+    :rtype: str
+    """
+    order = None
+    if hits:
+        # only the order matters, changing rates don't invalidate the render as long as the order stays
+        order = sorted((uuid for uuid in hits if hits[uuid] and config.find_tree(uuid)), key=lambda uuid: -hits[uuid])
+    # hashed chunk by chunk, like the compact JSON of config.encode() but without the encoded dictionaries
+    digest = hashlib.sha256()
+    for chunk in config.iter_json():
+        digest.update(chunk.encode())
+    digest.update(compact_encoder.encode([ApiConfig.optimize_filters, order]).encode())
+    return os.path.join(ApiConfig.render_cache, f'{digest.hexdigest()}.conf')
+
+
+def render_config(config, hits=None):
+    """
+    Renders a config into the render cache unless an unchanged config was rendered before. The template is streamed
+    into a temporary file, which replaces the cached file once it's complete, so readers never see a partial render.
+    :param hits: messages per node id to order the log paths by, see create_plan
+    :type hits: dict
+    :return: path of the rendered syslog-ng config
+    :rtype: str
+    """
+    filepath = get_render_path(config, hits)
+    try:
+        # the access time isn't reliable, the modification time marks the last use for pruning
+        os.utime(filepath)
+        return filepath
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(ApiConfig.render_cache, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=ApiConfig.render_cache, prefix='.', suffix='.tmp',
+                                     delete=False) as syslog_file:
+        try:
+            plan = create_plan(config, ApiConfig.optimize_filters, hits)
+            template = template_environment.get_template('syslog-ng.conf.jinja')
+            for chunk in template.generate(filters=plan.filters.items(), log_paths=plan.log_paths):
+                syslog_file.write(chunk)
+        except BaseException:
+            os.unlink(syslog_file.name)
+            raise
+    os.replace(syslog_file.name, filepath)
+    prune_render_cache()
+    return filepath
+
+
+def prune_render_cache():
+    renders = []
+    with os.scandir(ApiConfig.render_cache) as entries:
+        for entry in entries:
+            if entry.name.endswith('.conf'):
+                renders.append((entry.stat().st_mtime, entry.path))
+    renders.sort(reverse=True)
+    for _, filepath in renders[ApiConfig.render_cache_size:]:
+        try:
+            os.unlink(filepath)
+        except FileNotFoundError:
+            # pruned by another worker
+            pass
+
+
 def transform_config(config):
-    module_path = os.path.dirname(__file__)
-    template_path = os.path.join(module_path, 'templates')
-    template_loader = jinja2.FileSystemLoader(searchpath=template_path)
-    template_environment = jinja2.Environment(loader=template_loader)
-    template = template_environment.get_template('syslog-ng.conf.jinja')
-    return template.render(config.encode())
+    with open(render_config(config), 'r') as syslog_file:
+        return syslog_file.read()
 
 
 def create_syslog_config(config, filepath):
-    syslog_config = transform_config(config)
-    with open(filepath, 'w') as syslog_file:
-        syslog_file.write(syslog_config)
-
-
-def run_command(command, shell=False):
-    proc = subprocess.run(command,
-                          shell=shell,
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE,
-                          universal_newlines=True,
-                          preexec_fn=os.setsid,
-                          )
-    output = proc.stdout
+    shutil.copyfile(render_config(config), filepath)
+
+
+def run_command(command, shell=False, timeout=None, input=None, cwd=None, env=None):
+    with metrics.timer('lefci_command_duration_seconds', program='shell' if shell else os.path.basename(command[0])):
+        return _run_command(command, shell, timeout, input, cwd, env)
+
+
+def _run_command(command, shell, timeout, input, cwd, env):
+    proc = subprocess.Popen(command,
+                            shell=shell,
+                            stdin=subprocess.PIPE if input is not None else None,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            preexec_fn=os.setsid,
+                            cwd=cwd,
+                            env=env,
+                            )
+    try:
+        output, error = proc.communicate(input, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # the command runs in its own session, kill the whole group including children of a shell
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.communicate()
+        raise CommandException(f'Command timed out after {timeout} seconds')
     if proc.returncode != 0:
-        output = f'{output}\n{proc.stderr}'
+        output = f'{output}\n{error}'
         raise CommandException(output)
     return output
 
 
-def ssh(command, server, key_file='/home/syslog-admin/.ssh/deploy_key', user='syslog-admin'):
-    ssh_command = [f"ssh -i {key_file} -o StrictHostKeyChecking=no {user}@{server} '{command}'"]
-    return run_command(ssh_command, shell=True)
+def get_remaining(deadline):
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise CommandException('Deployment timed out')
+    return remaining
+
+
+class Transport(abc.ABC):
+    """
+    Runs shell scripts on a syslog-ng server.
+    """
+
+    @abc.abstractmethod
+    def run(self, script, input=None, timeout=None):
+        """
+        Runs a script in one session on the server.
+        :param script: shell script
+        :type script: str
+        :param input: data passed to the standard input of the script
+        :type input: str
+        :param timeout: seconds until the session is killed
+        :type timeout: float
+        :return: standard output of the script
+        :rtype: str
+        """
+
+    def send_file(self, filepath, timeout=None):
+        with open(filepath, 'r') as file:
+            content = file.read()
+        return self.run(f'cat > {shlex.quote(os.path.basename(filepath))}', content, timeout)
+
+    def close(self):
+        pass
+
+
+class SshTransport(Transport):
+    """
+    OpenSSH connection to one server. Sessions are multiplexed over a master connection, which is kept alive between
+    deployments for ApiConfig.ssh_persist seconds, so only the first session pays for the handshake.
+    """
+
+    def __init__(self, server, key_file=None, user=None):
+        self.server = server
+        self.key_file = key_file or ApiConfig.ssh_key_file
+        self.user = user or ApiConfig.ssh_user
+        control_path = os.path.join(tempfile.gettempdir(), 'lefci-ssh')
+        os.makedirs(control_path, mode=0o700, exist_ok=True)
+        self.options = [
+            '-i', self.key_file,
+            '-o', 'StrictHostKeyChecking=no',
+            '-o', 'BatchMode=yes',
+            '-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={os.path.join(control_path, "%C")}',
+            '-o', f'ControlPersist={ApiConfig.ssh_persist}',
+        ]
+
+    def run(self, script, input=None, timeout=None):
+        return run_command(['ssh'] + self.options + [f'{self.user}@{self.server}', script], input=input,
+                           timeout=timeout)
+
+    def close(self):
+        try:
+            run_command(['ssh'] + self.options + ['-O', 'exit', f'{self.user}@{self.server}'], timeout=10)
+        except CommandException:
+            # no master connection running
+            pass
+
 
+class LocalTransport(Transport):
+    """
+    Runs the scripts with sh in a local directory, a stand-in for a server in tests and dry runs.
+    """
 
-def send_file(filepath, server, key_file='/home/syslog-admin/.ssh/deploy_key', user='syslog-admin'):
-    command = f"/usr/bin/scp -i {key_file} -o StrictHostKeyChecking=no '{filepath}' {user}@{server}:"
-    return run_command(command, shell=True)
+    def __init__(self, directory, env=None):
+        self.directory = directory
+        self.env = env
 
+    def run(self, script, input=None, timeout=None):
+        return run_command(['sh', '-c', script], input=input, timeout=timeout, cwd=self.directory, env=self.env)
 
-def deploy_config(filepath, server, key_file='/home/syslog-admin/.ssh/deploy_key'):
-    file_name = os.path.basename(filepath)
-    send_file(filepath, server, key_file)
-    ssh(f'syslog-ng -f {file_name} -s', server, key_file)
-    ssh('mv running-config.conf running-config.conf.bak', server, key_file)
-    ssh(f'mv {file_name} running-config.conf', server, key_file)
-    ssh('sudo systemctl restart syslog-ng.service', server, key_file)
+
+transports = {}
+transports_lock = threading.Lock()
+
+
+def get_transport(server, key_file=None, user=None):
+    """
+    Returns the pooled transport of a server, every server has one connection, which is shared by all deployments.
+    :rtype: Transport
+    """
+    key = (server, key_file, user)
+    with transports_lock:
+        if key not in transports:
+            transports[key] = SshTransport(server, key_file, user)
+        return transports[key]
+
+
+def close_transports():
+    with transports_lock:
+        for transport in transports.values():
+            transport.close()
+        transports.clear()
+
+
+def ssh(command, server, key_file=None, user=None, timeout=None):
+    return get_transport(server, key_file, user).run(command, timeout=timeout)
+
+
+def send_file(filepath, server, key_file=None, user=None, timeout=None):
+    return get_transport(server, key_file, user).send_file(filepath, timeout)
+
+
+def get_check_script(checksum):
+    return '\n'.join([
+        '[ -e running-config.conf ] || { echo missing; exit 0; }',
+        f'if [ "$(sha256sum < running-config.conf)" = "{checksum}  -" ]; then echo unchanged; exit 0; fi',
+        'echo changed',
+        'cat running-config.conf',
+    ])
+
+
+def get_deploy_script(file_name, restart=True):
+    file_name = shlex.quote(file_name)
+    return '\n'.join([
+        'set -e',
+        f'cat > {file_name}',
+        f'syslog-ng -f {file_name} -s',
+        '[ ! -e running-config.conf ] || mv running-config.conf running-config.conf.bak',
+        f'mv {file_name} running-config.conf',
+        f'sudo systemctl {"restart" if restart else "reload"} syslog-ng.service',
+    ])
+
+
+def get_global_lines(syslog_config):
+    # everything up to the first filter, the rendered filters, destinations and log paths can be reloaded in place
+    lines = []
+    for line in syslog_config.splitlines():
+        if line.startswith(('filter ', 'log')):
+            break
+        lines.append(line)
+    return lines
+
+
+def requires_restart(running_config, syslog_config):
+    """
+    Checks whether syslog-ng has to be restarted to apply a config. A reload keeps the sources open and doesn't drop
+    messages, but doesn't apply changes to the version, includes, options or sources.
+    :param running_config: config running on the server, None if there is none
+    :type running_config: str
+    :type syslog_config: str
+    :rtype: bool
+    """
+    return running_config is None or get_global_lines(running_config) != get_global_lines(syslog_config)
+
+
+def deploy_config(filepath, server, key_file=None, timeout=None, transport=None, force=False, progress=None):
+    """
+    Deploys a syslog-ng config unless the server already runs it. The new config is uploaded, checked, swapped with
+    the running config and applied by a reload or, if required, a restart of syslog-ng in one session on the server.
+    :param transport: transport to the server, defaults to the pooled SSH connection
+    :type transport: Transport
+    :param force: deploy and restart even if the server runs the same config
+    :type force: bool
+    :param progress: called with the name of each step when it starts, 'check' and 'apply'
+    :type progress: callable
+    :return: 'unchanged', 'reloaded' or 'restarted' and the unified diff to the running config
+    :rtype: tuple(str, str)
+    """
+    transport = transport or get_transport(server, key_file)
+    progress = progress or (lambda step: None)
+    deadline = time.monotonic() + timeout if timeout else None
+    with open(filepath, 'r') as file:
+        syslog_config = file.read()
+
+    running_config = None
+    if not force:
+        progress('check')
+        checksum = hashlib.sha256(syslog_config.encode()).hexdigest()
+        with metrics.timer('lefci_deploy_step_duration_seconds', server=server, step='check'):
+            output = transport.run(get_check_script(checksum), timeout=get_remaining(deadline))
+        state, _, running_config = output.partition('\n')
+        if state == 'unchanged':
+            return 'unchanged', ''
+        if state == 'missing':
+            running_config = None
+
+    restart = force or requires_restart(running_config, syslog_config)
+    progress('apply')
+    with metrics.timer('lefci_deploy_step_duration_seconds', server=server, step='apply'):
+        transport.run(get_deploy_script(os.path.basename(filepath), restart), syslog_config, get_remaining(deadline))
+    diff = ''.join(difflib.unified_diff((running_config or '').splitlines(keepends=True),
+                                        syslog_config.splitlines(keepends=True),
+                                        'running-config.conf', os.path.basename(filepath)))
+    return 'restarted' if restart else 'reloaded', diff
+
+
+def deploy_server(filepath, server, timeout=None, force=False, progress=None):
+    """
+    Deploys a syslog-ng config to a server and reports the outcome instead of raising.
+    :return: report of the deployment, an ERROR if it failed
+    :rtype: Report
+    """
+    # deployment reports are short, so successful steps are reported regardless of ApiConfig.report_level
+    report = Report(level=Status.OK)
+    try:
+        action, diff = deploy_config(filepath, server, timeout=timeout, force=force, progress=progress)
+    except CommandException as e:
+        report.add(f'Deployment to {server} failed: {e}', Status.ERROR)
+        return report
+    if action == 'unchanged':
+        report.add(f'{server} already runs this config, skipped')
+    else:
+        report.add(f'Deployed to {server}, syslog-ng {action}')
+        if diff:
+            report.add(diff)
+    return report
 
 
 def deploy(config, server):
-    file_name = 'deploy.conf'
-    file_path = os.path.join('/tmp', file_name)
-    create_syslog_config(config, file_path)
-    deploy_config(file_path, server)
+    deploy_config(render_config(config), server)
+
+
+def deploy_fleet(config, servers=None, max_workers=None, timeout=None, force=False):
+    """
+    Renders the config once and deploys it to all servers concurrently.
+    :param servers: servers to deploy to, defaults to the servers of the config
+    :type servers: list(str)
+    :param max_workers: number of concurrent deployments, defaults to ApiConfig.deploy_workers
+    :type max_workers: int
+    :param timeout: seconds a deployment to a single server may take, defaults to ApiConfig.deploy_timeout
+    :type timeout: float
+    :param force: deploy and restart even on servers running the same config
+    :type force: bool
+    :return: result of the deployment per server
+    :rtype: ReportBySource
+    """
+    servers = servers or config.server
+    max_workers = max_workers or ApiConfig.deploy_workers
+    timeout = timeout or ApiConfig.deploy_timeout
+    reports = ReportBySource()
+    if not servers:
+        return reports
+
+    file_path = render_config(config)
+    with ThreadPoolExecutor(min(max_workers, len(servers))) as executor:
+        futures = [executor.submit(deploy_server, file_path, server, timeout, force) for server in servers]
+        for server, future in zip(servers, futures):
+            reports.add(future.result(), server)
+    return reports
@@ -0,0 +1,232 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from uuid import uuid4
+
+from lefci import deploy
+from lefci.model import ApiConfig, Config, Report, ReportBySource, Status, compact_encoder
+
+
+class Job:
+    """
+    Deployment of a config to servers in the background. Progress is recorded as events for streaming and every change
+    is written as snapshot to ApiConfig.job_dir, so workers which don't run the job can still answer for it.
+    """
+
+    def __init__(self, config_name, servers, path=None):
+        self.id = uuid4().hex
+        self.config_name = config_name
+        self.path = path or ApiConfig.job_dir
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished = None
+        self.servers = OrderedDict((server, {'status': 'queued', 'steps': []}) for server in servers)
+        self.reports = ReportBySource()
+        self.events = []
+        self._condition = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def start_step(self, server, step):
+        """
+        Finishes the current step of a server and starts the next one.
+        :type server: str
+        :param step: 'render', 'lock', 'check' or 'apply'
+        :type step: str
+        """
+        with self._condition:
+            self.status = 'running'
+            self._finish_step(server)
+            self.servers[server]['status'] = 'running'
+            self.servers[server]['steps'].append({'step': step, 'started': time.time(), 'duration': None})
+            self._emit({'server': server, 'step': step, 'status': 'running'})
+
+    def finish_server(self, server, report):
+        with self._condition:
+            self._finish_step(server)
+            status = 'failed' if report.get_highest_status_code() == Status.ERROR else 'done'
+            self.servers[server]['status'] = status
+            self.reports.add(report, server)
+            self._emit({'server': server, 'status': status, 'report': report.encode()})
+            if all(server['status'] in ('done', 'failed') for server in self.servers.values()):
+                failed = any(server['status'] == 'failed' for server in self.servers.values())
+                self.status = 'failed' if failed else 'done'
+                self.finished = time.time()
+                self._emit({'status': self.status})
+
+    def wait_events(self, start, timeout=None):
+        """
+        Waits for events after the given position.
+        :param start: number of events already seen
+        :type start: int
+        :param timeout: seconds to wait for new events
+        :type timeout: float
+        :return: new events and whether the job is done
+        :rtype: tuple(list(dict), bool)
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.events) > start or self.done, timeout)
+            return self.events[start:], self.done
+
+    def encode(self):
+        return {
+            'id': self.id,
+            'config': self.config_name,
+            'status': self.status,
+            'created': self.created,
+            'finished': self.finished,
+            'servers': [dict(server=server, **state) for server, state in self.servers.items()],
+            'reports': self.reports.encode(),
+        }
+
+    def _finish_step(self, server):
+        steps = self.servers[server]['steps']
+        if steps and steps[-1]['duration'] is None:
+            steps[-1]['duration'] = time.time() - steps[-1]['started']
+
+    def _emit(self, event):
+        event['time'] = time.time()
+        self.events.append(event)
+        self.save()
+        self._condition.notify_all()
+
+    def save(self):
+        # the threads of a job share the temporary file, so snapshots are written one at a time
+        with self._condition:
+            os.makedirs(self.path, exist_ok=True)
+            filepath = os.path.join(self.path, f'{self.id}.json')
+            tmp_filepath = os.path.join(self.path, f'.{self.id}.{os.getpid()}.tmp')
+            with open(tmp_filepath, 'w') as job_file:
+                job_file.write(compact_encoder.encode(dict(self.encode(), events=self.events)))
+            os.replace(tmp_filepath, filepath)
+
+
+class JobQueue:
+    """
+    Runs deployments on a bounded pool of threads. Deployments to the same server are serialized by a lock file, which
+    also holds across worker processes, so two jobs never race on the running config of a server.
+    """
+
+    def __init__(self, max_workers=None, path=None):
+        self.max_workers = max_workers or ApiConfig.deploy_workers
+        self.path = path or ApiConfig.job_dir
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, config, servers, timeout=None, force=False, hits=None):
+        """
+        Queues the deployment of a config and returns right away.
+        :type config: Config
+        :type servers: list(str)
+        :param timeout: seconds a deployment to a single server may take once it holds the server
+        :type timeout: float
+        :type force: bool
+        :param hits: messages per node id to order the log paths by
+        :type hits: dict
+        :rtype: Job
+        """
+        job = Job(config.name, servers, self.path)
+        # the job renders a copy, later changes to the config don't leak into a queued deployment
+        config = Config(**config.encode())
+        render_lock = threading.Lock()
+        with self._lock:
+            if self._executor is None:
+                # created on first use, so forked workers don't inherit a pool
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='lefci-deploy')
+            self.jobs[job.id] = job
+            self._prune()
+            for server in servers:
+                self._executor.submit(self._run, job, config, server, render_lock, timeout, force, hits)
+        job.save()
+        return job
+
+    def get(self, job_id):
+        """
+        Returns a job of this process or the last snapshot of a job of another worker.
+        :rtype: Job or dict
+        """
+        job = self.jobs.get(job_id)
+        if job:
+            return job
+        try:
+            with open(os.path.join(self.path, f'{os.path.basename(job_id)}.json'), 'r') as job_file:
+                return json.load(job_file)
+        except FileNotFoundError:
+            return None
+
+    def iter_events(self, job_id):
+        """
+        Yields the events of a job until it's done. None is yielded after ApiConfig.event_keepalive seconds without
+        an event.
+        :rtype: generator(dict)
+        """
+        start = 0
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if isinstance(job, Job):
+                events, done = job.wait_events(start, ApiConfig.event_keepalive)
+            else:
+                events, done = self._poll_events(job_id, start)
+            yield from events
+            start += len(events)
+            if done:
+                return
+            if not events:
+                yield None
+
+    def _poll_events(self, job_id, start):
+        # jobs of other workers are followed through their snapshots
+        deadline = time.monotonic() + ApiConfig.event_keepalive
+        while True:
+            job = self.get(job_id) or {'events': [], 'status': 'failed'}
+            events = job['events'][start:]
+            done = job['status'] in ('done', 'failed')
+            if events or done or time.monotonic() > deadline:
+                return events, done
+            time.sleep(0.5)
+
+    @contextmanager
+    def lock_server(self, server):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, f'.{server.replace(os.sep, "_")}.lock'), 'w') as lock_file:
+            # flock locks belong to the open file, so they serialize threads as well as processes
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _run(self, job, config, server, render_lock, timeout, force, hits):
+        try:
+            job.start_step(server, 'render')
+            with render_lock:
+                filepath = deploy.render_config(config, hits)
+            job.start_step(server, 'lock')
+            with self.lock_server(server):
+                report = deploy.deploy_server(filepath, server, timeout or ApiConfig.deploy_timeout, force,
+                                              lambda step: job.start_step(server, step))
+        except Exception as e:
+            report = Report(f'Deployment to {server} failed: {e}', Status.ERROR)
+        job.finish_server(server, report)
+
+    def _prune(self):
+        while len(self.jobs) > ApiConfig.job_history:
+            job_id, job = next(iter(self.jobs.items()))
+            if not job.done:
+                break
+            del self.jobs[job_id]
+            try:
+                os.unlink(os.path.join(self.path, f'{job_id}.json'))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,215 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from uuid import uuid4
+
+DURATION_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(10))
+
+# name: type, help and buckets of histograms
+METRICS = {
+    'lefci_request_duration_seconds': ('histogram', 'Duration of API requests', DURATION_BUCKETS),
+    'lefci_verify_node_duration_seconds': ('histogram', 'Duration of Config.verify_node', DURATION_BUCKETS),
+    'lefci_regex_evaluations_total': ('counter', 'Filter patterns evaluated on example and sample values', None),
+    'lefci_regex_timeouts_total': ('counter', 'Filter patterns which ran out of their time budget', None),
+    'lefci_state_cache_total': ('counter', 'Lookups of configs in the State cache', None),
+    'lefci_state_load_duration_seconds': ('histogram', 'Duration of loading configs from the store', DURATION_BUCKETS),
+    'lefci_save_config_duration_seconds': ('histogram', 'Duration of saving whole configs', DURATION_BUCKETS),
+    'lefci_save_config_bytes': ('histogram', 'Bytes written by saving whole configs', SIZE_BUCKETS),
+    'lefci_command_duration_seconds': ('histogram', 'Duration of commands run by deployments', DURATION_BUCKETS),
+    'lefci_deploy_step_duration_seconds': ('histogram', 'Duration of deployment steps', DURATION_BUCKETS),
+}
+
+
+class Registry:
+    """
+    Counters and histograms of one process. Updates only touch a dictionary, the values are written to a file per
+    process at most every flush interval, and the files of all processes are merged when the metrics are collected.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.token = f'{os.getpid()}-{uuid4().hex}'
+        self.flushed = 0
+        self._lock = threading.Lock()
+        # the threads of the process share the file, so it is written by one at a time
+        self._flush_lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def counter(self, name, **labels):
+        """
+        Binds one series of a counter, so hot paths don't build its key on every update.
+        :return: function incrementing the series by its argument, 1 by default
+        :rtype: function
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        def inc(value=1):
+            with self._lock:
+                self.values[key] = self.values.get(key, 0) + value
+        return inc
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRICS[name][2]
+        with self._lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                # counts per bucket, the sum and the count of all observations
+                histogram = self.values[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, dict(labels), list(value) if isinstance(value, list) else value]
+                    for (name, labels), value in self.values.items()]
+
+    def flush(self, path, interval=0):
+        """
+        Writes the values of this process for other processes to collect.
+        :param interval: seconds since the last flush before the values are written again
+        :type interval: float
+        """
+        with self._flush_lock:
+            now = time.monotonic()
+            if now - self.flushed < interval:
+                return
+            self.flushed = now
+            os.makedirs(path, exist_ok=True)
+            filepath = os.path.join(path, f'{self.token}.json')
+            with open(f'{filepath}.tmp', 'w') as metrics_file:
+                json.dump(self.snapshot(), metrics_file)
+            os.replace(f'{filepath}.tmp', filepath)
+
+
+def merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            key = (name, tuple(sorted(labels.items())))
+            if key not in merged:
+                merged[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                merged[key] = [total + part for total, part in zip(merged[key], value)]
+            else:
+                merged[key] += value
+    return merged
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_snapshots(path, registry):
+    """
+    Reads the values of all other processes. Values of processes which ended are folded into one file, so counters
+    don't go backwards and the directory doesn't grow with every restarted worker.
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        snapshots = {}
+        for file_name in os.listdir(path):
+            if file_name.endswith('.json') and file_name != f'{registry.token}.json':
+                try:
+                    with open(os.path.join(path, file_name), 'r') as metrics_file:
+                        snapshots[file_name] = json.load(metrics_file)
+                except (OSError, ValueError):
+                    # written by a process which ended while flushing
+                    continue
+
+        ended = [file_name for file_name in snapshots
+                 if file_name != 'ended.json' and not is_running(int(file_name.split('-')[0]))]
+        if ended:
+            archive = merge([snapshots.get('ended.json', [])] + [snapshots.pop(file_name) for file_name in ended])
+            snapshots['ended.json'] = [[name, dict(labels), value] for (name, labels), value in archive.items()]
+            archive_path = os.path.join(path, 'ended.json')
+            with open(f'{archive_path}.tmp', 'w') as metrics_file:
+                json.dump(snapshots['ended.json'], metrics_file)
+            os.replace(f'{archive_path}.tmp', archive_path)
+            for file_name in ended:
+                os.unlink(os.path.join(path, file_name))
+    return list(snapshots.values())
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                      for key, value in labels)
+    return f'{{{values}}}'
+
+
+def render(values):
+    """
+    Renders merged values in the Prometheus text format.
+    :type values: dict
+    :rtype: str
+    """
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {value[-1]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def collect(path, registry=None):
+    """
+    Merges the values of this process with the ones all other processes flushed to the directory.
+    :rtype: str
+    """
+    registry = registry or default_registry
+    return render(merge([registry.snapshot()] + read_snapshots(path, registry)))
+
+
+default_registry = Registry()
+inc = default_registry.inc
+counter = default_registry.counter
+observe = default_registry.observe
+timer = default_registry.timer
+
+
+def flush_at_exit(path):
+    atexit.register(default_registry.flush, path)
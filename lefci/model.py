@@ -1,12 +1,22 @@
+import fcntl
+import gc
 import json
 import os
 import re
+import sys
+import tempfile
+import threading
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
 from os.path import isfile, join
 from uuid import uuid4
 from enum import IntEnum
 
+from lefci import metrics, regex_guard
+
 
 class Status(IntEnum):
     OK = 1
@@ -18,46 +28,376 @@ class Status(IntEnum):
 Message = namedtuple('Message', ['message', 'status'])
 
 
+class FilterResult(namedtuple('FilterResult', ['check', 'pattern', 'value', 'status'])):
+    """
+    Result of testing a filter on an example, the message is only formatted when it is read, e.g. by Report.encode.
+    :param check: 'match' if the filter should hit the example, 'miss' if it shouldn't
+    """
+    __slots__ = ()
+    templates = {
+        ('match', Status.UNKNOWN): "No example given for filter '{pattern}'",
+        ('match', Status.OK): "Filter '{pattern}' matched example '{value}'",
+        ('match', Status.WARNING): "Filter '{pattern}' didn't match example '{value}'",
+        ('miss', Status.UNKNOWN): "Filter '{pattern}' did not hit any example",
+        ('miss', Status.OK): "Filter '{pattern}' did not hit example '{value}, everything is OK'",
+        ('miss', Status.WARNING): "Filter '{pattern}' hit example '<span class={span_class}>{value}</span>'",
+    }
+
+    @property
+    def message(self):
+        return self.templates[self.check, self.status].format(pattern=self.pattern, value=self.value,
+                                                              span_class=ApiConfig.filter_hit_span_class)
+
+
+class SampleResult(namedtuple('SampleResult', ['check', 'pattern', 'hits', 'total', 'failing', 'value', 'status'])):
+    """
+    Result of testing a filter on the samples of a node, see FilterResult.
+    :param hits: number of samples the filter hit
+    :param total: number of samples with a value of the field of the filter
+    :param failing: indices of the first samples, which failed the check
+    :param value: value of the first failing sample
+    """
+    __slots__ = ()
+    templates = {
+        ('match', Status.UNKNOWN): "No samples given for filter '{pattern}'",
+        ('match', Status.OK): "Filter '{pattern}' matched all {total} samples",
+        ('match', Status.WARNING): "Filter '{pattern}' matched {hits} of {total} samples ({rate:.0%}), e.g. it didn't "
+                                   "match '{value}'",
+        ('miss', Status.UNKNOWN): "Filter '{pattern}' did not hit any samples",
+        ('miss', Status.OK): "Filter '{pattern}' did not hit any of {total} samples, everything is OK",
+        ('miss', Status.WARNING): "Filter '{pattern}' hit {hits} of {total} samples ({rate:.0%}), e.g. "
+                                  "'<span class={span_class}>{value}</span>'",
+    }
+
+    @property
+    def rate(self):
+        return self.hits / self.total if self.total else None
+
+    @property
+    def message(self):
+        return self.templates[self.check, self.status].format(pattern=self.pattern, hits=self.hits, total=self.total,
+                                                              rate=self.rate, value=self.value,
+                                                              span_class=ApiConfig.filter_hit_span_class)
+
+
+compact_encoder = json.JSONEncoder(separators=(',', ':'))
+data_decoder = json.JSONDecoder()
+# evaluations of filter patterns by the code running them, bound once for the hot paths of the verification
+count_evaluations = {caller: metrics.counter('lefci_regex_evaluations_total', caller=caller)
+                     for caller in ('match_example', 'miss_example', 'classifier', 'matrix', 'samples')}
+
+
+class FilterException(Exception):
+    pass
+
+
+class OperationException(Exception):
+    pass
+
+
+class SampleException(Exception):
+    pass
+
+
 class ApiConfig:
     allowed_fields = ['message', 'host', 'program']
     filter_hit_span_class = 'filter_hit'
     report_level = Status.UNKNOWN
+    pattern_cache_size = 4096
+    data_cache_size = 16384
+    matrix_sweep_size = 100000
+    verify_processes = os.cpu_count()
+    parallel_verify_size = 500
+    store = os.environ.get('LEFCI_STORE', 'json')
+    database = os.environ.get('LEFCI_DATABASE', 'lefci.db')
+    gzip_responses = True
+    stream_chunk_size = 1 << 16
+    deploy_workers = 16
+    deploy_timeout = 120
+    ssh_key_file = '/home/syslog-admin/.ssh/deploy_key'
+    ssh_user = 'syslog-admin'
+    ssh_persist = 600
+    render_cache = os.environ.get('LEFCI_RENDER_CACHE', os.path.join(tempfile.gettempdir(), 'lefci-render'))
+    render_cache_size = 64
+    optimize_filters = True
+    order_by_hits = False
+    stats_path = os.environ.get('LEFCI_STATS', 'stats')
+    stats_samples = 288
+    job_dir = os.environ.get('LEFCI_JOB_DIR', os.path.join(tempfile.gettempdir(), 'lefci-jobs'))
+    job_history = 100
+    event_keepalive = 15
+    metrics_dir = os.environ.get('LEFCI_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'lefci-metrics'))
+    metrics_flush_interval = 5
+    regex_timeout = 1.0
+    regex_quarantine_after = 3
+    # patterns whose backtracking can't take more steps run without the sandbox, see regex_guard.get_degree
+    regex_inline_steps = 1000000
+    max_samples = 10000
+    reported_samples = 5
+    debug = bool(os.environ.get('LEFCI_DEBUG'))
+
+
+@lru_cache(maxsize=ApiConfig.pattern_cache_size)
+def compile_pattern(pattern):
+    """
+    Compiles a filter pattern once per process. Identical patterns of different filters and configs share the same
+    compiled object.
+    :param pattern: regular expression of a filter
+    :type pattern: str
+    :return: compiled pattern
+    :rtype: re.Pattern
+    """
+    if not isinstance(pattern, str):
+        raise FilterException(f"Filter pattern '{pattern}' is not a string")
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise FilterException(f"Filter pattern '{pattern}' is invalid: {e}")
+
+
+def get_pattern_problem(pattern):
+    """
+    Tells whether a pattern may backtrack for exponential time or is quarantined.
+    :param pattern: a valid regular expression
+    :type pattern: str
+    :return: the problem of the pattern or None
+    :rtype: str
+    """
+    reason = regex_guard.screen_pattern(pattern)
+    if reason:
+        return f"Filter pattern '{pattern}' may take exponential time, {reason}"
+    if regex_guard.guard.is_quarantined(pattern, ApiConfig.regex_quarantine_after):
+        return f"Filter pattern '{pattern}' is quarantined, it ran out of time too often"
+    return None
+
+
+def screen_trees(trees):
+    """
+    Rejects new patterns with a problem, see get_pattern_problem. Only the patterns a client sends are screened, stored
+    configs load with theirs and the verification reports them as errors, so they can still be fixed.
+    :param trees: nodes or changes of nodes as sent by a client, with their children
+    :type trees: list(dict)
+    :raises FilterException: if a pattern is invalid or has a problem
+    """
+    trees = list(trees)
+    while trees:
+        tree = trees.pop()
+        for filter in tree.get('filters') or ():
+            if filter.get('field') != 'unknown':
+                compile_pattern(filter.get('pattern'))
+                problem = get_pattern_problem(filter['pattern'])
+                if problem:
+                    raise FilterException(problem)
+        trees += tree.get('children') or ()
+
+
+@lru_cache(maxsize=ApiConfig.pattern_cache_size)
+def get_filter(field, pattern):
+    """
+    Returns the filter of a field and pattern from a table shared by all nodes and configs. Filters are immutable, so
+    nodes with the same filter hold the same object.
+    :rtype: Filter
+    """
+    return Filter(field, pattern)
+
+
+@lru_cache(maxsize=ApiConfig.data_cache_size)
+def decode_data(data):
+    """
+    Decodes the actions and the example of a node once, until the node gets other ones. Nodes with equal data share
+    the decoded object, so it must not be changed.
+    :param data: compact JSON object of a node, see LogTree
+    :type data: str
+    :rtype: dict
+    """
+    return json.loads(data)
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pauses the cyclic garbage collector while a large tree of acyclic objects is built, e.g. a whole encoded config.
+    Otherwise the allocations trigger collections, which traverse every node of the loaded configs again and again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 
 class State:
+    """
+    Caches the configs of a store. Every store write gets a new version stamp, the cached config is reloaded when the
+    stamp in the store differs, e.g. because another worker process changed the config.
+    """
 
-    def __init__(self):
-        self.DEFAULT_CONFIG_PATH = 'configs'
+    def __init__(self, store=None):
+        self.store = store or JsonStore()
         self.configs_cache = {}
-        if not os.path.exists(self.DEFAULT_CONFIG_PATH):
-            os.mkdir(self.DEFAULT_CONFIG_PATH)
+        self.versions = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
 
-        self.saved_configs = [f for f in os.listdir(self.DEFAULT_CONFIG_PATH) if isfile(join(self.DEFAULT_CONFIG_PATH, f))]
+    @contextmanager
+    def lock(self, config_name, write=False, create=False):
+        """
+        Serializes the requests on a config. The threads of a process share the cached config, so they take turns
+        reading and changing it. Writers also hold a flock on the lock file of the config in the store, so loading,
+        changing and saving isn't interleaved with the writes of other worker processes.
+        :param write: the config is changed and saved
+        :type write: bool
+        :param create: the config may not be saved yet
+        :type create: bool
+        :raises KeyError: if the config isn't saved and isn't created, no lock or lock file is made for it then
+        """
+        with self._locks_lock:
+            thread_lock = self._locks.get(config_name)
+            if thread_lock is None:
+                if not create:
+                    try:
+                        self.store.get_version(config_name)
+                    except (KeyError, OSError):
+                        raise KeyError(f'No config {config_name} saved')
+                thread_lock = self._locks[config_name] = threading.Lock()
+        with thread_lock:
+            if not write:
+                yield
+                return
+            with open(self.store.get_lock_path(config_name), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def saved_configs(self):
+        return self.store.list_configs()
 
     def delete_config(self, config_name):
-        filepath = join(self.DEFAULT_CONFIG_PATH, config_name)
-        os.remove(filepath)
-        self.saved_configs.remove(config_name)
-        self.configs_cache.pop(config_name)
+        self.store.delete_config(config_name)
+        self.configs_cache.pop(config_name, None)
+        self.versions.pop(config_name, None)
+        with self._locks_lock:
+            self._locks.pop(config_name, None)
         return True
 
     def get_config(self, config_name):
-        if config_name not in self.configs_cache:
-            self.configs_cache[config_name] = self.load_config(config_name)
+        try:
+            version = self.store.get_version(config_name)
+        except Exception:
+            self.configs_cache.pop(config_name, None)
+            self.versions.pop(config_name, None)
+            raise
+        if config_name not in self.configs_cache or self.versions.get(config_name) != version:
+            metrics.inc('lefci_state_cache_total', result='miss' if config_name not in self.configs_cache else 'stale')
+            with metrics.timer('lefci_state_load_duration_seconds'):
+                self.configs_cache[config_name] = self.load_config(config_name)
+            self.versions[config_name] = version
+        else:
+            metrics.inc('lefci_state_cache_total', result='hit')
         return self.configs_cache[config_name]
 
+    def get_version(self, config_name):
+        """
+        Returns the version stamp of the cached config, call get_config first to make sure it is current.
+        :rtype: str
+        """
+        return self.versions.get(config_name)
+
     def save_config(self, config):
-        filepath = join(self.DEFAULT_CONFIG_PATH, config.name)
-        with open(filepath, 'w') as file:
-            file.write(config.to_json())
-        if config.name not in self.saved_configs:
-            self.saved_configs.append(config.name)
-        if config.name not in self.configs_cache:
-            self.configs_cache[config.name] = config
+        with metrics.timer('lefci_save_config_duration_seconds'):
+            self.versions[config.name] = self.store.save_config(config)
+        self.configs_cache[config.name] = config
+        return True
+
+    def save_node(self, config, node, subtree=True, previous_id=None):
+        """
+        Persists an added or updated node of a config, which is already saved.
+        :param subtree: also persist the descendants of the node, e.g. if its children were replaced
+        :type subtree: bool
+        :param previous_id: id the node was saved with, if it was renamed since
+        :type previous_id: str
+        """
+        self.versions[config.name] = self.store.save_node(config, node, subtree, previous_id)
         return True
 
+    def delete_node(self, config, node):
+        """
+        Persists the removal of a node and its descendants from a config, which is already saved.
+        """
+        self.versions[config.name] = self.store.delete_node(config, node)
+        return True
+
+    def save_changes(self, config, changes):
+        """
+        Persists the changes of Config.apply_operations to a config, which is already saved, in one write.
+        :type changes: TreeChanges
+        """
+        self.versions[config.name] = self.store.save_changes(config, changes)
+        return True
+
+    def load_config(self, config_name):
+        return self.store.load_config(config_name)
+
+
+class JsonStore:
+    """
+    Keeps every config as one JSON file. Files are replaced atomically, but every change rewrites the whole config.
+    The version of a config is derived from inode, modification time and size of its file.
+    """
+
+    def __init__(self, path='configs', indent=None):
+        """
+        :param indent: pretty print the files with this indent, by default they are written compact and streamed
+        :type indent: int
+        """
+        self.path = path
+        self.indent = indent
+        if not os.path.exists(self.path):
+            os.mkdir(self.path)
+
+    def list_configs(self):
+        return [f for f in os.listdir(self.path) if isfile(join(self.path, f)) and not f.startswith('.')]
+
+    def get_lock_path(self, config_name):
+        return join(self.path, f'.{config_name.replace(os.sep, "_")}.lock')
+
+    def delete_config(self, config_name):
+        os.remove(join(self.path, config_name))
+
+    def save_config(self, config):
+        filepath = join(self.path, config.name)
+        # write next to the config and rename, so a crash never leaves a partially written config behind
+        # threads of one process save concurrently, so the temporary file is unique per thread
+        temp_filepath = join(self.path, f'.{config.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(temp_filepath, 'w') as file:
+            if self.indent:
+                file.write(config.to_json(self.indent))
+            else:
+                file.writelines(config.iter_json())
+            metrics.observe('lefci_save_config_bytes', file.tell())
+        os.replace(temp_filepath, filepath)
+        return self.get_version(config.name)
+
+    def save_node(self, config, node, subtree=True, previous_id=None):
+        return self.save_config(config)
+
+    def delete_node(self, config, node):
+        return self.save_config(config)
+
+    def save_changes(self, config, changes):
+        return self.save_config(config)
+
+    def get_version(self, config_name):
+        stat = os.stat(join(self.path, config_name))
+        return f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
     def load_config(self, config_name):
-        filepath = join(self.DEFAULT_CONFIG_PATH, config_name)
+        filepath = join(self.path, config_name)
         with open(filepath, 'r') as file:
             config_data = json.load(file)
 
@@ -70,34 +410,119 @@ class Config:
         self.name = str(uuid4())
         self.log_trees = []
         self.server = []
+        self._classifier = None
+        self._index = {}
+        self._matrix = ResultMatrix()
+        self._verified = {}
 
         if kwargs:
             for key, value in kwargs.items():
                 if key == 'log_trees':
                     self.log_trees = [LogTree(**child) for child in value]
-                elif key in self.__dict__:
+                elif key in self.__dict__ and not key.startswith('_'):
                     self.__dict__[key] = value
 
+        for tree in self.log_trees:
+            tree.register(self._index)
+
     def add_tree(self, tree, position=None):
         if position is None or not (0 <= position < self.log_trees.__len__()):
             self.log_trees.append(tree)
         else:
             self.log_trees.insert(position, tree)
+        tree.register(self._index)
 
     def remove_tree(self, tree):
         self.log_trees.remove(tree)
+        tree.unregister()
 
-    def verify_node(self, node):
-        reports = ReportBySource()
-        # verify if node configuration is OK
-        report = node.get_verify_report()
-        reports.add(report, node.title)
-        if report.get_highest_status_code() == Status.ERROR:
+    def verify_node(self, node, delta=False):
+        """
+        Verifies the filters and the example of a node against its own configuration, its siblings, ancestors and
+        descendants. Filter results are memoized, so only changed filters and examples are evaluated again.
+        :param node: node to verify
+        :type node: LogTree
+        :param delta: only return the sources, whose report changed since the previous verification of the node
+        :type delta: bool
+        :rtype: ReportBySource
+        """
+        with metrics.timer('lefci_verify_node_duration_seconds'):
+            reports = self._verify(node)
+
+        if self._matrix.size > self._matrix.sweep_size:
+            self._matrix.sweep(self._index.values())
+            self._verified = {uuid: verified for uuid, verified in self._verified.items() if uuid in self._index}
+
+        previous = self._verified.get(node.id)
+        self._verified[node.id] = reports
+        if delta and previous is not None:
+            return reports.difference(previous)
+        return reports
+
+    def verify_all(self, fail_fast=False, processes=None):
+        """
+        Verifies every node of the config once. Large configs with several root trees are verified in a pool of
+        processes, one root tree per task.
+        :param fail_fast: stop at the first node, whose verification reports an ERROR
+        :type fail_fast: bool
+        :param processes: size of the process pool, defaults to ApiConfig.verify_processes
+        :type processes: int
+        :return: merged reports of all nodes
+        :rtype: ReportBySource
+        """
+        processes = processes or ApiConfig.verify_processes or 1
+        if processes == 1 or len(self.log_trees) < 2 or len(self._index) < ApiConfig.parallel_verify_size:
+            reports = ReportBySource()
+            for tree in self.log_trees:
+                tree_reports = self.verify_tree(tree, fail_fast)
+                reports += tree_reports
+                if fail_fast and tree_reports.get_highest_status_code() == Status.ERROR:
+                    break
             return reports
 
-        reports += self.get_filter_report(node, node.filters)
-        reports += self.get_example_report(node, node.example)
+        tree_reports = {}
+        with ProcessPoolExecutor(min(processes, len(self.log_trees)), initializer=_init_verify_worker,
+                                 initargs=(self,)) as executor:
+            futures = {executor.submit(_verify_tree, index, fail_fast): index for index in range(len(self.log_trees))}
+            for future in as_completed(futures):
+                tree_reports[futures[future]] = future.result()
+                if fail_fast and tree_reports[futures[future]].get_highest_status_code() == Status.ERROR:
+                    executor.shutdown(cancel_futures=True)
+                    break
 
+        reports = ReportBySource()
+        for index in sorted(tree_reports):
+            reports += tree_reports[index]
+        return reports
+
+    def verify_tree(self, tree, fail_fast=False):
+        """
+        Verifies a node and all its descendants.
+        :type tree: LogTree
+        :param fail_fast: stop at the first node, whose verification reports an ERROR
+        :type fail_fast: bool
+        :rtype: ReportBySource
+        """
+        reports = ReportBySource()
+        nodes = [tree]
+        while nodes:
+            node = nodes.pop()
+            node_reports = self._verify(node)
+            reports += node_reports
+            if fail_fast and node_reports.get_highest_status_code() == Status.ERROR:
+                break
+            nodes += reversed(node.children)
+        return reports
+
+    def _verify(self, node):
+        reports = ReportBySource()
+        # verify if node configuration is OK
+        report = node.get_verify_report(self._get_hits(node.filters, node.example))
+        reports.add(report, node.id, node.title)
+        if report.get_highest_status_code() != Status.ERROR:
+            reports += self.get_filter_report(node, node.filters)
+            reports += self.get_example_report(node, node.example)
+            reports += self.get_sample_report(node)
         return reports
 
     def get_filter_report(self, node, filters):
@@ -113,8 +538,8 @@ class Config:
         """
         reports = ReportBySource()
         for sibling in self._get_siblings(node):
-            sibling_report = sibling.get_example_miss_report(filters)
-            reports.add(sibling_report, sibling.title)
+            sibling_report = sibling.get_example_miss_report(filters, self._get_hits(filters, sibling.example))
+            reports.add(sibling_report, sibling.id, sibling.title)
 
         reports += self.get_filter_match_report_of_children(node, filters)
 
@@ -133,8 +558,8 @@ class Config:
         """
         reports = ReportBySource()
         for child in node.children:
-            child_report = child.get_example_match_report(filters)
-            reports.add(child_report, child.title)
+            child_report = child.get_example_match_report(filters, self._get_hits(filters, child.example))
+            reports.add(child_report, child.id, child.title)
 
             # if the filter hits, do the same for the child
             if child_report.get_highest_status_code() == Status.OK:
@@ -153,79 +578,540 @@ class Config:
         :rtype: Report
         """
         reports = ReportBySource()
-        siblings = self._get_siblings(node)
-        for sibling in siblings:
-            sibling_report = sibling.get_filter_miss_report(example)
-            reports.add(sibling_report, sibling.title)
-
-        if node.parent:
-            reports.add(node.parent.get_filter_match_report(example), node.parent.title)
-            reports += self.get_example_report(node.parent, example)
+        # every level is scanned once, the hits of the level are shared by the siblings and the ancestor
+        hits = self._get_level_classifier(node).evaluate(example, self._matrix)
+        while True:
+            for index, sibling in enumerate(self._get_level(node)):
+                if sibling is not node:
+                    sibling_report = sibling.get_filter_miss_report(example, hits[index])
+                    reports.add(sibling_report, sibling.id, sibling.title)
+
+            parent = node.parent
+            if not parent:
+                return reports
+            parent_hits = self._get_level_classifier(parent).evaluate(example, self._matrix)
+            parent_index = self._get_level(parent).index(parent)
+            reports.add(parent.get_filter_match_report(example, parent_hits[parent_index]), parent.id, parent.title)
+            node, hits = parent, parent_hits
+
+    def get_sample_report(self, node):
+        """
+        Tests filters on samples like on examples: the samples of a node should be matched by its own filters and the
+        ones of its ancestors and missed by the filters of its siblings. The filters of the node should miss the
+        samples of the siblings and match the ones of the children. Every filter is evaluated once per column.
+        :type node: LogTree
+        :return: match rates and the first failing samples of every filter
+        :rtype: ReportBySource
+        """
+        reports = ReportBySource()
+        # the level is walked without copying it, most nodes have no samples
+        level = self._get_level(node)
+        if node.samples:
+            reports.add(self._get_sample_report(node.filters, node.samples, 'match'), node.id, node.title)
+            for sibling in level:
+                if sibling is not node:
+                    reports.add(self._get_sample_report(sibling.filters, node.samples, 'miss'), sibling.id,
+                                sibling.title)
+            parent = node.parent
+            while parent:
+                reports.add(self._get_sample_report(parent.filters, node.samples, 'match'), parent.id, parent.title)
+                parent = parent.parent
+        for sibling in level:
+            if sibling.samples and sibling is not node:
+                reports.add(self._get_sample_report(node.filters, sibling.samples, 'miss'), sibling.id, sibling.title)
+        for child in node.children:
+            if child.samples:
+                reports.add(self._get_sample_report(node.filters, child.samples, 'match'), child.id, child.title)
         return reports
 
+    def _get_sample_report(self, filters, samples, check):
+        report = Report()
+        expected = check == 'match'
+        for filter in filters:
+            if filter.field == 'unknown':
+                continue
+            column = samples.get_column(filter.field) or empty_column
+            try:
+                count, total, hit_indices, miss_indices = self._matrix.summarize_column(filter, column)
+            except regex_guard.PatternTimeout as e:
+                report.add(f'{e} on the samples', Status.ERROR)
+                continue
+            failing = miss_indices if expected else hit_indices
+            status = Status.UNKNOWN if not total else Status.WARNING if failing else Status.OK
+            report.add_sample_result(check, filter.pattern, count, total, failing,
+                                     column[failing[0]] if failing else None, status)
+        return report
+
+    def route(self, example):
+        """
+        Follows an example down the trees the way the rendered syslog-ng configuration does and returns the nodes it
+        lands in. A node is a landing node, if its filters hit and none of its children catch the example.
+        :param example: example to route, missing fields are treated as empty
+        :type example: dict
+        :return: landing nodes
+        :rtype: list(LogTree)
+        """
+        return self._route(self.log_trees, self.get_classifier(), example)
+
+    def _route(self, nodes, classifier, example):
+        landed = []
+        for index in classifier.route(example):
+            node = nodes[index]
+            caught = self._route(node.children, node.get_classifier(), example) if node.children else []
+            landed += caught or [node]
+        return landed
+
+    def get_classifier(self):
+        """
+        Returns the classifier of the root level, it is rebuilt when the filters of a root tree changed.
+        :rtype: Classifier
+        """
+        self._classifier = Classifier.for_nodes(self.log_trees, self._classifier)
+        return self._classifier
+
+    def _get_hits(self, filters, example):
+        return [self._matrix.hits(filter, example[filter.field])
+                if filter.field != 'unknown' and filter.field in example else None
+                for filter in filters]
+
+    def _get_level(self, node):
+        return node.parent.children if node.parent else self.log_trees
+
+    def _get_level_classifier(self, node):
+        return node.parent.get_classifier() if node.parent else self.get_classifier()
+
     def _get_siblings(self, node):
-        if node.parent:
-            siblings = [child for child in node.parent.children if child is not node]
-        else:
-            siblings = [child for child in self.log_trees if child is not node]
-        return siblings
+        return [child for child in self._get_level(node) if child is not node]
 
     def find_tree(self, uuid):
         """
-        Search all LogTrees in the current config and returns the sub-tree if found.
+        Looks up a LogTree of the current config by its id.
         :param uuid: str
         :return: LogTree
         """
-        for tree in self.log_trees:
-            result = tree.search_for_descendant(uuid)
-            if result:
-                return result
+        if ApiConfig.debug:
+            self.check_index()
+        return self._index.get(uuid)
+
+    def apply_operations(self, operations):
+        """
+        Applies a list of tree operations in order. If one fails, the ones before are undone and the config is left
+        as it was. Every operation is a dict with an 'op' and its arguments:
+
+        - add: 'tree' under the 'parent' at 'position', 'ref' names the new node for later operations
+        - update: 'changes' to the node 'id', like a PUT of the node
+        - move: node 'id' under the 'parent' at 'position' of the level without the node, the node keeps its id
+        - reorder: the children of the 'parent' in the 'order' of their ids
+        - delete: node 'id' and its descendants
+
+        The parent null or missing is the root level, the position missing is the end of the level. Ids may also be
+        the ref of a node added before.
+        :type operations: list(dict)
+        :return: the changed nodes and levels
+        :rtype: TreeChanges
+        :raises OperationException: if an operation is invalid, nothing is changed then
+        """
+        changes = TreeChanges()
+        undo = []
+        try:
+            for number, operation in enumerate(operations):
+                try:
+                    self._apply_operation(number, operation, changes, undo)
+                except KeyError as e:
+                    raise OperationException(f'Operation {number} misses {e}')
+                except (AttributeError, FilterException, SampleException, TypeError, ValueError) as e:
+                    raise OperationException(f'Operation {number} failed: {e}')
+        except Exception:
+            for action in reversed(undo):
+                action()
+            raise
+        return changes
+
+    def _apply_operation(self, number, operation, changes, undo):
+        op = operation['op']
+        if op == 'add':
+            parent = self._get_operation_parent(operation, changes)
+            screen_trees([operation['tree']])
+            tree = LogTree(parent=parent, **operation['tree'])
+            nodes = [tree]
+            while nodes:
+                node = nodes.pop()
+                if node.id in self._index:
+                    raise ValueError(f'Node id {node.id} is already used')
+                nodes += node.children
+            self._insert(tree, parent, operation.get('position'))
+            undo.append(lambda: self._detach(tree))
+            changes.add(tree, subtree=True)
+            changes.created.append({'operation': number, 'ref': operation.get('ref'), 'id': tree.id})
+            if operation.get('ref') is not None:
+                changes.refs[operation['ref']] = tree
+        elif op == 'update':
+            node = self._get_operation_node(operation['id'], changes)
+            uuid, index = node.id, node._index
+            if operation['changes'].get('id', uuid) != uuid and operation['changes']['id'] in self._index:
+                raise ValueError(f'Node id {operation["changes"]["id"]} is already used')
+            screen_trees([operation['changes']])
+            previous = [(key, getattr(node, key)) for key in ('id', 'title', 'description', 'children', 'filters',
+                                                              'samples', '_data')]
+
+            def restore():
+                node.unregister()
+                for key, value in previous:
+                    setattr(node, key, value)
+                node.register(index)
+            undo.append(restore)
+            node.update_config(**operation['changes'])
+            if node.id != uuid:
+                # the node and its descendants are stored again under the new id
+                changes.deleted.append(uuid)
+            changes.add(node, subtree='children' in operation['changes'] or node.id != uuid)
+        elif op == 'move':
+            node = self._get_operation_node(operation['id'], changes)
+            parent = self._get_operation_parent(operation, changes)
+            ancestor = parent
+            while ancestor is not None:
+                if ancestor is node:
+                    raise ValueError(f'Node {node.id} can\'t be moved into its own subtree')
+                ancestor = ancestor.parent
+            previous_parent, previous_position = node.parent, self._get_level(node).index(node)
+            changes.levels.add(previous_parent)
+            self._detach(node)
+            self._insert(node, parent, operation.get('position'))
+
+            def move_back():
+                self._detach(node)
+                self._insert(node, previous_parent, previous_position)
+            undo.append(move_back)
+            # the stored descendants may be removed with a subtree the node was moved out of
+            changes.add(node, subtree=True)
+        elif op == 'reorder':
+            parent = self._get_operation_parent(operation, changes)
+            level = parent.children if parent else self.log_trees
+            nodes = {node.id: node for node in level}
+            order = [changes.refs[uuid].id if uuid in changes.refs else uuid for uuid in operation['order']]
+            if sorted(order) != sorted(nodes):
+                raise ValueError('The order has to list the ids of all children once')
+            if order == [node.id for node in level]:
+                return
+            previous = list(level)
+            level[:] = [nodes[uuid] for uuid in order]
+
+            def restore_order():
+                level[:] = previous
+            undo.append(restore_order)
+            changes.levels.add(parent)
+        elif op == 'delete':
+            node = self._get_operation_node(operation['id'], changes)
+            parent, position = node.parent, self._get_level(node).index(node)
+            self._detach(node)
+            undo.append(lambda: self._insert(node, parent, position))
+            changes.deleted.append(node.id)
+            changes.levels.add(parent)
+        else:
+            raise ValueError(f'Unknown operation {op}')
+
+    def _get_operation_node(self, uuid, changes):
+        node = changes.refs[uuid] if uuid in changes.refs else self.find_tree(uuid)
+        if node is None or node._index is not self._index:
+            raise ValueError(f'No node with {uuid} found')
+        return node
+
+    def _get_operation_parent(self, operation, changes):
+        if operation.get('parent') is None:
+            return None
+        return self._get_operation_node(operation['parent'], changes)
+
+    def _insert(self, tree, parent, position=None):
+        if parent:
+            parent.add_tree(tree, position)
+        else:
+            tree.parent = None
+            self.add_tree(tree, position)
+
+    def _detach(self, tree):
+        if tree.parent:
+            tree.parent.remove_tree(tree)
+        else:
+            self.remove_tree(tree)
+
+    def check_index(self):
+        """
+        Confirms that the id index holds exactly the nodes of the trees.
+        """
+        nodes = {}
+        trees = list(self.log_trees)
+        while trees:
+            tree = trees.pop()
+            assert tree.id not in nodes, f'Node id {tree.id} is used twice'
+            nodes[tree.id] = tree
+            trees += tree.children
+        assert nodes.keys() == self._index.keys(), f'Index differs in ids {nodes.keys() ^ self._index.keys()}'
+        for uuid, node in nodes.items():
+            assert self._index[uuid] is node, f'Index holds a stale node for {uuid}'
 
     def encode(self):
-        var_dict = self.__dict__.copy()
+        var_dict = {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
         trees = []
-        for tree in var_dict.pop('log_trees'):
-            trees.append(tree.encode())
+        with paused_gc():
+            for tree in var_dict.pop('log_trees'):
+                trees.append(tree._encode())
         var_dict['log_trees'] = trees
         return var_dict
 
-    def to_json(self):
-        return json.dumps(self.encode(), indent=4)
+    def iter_json(self):
+        """
+        Encodes the config as compact JSON chunk by chunk while walking the trees, without building the encoded
+        dictionaries first. The result equals the compact dump of encode().
+        :rtype: generator(str)
+        """
+        separator = '{'
+        for key, value in self.__dict__.items():
+            if not key.startswith('_') and key != 'log_trees':
+                yield f'{separator}{compact_encoder.encode(key)}:{compact_encoder.encode(value)}'
+                separator = ','
+        yield f'{separator}"log_trees":'
+        yield from iter_json_list(self.log_trees)
+        yield '}'
+
+    def to_json(self, indent=None):
+        if indent:
+            return json.dumps(self.encode(), indent=indent)
+        return ''.join(self.iter_json())
+
+
+# config of a process of the Config.verify_all pool
+_verify_config = None
+
+
+def _init_verify_worker(config):
+    global _verify_config
+    _verify_config = config
+
+
+def _verify_tree(index, fail_fast):
+    return _verify_config.verify_tree(_verify_config.log_trees[index], fail_fast)
+
+
+class TreeChanges:
+    """
+    Nodes and levels changed by Config.apply_operations, see State.save_changes.
+    """
+
+    def __init__(self):
+        # the nodes added by the operations, by their number
+        self.created = []
+        self.refs = {}
+        # the saved nodes and whether their descendants are saved too
+        self.saved = {}
+        # ids of the removed nodes
+        self.deleted = []
+        # parents whose children were added, moved or reordered, None is the root level
+        self.levels = set()
+
+    def add(self, node, subtree=False):
+        self.saved[node] = self.saved.get(node, False) or subtree
+        self.levels.add(node.parent)
+
+    def get_affected_nodes(self, config):
+        """
+        Returns the added, updated and moved nodes, which are still part of the config.
+        :type config: Config
+        :rtype: list(LogTree)
+        """
+        return [node for node in self.saved if config.find_tree(node.id) is node]
+
+
+class Samples:
+    """
+    Sample lines of a node, e.g. imported from real logs. They are kept as one column of values per field, a sample
+    without a value of a field holds None in its column. Filters are tested on a whole column in one batch.
+    """
+    __slots__ = ('columns', 'size')
+
+    def __init__(self, columns=None):
+        """
+        :param columns: values per field, all columns have the same length
+        :type columns: dict
+        :raises SampleException: if the columns are invalid
+        """
+        self.columns = {}
+        self.size = 0
+        if columns is not None and not isinstance(columns, dict):
+            raise SampleException('Samples have to be an object of columns by field')
+        sizes = set()
+        for field, values in (columns or {}).items():
+            if field not in ApiConfig.allowed_fields:
+                raise SampleException(f"Samples of unknown field '{field}'")
+            if not isinstance(values, list) or not all(value is None or isinstance(value, str) for value in values):
+                raise SampleException(f"Samples of field '{field}' have to be a list of strings")
+            sizes.add(len(values))
+            self.columns[sys.intern(field)] = values
+        if len(sizes) > 1:
+            raise SampleException('Sample columns have different lengths')
+        self.size = sizes.pop() if sizes else 0
+        if self.size > ApiConfig.max_samples:
+            raise SampleException(f'{self.size} samples are more than the {ApiConfig.max_samples} allowed')
+
+    @staticmethod
+    def from_records(records):
+        """
+        :param records: samples as dicts of fields and values, e.g. parsed log lines
+        :type records: list(dict)
+        :rtype: Samples
+        """
+        fields = dict.fromkeys(field for record in records for field in record)
+        return Samples({field: [record.get(field) for record in records] for field in fields})
+
+    def concat(self, other):
+        """
+        :return: the samples of both, missing columns are filled with None
+        :rtype: Samples
+        """
+        fields = list(dict.fromkeys(list(self.columns) + list(other.columns)))
+        return Samples({field: (self.columns.get(field) or [None] * self.size) +
+                        (other.columns.get(field) or [None] * other.size) for field in fields})
+
+    def get_column(self, field):
+        return self.columns.get(field)
+
+    def encode(self):
+        return self.columns
+
+    def __len__(self):
+        return self.size
+
+
+no_samples = Samples()
+# column of the fields without samples
+empty_column = []
 
 
 class LogTree:
+    """
+    Node of a config. Large configs have hundreds of thousands of nodes in every worker, so nodes are compact: the
+    attributes are slots, leaves share an empty tuple as children, filters come from the shared filter table and the
+    actions and the example are kept together as one compact JSON object, which is decoded once by decode_data. Nodes
+    without samples share one empty Samples object, whose samples aren't encoded.
+    """
+    # attributes of a node in the order they are encoded
+    fields = ('id', 'title', 'description', 'children', 'filters', 'samples', 'actions', 'example')
+    # attributes of a projection, see project
+    projected_fields = fields + ('children_count', 'samples_count')
+    __slots__ = ('id', 'title', 'description', 'children', 'filters', 'samples', '_data', 'parent', '_classifier',
+                 '_index')
+    empty_data = '{"actions":[],"example":{}}'
 
     def __init__(self, parent=None, **kwargs):
-        self.id = uuid4().__str__()
+        # a random id only for nodes created without one
+        self.id = None if 'id' in kwargs else uuid4().__str__()
         self.title = 'root'
         self.description = ''
-        self.children = []
-        self.filters = []
-        self.actions = []
-        self.example = {}
+        self.children = ()
+        self.filters = ()
+        self.samples = no_samples
+        self._data = LogTree.empty_data
         self.parent = parent
+        self._classifier = None
+        self._index = None
 
         if kwargs:
             self.update_config(**kwargs)
 
     def update_config(self, **update_dict):
+        # compile the filters first, so an invalid pattern leaves the node untouched
+        filters = None
+        if 'filters' in update_dict:
+            filters = tuple(get_filter(filter['field'], filter['pattern']) for filter in update_dict['filters'])
+        samples = Samples(update_dict['samples']) if update_dict.get('samples') else no_samples
+
+        # replaced children and a changed id have to be re-indexed
+        index = self._index if 'children' in update_dict or 'id' in update_dict else None
+        if index is not None:
+            self.unregister()
+
         for key, value in update_dict.items():
             if key == 'children':
-                self.children = [LogTree(parent=self, **child) for child in value]
+                self.children = [LogTree(parent=self, **child) for child in value] or ()
             elif key == 'filters':
-                self.filters = [Filter(filter['field'], filter['pattern']) for filter in value]
-            elif key in self.__dict__:
-                self.__dict__[key] = value
+                self.filters = filters
+            elif key == 'samples':
+                self.samples = samples
+            elif key in ('actions', 'example'):
+                continue
+            elif key in LogTree.fields:
+                setattr(self, key, value)
+        if 'actions' in update_dict or 'example' in update_dict:
+            # both are kept in one JSON object, the one not given keeps its value
+            actions = update_dict['actions'] if 'actions' in update_dict else self.actions
+            example = update_dict['example'] if 'example' in update_dict else self.example
+            self._set_data(actions, example)
+
+        if index is not None:
+            self.register(index)
+
+    @property
+    def actions(self):
+        return decode_data(self._data)['actions']
+
+    @actions.setter
+    def actions(self, actions):
+        self._set_data(actions, self.example)
+
+    @property
+    def example(self):
+        return decode_data(self._data)['example']
+
+    @example.setter
+    def example(self, example):
+        self._set_data(self.actions, example)
+
+    def _set_data(self, actions, example):
+        data = compact_encoder.encode({'actions': actions, 'example': example})
+        self._data = LogTree.empty_data if data == LogTree.empty_data else data
 
     def add_tree(self, tree, position=None):
         tree.parent = self
+        if not self.children:
+            # leaves share an empty tuple
+            self.children = []
         if position is None or not (0 <= position < self.children.__len__()):
             self.children.append(tree)
         else:
             self.children.insert(position, tree)
+        if self._index is not None:
+            tree.register(self._index)
 
     def remove_tree(self, tree):
         self.children.remove(tree)
+        tree.unregister()
+
+    def register(self, index):
+        """
+        Adds the node and its descendants to the id index of a config.
+        :type index: dict
+        """
+        self._index = index
+        index[self.id] = self
+        for child in self.children:
+            child.register(index)
+
+    def unregister(self):
+        """
+        Removes the node and its descendants from the id index of their config.
+        """
+        if self._index is not None and self._index.get(self.id) is self:
+            del self._index[self.id]
+        self._index = None
+        for child in self.children:
+            child.unregister()
+
+    def get_classifier(self):
+        """
+        Returns the classifier of the children, it is rebuilt when the filters of a child changed.
+        :rtype: Classifier
+        """
+        self._classifier = Classifier.for_nodes(self.children, self._classifier)
+        return self._classifier
 
     def search_for_descendant(self, uuid):
         if uuid == self.id:
@@ -235,113 +1121,680 @@ class LogTree:
             if result:
                 return result
 
-    def get_verify_report(self):
+    def get_verify_report(self, hits=None):
+        """
+        :param hits: results of previous evaluations of the own filters on the own example
+        """
         report = Report()
-        if not self.example:
+        example = self.example
+        if not example:
             report.add('No examples given', Status.WARNING)
         if not self.filters:
             report.add('No filters given', Status.WARNING)
+        for filter in self.filters:
+            problem = filter.field != 'unknown' and get_pattern_problem(filter.pattern)
+            if problem:
+                report.add(problem, Status.ERROR)
 
         # check if own filters hit on own example
-        if self.example and self.filters:
-            filter_messages = Report()
-            for filter in self.filters:
-                filter_messages += filter.match_example(self.example)
+        if example and self.filters:
+            filter_messages = self.get_filter_match_report(example, hits)
             highest_status = filter_messages.get_highest_status_code()
             if highest_status == Status.WARNING:
                 filter_messages.add("Own filter miss on own examples", Status.ERROR)
-            elif highest_status == Status.UNKNOWN and not filter_messages.get_messages_with_status_code(Status.OK):
+            elif highest_status == Status.UNKNOWN and not filter_messages.count(Status.OK):
                 filter_messages.add('No filter hit any example', Status.ERROR)
             report += filter_messages
 
         return report
 
-    def get_example_match_report(self, filters):
-        return self._get_match_report(filters, self.example)
+    def get_example_match_report(self, filters, hits=None):
+        return self._get_match_report(filters, self.example, hits)
 
-    def get_example_miss_report(self, filters):
-        return self._get_miss_report(filters, self.example)
+    def get_example_miss_report(self, filters, hits=None):
+        return self._get_miss_report(filters, self.example, hits)
 
-    def get_filter_match_report(self, example):
-        return self._get_match_report(self.filters, example)
+    def get_filter_match_report(self, example, hits=None):
+        return self._get_match_report(self.filters, example, hits)
 
-    def get_filter_miss_report(self, example):
-        return self._get_miss_report(self.filters, example)
+    def get_filter_miss_report(self, example, hits=None):
+        return self._get_miss_report(self.filters, example, hits)
 
-    def _get_match_report(self, filters, example):
-        messages = Report()
-        for filter in filters:
-            messages += filter.match_example(example)
-        return messages
+    def _get_match_report(self, filters, example, hits=None):
+        report = Report()
+        for index, filter in enumerate(filters):
+            filter.match_example(example, hits[index] if hits else None, report)
+        return report
 
-    def _get_miss_report(self, filters, example):
-        messages = Report()
-        for filter in filters:
-            messages += filter.miss_example(example)
-        return messages
+    def _get_miss_report(self, filters, example, hits=None):
+        report = Report()
+        for index, filter in enumerate(filters):
+            filter.miss_example(example, hits[index] if hits else None, report)
+        return report
 
-    def encode(self):
-        var_dict = self.__dict__.copy()
-        var_dict.pop('parent')
-        var_dict['children'] = [child.encode() for child in self.children]
+    def encode(self, children=True):
+        """
+        :param children: include the encoded descendants, otherwise only the node itself is encoded
+        :type children: bool
+        """
+        if not children:
+            return self._encode(False)
+        with paused_gc():
+            return self._encode()
+
+    def _encode(self, children=True):
+        var_dict = {'id': self.id, 'title': self.title, 'description': self.description}
+        if children:
+            var_dict['children'] = [child._encode() for child in self.children]
         var_dict['filters'] = [filter.encode() for filter in self.filters]
+        if self.samples:
+            var_dict['samples'] = self.samples.encode()
+        # decoded again instead of copied from the shared cache, which large configs would only churn
+        var_dict.update(data_decoder.raw_decode(self._data)[0])
+        return var_dict
+
+    def project(self, fields=None, depth=None, offset=0, limit=None):
+        """
+        Encodes a part of the node and its descendants, e.g. to load a wide tree level by level.
+        :param fields: attributes to encode, see LogTree.projected_fields, all but children_count if not given
+        :type fields: list(str)
+        :param depth: levels of descendants to encode, all if not given. Nodes at the last level have no children.
+        :type depth: int
+        :param offset: index of the first child to encode
+        :type offset: int
+        :param limit: number of children to encode, all if not given. Offset and limit only apply to the children of
+            this node, not to the ones of its descendants.
+        :type limit: int
+        :rtype: dict
+        """
+        requested = fields
+        fields = fields or LogTree.fields
+        data = json.loads(self._data) if 'actions' in fields or 'example' in fields else None
+        var_dict = {}
+        for field in fields:
+            if field == 'children':
+                if depth is None or depth > 0:
+                    children_depth = None if depth is None else depth - 1
+                    var_dict['children'] = project_trees(self.children, requested, children_depth, offset, limit)
+            elif field == 'children_count':
+                var_dict['children_count'] = len(self.children)
+            elif field == 'samples':
+                # like encode, only nodes with samples have them unless they are requested
+                if self.samples or requested:
+                    var_dict['samples'] = self.samples.encode()
+            elif field == 'samples_count':
+                var_dict['samples_count'] = len(self.samples)
+            elif field == 'filters':
+                var_dict['filters'] = [filter.encode() for filter in self.filters]
+            elif field in ('actions', 'example'):
+                var_dict[field] = data[field]
+            else:
+                var_dict[field] = getattr(self, field)
         return var_dict
 
-    def to_json(self):
-        return json.dumps(self.encode(), indent=4)
+    def iter_json(self):
+        """
+        Encodes the node and its descendants as compact JSON chunk by chunk, see Config.iter_json.
+        :rtype: generator(str)
+        """
+        yield (f'{{"id":{compact_encoder.encode(self.id)},"title":{compact_encoder.encode(self.title)},'
+               f'"description":{compact_encoder.encode(self.description)},"children":')
+        yield from iter_json_list(self.children)
+        yield f',"filters":{compact_encoder.encode([filter.encode() for filter in self.filters])},'
+        if self.samples:
+            yield f'"samples":{compact_encoder.encode(self.samples.encode())},'
+        # the actions and the example are the last attributes, their JSON object closes the node
+        yield self._data[1:]
+
+    def to_json(self, indent=None):
+        if indent:
+            return json.dumps(self.encode(), indent=indent)
+        return ''.join(self.iter_json())
+
+
+def project_trees(trees, fields=None, depth=None, offset=0, limit=None):
+    """
+    Encodes a part of a list of LogTrees and their descendants, see LogTree.project. Offset and limit select the trees
+    of the list.
+    :type trees: list(LogTree)
+    :rtype: list(dict)
+    """
+    trees = trees[offset:] if limit is None else trees[offset:offset + limit]
+    return [tree.project(fields, depth) for tree in trees]
+
+
+def iter_json_list(trees):
+    """
+    Encodes a list of LogTrees as compact JSON chunk by chunk.
+    :type trees: list(LogTree)
+    :rtype: generator(str)
+    """
+    separator = '['
+    for tree in trees:
+        yield separator
+        yield from tree.iter_json()
+        separator = ','
+    yield '[]' if separator == '[' else ']'
 
 
 class Filter:
+    """
+    Immutable field and pattern, see get_filter. The compiled pattern isn't kept by the filter, it's looked up in the
+    pattern cache when needed.
+    """
+    __slots__ = ('field', 'pattern', 'degree')
+
     def __init__(self, field, pattern):
-        self.field = field
+        # field names repeat in every node, so they are stored once
+        self.field = sys.intern(field) if isinstance(field, str) else field
         self.pattern = pattern
+        self.degree = None
+        if field != 'unknown':
+            compile_pattern(pattern)
+            self.degree = regex_guard.get_degree(pattern)
 
-    def match_example(self, example):
-        if self.field == 'unknown':
-            return Report()
-        status = Status.UNKNOWN
-        message = f"No example given for filter '{self.pattern}'"
-        if self.field in example:
-            match = re.search(self.pattern, example[self.field])
-            if match:
-                status = Status.OK
-                message = f"Filter '{self.pattern}' matched example '{example[self.field]}'"
-            else:
-                status = Status.WARNING
-                message = f"Filter '{self.pattern}' didn't match example '{example[self.field]}'"
-        return Report(message, status)
+    @property
+    def regex(self):
+        return None if self.field == 'unknown' else compile_pattern(self.pattern)
+
+    def match_example(self, example, hit=None, report=None):
+        """
+        :param hit: result of a previous evaluation of the filter on the example, e.g. from a Classifier
+        :param report: report to add the result to, a new one if not given
+        :rtype: Report
+        """
+        return self._check_example('match', example, hit, Report() if report is None else report)
+
+    def miss_example(self, example, hit=None, report=None):
+        """
+        :param hit: result of a previous evaluation of the filter on the example, e.g. from a Classifier
+        :param report: report to add the result to, a new one if not given
+        :rtype: Report
+        """
+        return self._check_example('miss', example, hit, Report() if report is None else report)
 
-    def miss_example(self, example):
+    def _check_example(self, check, example, hit, report):
         if self.field == 'unknown':
-            return Report()
-        status = Status.UNKNOWN
-        message = f"Filter '{self.pattern}' did not hit any example"
-        if self.field in example:
-            match = re.search(f'({self.pattern})', example[self.field])
-            if match:
-                status = Status.WARNING
-                formatted_example = f'<span class={ApiConfig.filter_hit_span_class}>{example[self.field]}</span>'
-                message = f"Filter '{self.pattern}' hit example '{formatted_example}'"
-            else:
-                status = Status.OK
-                message = f"Filter '{self.pattern}' did not hit example '{example[self.field]}, everything is OK'"
-        return Report(message, status)
+            return report
+        if self.field not in example:
+            report.add_result(check, self.pattern, None, Status.UNKNOWN)
+            return report
+        value = example[self.field]
+        if hit is None:
+            count_evaluations[f'{check}_example']()
+            try:
+                hit = self.hits(value)
+            except regex_guard.PatternTimeout as e:
+                report.add(f'{e} on example \'{value}\'', Status.ERROR)
+                return report
+        if check == 'match':
+            report.add_result(check, self.pattern, value, Status.OK if hit else Status.WARNING)
+        else:
+            report.add_result(check, self.pattern, value, Status.WARNING if hit else Status.OK)
+        return report
+
+    def is_inline(self, steps):
+        """
+        Tells whether the pattern can be evaluated in this thread: if ApiConfig.regex_timeout is None or the evaluation
+        takes at most ApiConfig.regex_inline_steps and the pattern never ran out of time.
+        :param steps: estimated backtracking steps of the evaluation, see regex_guard.get_degree
+        :type steps: int
+        :rtype: bool
+        """
+        return ApiConfig.regex_timeout is None or (steps <= ApiConfig.regex_inline_steps
+                                                   and not regex_guard.guard.has_timed_out(self.pattern))
+
+    def hits(self, value):
+        """
+        Evaluates the pattern in a sandbox process under ApiConfig.regex_timeout, or in this thread if it is cheap
+        enough, see is_inline.
+        :raises PatternTimeout: if the pattern ran out of time or is quarantined
+        """
+        if self.is_inline((len(value) + 1) ** self.degree):
+            return self.regex.search(value) is not None
+        return regex_guard.guard.search(self.pattern, value, ApiConfig.regex_timeout,
+                                        ApiConfig.regex_quarantine_after)
+
+    def hits_many(self, values):
+        """
+        Evaluates the pattern on a list of values in one batch, see hits. The time budget covers the whole batch.
+        :type values: list(str)
+        :rtype: list(bool)
+        :raises PatternTimeout: if the pattern ran out of time or is quarantined
+        """
+        steps = (max(map(len, values), default=0) + 1) ** self.degree * len(values)
+        if self.is_inline(steps):
+            search = self.regex.search
+            return [search(value) is not None for value in values]
+        return regex_guard.guard.search(self.pattern, values, ApiConfig.regex_timeout,
+                                        ApiConfig.regex_quarantine_after)
 
     def encode(self):
         return {'field': self.field, 'pattern': self.pattern}
 
 
+class Classifier:
+    """
+    Evaluates the filters of all nodes of one tree level together. The patterns of each field are combined into a
+    single expression of optional lookaheads with one named group per filter, so one scan of an example value tells
+    which filters of which siblings hit.
+    """
+    # numbered back references and conditionals change their meaning once the pattern is embedded into another one,
+    # leading global flags are only allowed at the start of an expression
+    standalone_pattern = re.compile(r'\\[1-9]|\(\?\(|^\(\?[aiLmsux]+\)')
+    route_cache_size = 4096
+
+    def __init__(self, nodes, signature=None):
+        self.signature = signature if signature is not None else Classifier.get_signature(nodes)
+        self.filter_counts = [len(node.filters) for node in nodes]
+        self.catch_alls = []
+        entries_by_field = {}
+        for node_index, node in enumerate(nodes):
+            for filter_index, filter in enumerate(node.filters):
+                if filter.field == 'unknown':
+                    self.catch_alls.append((node_index, filter_index))
+                else:
+                    entries_by_field.setdefault(filter.field, []).append((node_index, filter_index, filter))
+
+        self.matchers = {field: FieldMatcher(entries) for field, entries in entries_by_field.items()}
+
+    @staticmethod
+    def get_signature(nodes):
+        return tuple(tuple((filter.field, filter.pattern) for filter in node.filters) for node in nodes)
+
+    @staticmethod
+    def for_nodes(nodes, classifier=None):
+        """
+        Returns the given classifier if it still fits the filters of the nodes, otherwise a new one.
+        """
+        signature = Classifier.get_signature(nodes)
+        if classifier is None or classifier.signature != signature:
+            classifier = Classifier(nodes, signature)
+        return classifier
+
+    def evaluate(self, example, matrix=None):
+        """
+        Scans the example once per field.
+        :param example: example to test
+        :type example: dict
+        :param matrix: memoized results to use and fill
+        :type matrix: ResultMatrix
+        :return: per node a list with one entry per filter, True if the filter hit, False if it missed and None if the
+                 example has no value for the field of the filter or the filter is a catch-all
+        :rtype: list(list)
+        """
+        hits = [[None] * count for count in self.filter_counts]
+        for field, matcher in self.matchers.items():
+            if field in example:
+                matcher.scan(example[field], hits, matrix)
+        return hits
+
+    def route(self, example, cache=None):
+        """
+        Returns the indices of the nodes, whose filters all hit the example. Catch-all filters hit, if no other filter
+        of the level hit. Missing fields are treated as empty, like syslog-ng does for empty macros.
+        :param example: example to route
+        :type example: dict
+        :param cache: filters hit by already seen field values, for routing many examples with repeating values like
+                      hosts and programs
+        :type cache: dict
+        :rtype: list(int)
+        """
+        if cache is None:
+            hits = self.evaluate({field: example.get(field, '') for field in self.matchers})
+        else:
+            hits = [[None] * count for count in self.filter_counts]
+            for field, matcher in self.matchers.items():
+                key = (field, example.get(field, ''))
+                hit_filters = cache.get(key)
+                if hit_filters is None:
+                    matcher.scan(key[1], hits)
+                    if len(cache) < self.route_cache_size:
+                        cache[key] = tuple((node_index, filter_index) for node_index, filter_index, _ in matcher.entries
+                                           if hits[node_index][filter_index])
+                else:
+                    for node_index, filter_index, _ in matcher.entries:
+                        hits[node_index][filter_index] = False
+                    for node_index, filter_index in hit_filters:
+                        hits[node_index][filter_index] = True
+
+        if self.catch_alls:
+            caught = any(hit for node_hits in hits for hit in node_hits)
+            for node_index, filter_index in self.catch_alls:
+                hits[node_index][filter_index] = not caught
+        return [index for index, node_hits in enumerate(hits) if all(node_hits)]
+
+    def route_many(self, examples, cache):
+        """
+        Routes a batch of examples, see route. The field values not in the cache are scanned together per field, so
+        patterns evaluated in the sandbox take one round trip per batch instead of one per example.
+        :type examples: list(dict)
+        :param cache: filters hit by already seen field values, see route
+        :type cache: dict
+        :return: the indices of the nodes per example
+        :rtype: list(list(int))
+        """
+        # the hit filters of every value of the batch, also if the cache is full
+        batch_cache = {}
+        for field, matcher in self.matchers.items():
+            values = []
+            for example in examples:
+                key = (field, example.get(field, ''))
+                if key not in batch_cache:
+                    hit_filters = cache.get(key)
+                    batch_cache[key] = hit_filters
+                    if hit_filters is None:
+                        values.append(key[1])
+            if not values:
+                continue
+            hits_list = [[[None] * count for count in self.filter_counts] for _ in values]
+            matcher.scan_many(values, hits_list)
+            for value, hits in zip(values, hits_list):
+                hit_filters = tuple((node_index, filter_index) for node_index, filter_index, _ in matcher.entries
+                                    if hits[node_index][filter_index])
+                batch_cache[(field, value)] = hit_filters
+                if len(cache) < self.route_cache_size:
+                    cache[(field, value)] = hit_filters
+        return [self.route(example, batch_cache) for example in examples]
+
+
+class FieldMatcher:
+    """
+    Matches the patterns of all filters on one field with a single combined expression. Patterns which can't be
+    embedded are searched one by one. Both run in the sandbox of the guard, unless they are cheap enough to run in this
+    thread, see Filter.is_inline.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._combine()
+
+    def _combine(self):
+        self.groups = []
+        self.standalone = []
+        self.timed_out = False
+        combinable = []
+        for node_index, filter_index, filter in self.entries:
+            if regex_guard.guard.has_timed_out(filter.pattern):
+                # left out, so it doesn't take the time budget of the other patterns
+                continue
+            if Classifier.standalone_pattern.search(filter.pattern):
+                self.standalone.append((node_index, filter_index, filter))
+            else:
+                combinable.append((node_index, filter_index, filter))
+
+        self.regex = None
+        self.degrees = {}
+        # longest value scanned in this thread and the ApiConfig.regex_inline_steps it was computed for
+        self.inline_steps = None
+        self.inline_length = -1
+        if combinable:
+            try:
+                self.regex = re.compile(''.join(rf'(?:(?=[\s\S]*?(?P<_f{index}>{filter.pattern})))?'
+                                                for index, (_, _, filter) in enumerate(combinable)))
+                self.groups = [(f'_f{index}', node_index, filter_index)
+                               for index, (node_index, filter_index, _) in enumerate(combinable)]
+                # patterns by the degree of their steps, see regex_guard.get_degree
+                for _, _, filter in combinable:
+                    self.degrees[filter.degree] = self.degrees.get(filter.degree, 0) + 1
+            except re.error:
+                # e.g. group names used by more than one pattern
+                self.standalone += combinable
+
+    def scan(self, value, hits, matrix=None):
+        if matrix is None:
+            self._scan(value, hits)
+            return
+
+        missing = []
+        for entry in self.entries:
+            node_index, filter_index, filter = entry
+            hit = matrix.get(filter, value)
+            if hit is None:
+                missing.append(entry)
+            else:
+                hits[node_index][filter_index] = hit
+
+        if len(missing) == len(self.entries):
+            self._scan(value, hits)
+            for node_index, filter_index, filter in self.entries:
+                matrix.set(filter, value, hits[node_index][filter_index])
+        else:
+            # only the changed filters of the level are evaluated again
+            for node_index, filter_index, filter in missing:
+                hits[node_index][filter_index] = matrix.hits(filter, value)
+
+    def _scan(self, value, hits):
+        """
+        Patterns, which ran out of time, are left None, so they are evaluated one by one and report the timeout.
+        """
+        if self.timed_out:
+            # the patterns evaluated one by one since tell which one to leave out
+            self._combine()
+        count_evaluations['classifier'](len(self.groups) + len(self.standalone))
+        if self.groups:
+            if self._is_inline(value):
+                match = self.regex.match(value)
+                for group, node_index, filter_index in self.groups:
+                    hits[node_index][filter_index] = match.start(group) != -1
+            else:
+                self._match_groups(value, hits)
+        for node_index, filter_index, filter in self.standalone:
+            try:
+                hits[node_index][filter_index] = filter.hits(value)
+            except regex_guard.PatternTimeout:
+                pass
+
+    def scan_many(self, values, hits_list):
+        """
+        Scans a batch of values like scan without a matrix. The values too expensive to scan in this thread are sent
+        to the sandbox together and share one time budget. If the batch runs out of time, they are scanned one by one,
+        so only the values running out of time are left None.
+        :type values: list(str)
+        :param hits_list: hits per value, see Classifier.evaluate
+        :type hits_list: list(list(list))
+        """
+        if self.timed_out:
+            self._combine()
+        count_evaluations['classifier'](len(values) * (len(self.groups) + len(self.standalone)))
+        if self.groups:
+            sandboxed = []
+            for value, hits in zip(values, hits_list):
+                if self._is_inline(value):
+                    match = self.regex.match(value)
+                    for group, node_index, filter_index in self.groups:
+                        hits[node_index][filter_index] = match.start(group) != -1
+                else:
+                    sandboxed.append((value, hits))
+            if sandboxed:
+                try:
+                    matched_list = regex_guard.guard.match_groups(self.regex.pattern,
+                                                                  [value for value, _ in sandboxed],
+                                                                  ApiConfig.regex_timeout,
+                                                                  ApiConfig.regex_quarantine_after)
+                    for matched, (_, hits) in zip(matched_list, sandboxed):
+                        matched = set(matched)
+                        for group, node_index, filter_index in self.groups:
+                            hits[node_index][filter_index] = group in matched
+                except regex_guard.PatternTimeout:
+                    for value, hits in sandboxed:
+                        self._match_groups(value, hits)
+        for node_index, filter_index, filter in self.standalone:
+            try:
+                results = filter.hits_many(values)
+            except regex_guard.PatternTimeout:
+                results = []
+                for value in values:
+                    try:
+                        results.append(filter.hits(value))
+                    except regex_guard.PatternTimeout:
+                        results.append(None)
+            for hits, hit in zip(hits_list, results):
+                hits[node_index][filter_index] = hit
+
+    def _is_inline(self, value):
+        if ApiConfig.regex_timeout is None:
+            return True
+        if self.inline_steps != ApiConfig.regex_inline_steps:
+            self.inline_steps = ApiConfig.regex_inline_steps
+            self.inline_length = self._get_inline_length(self.inline_steps)
+        return len(value) <= self.inline_length
+
+    def _get_inline_length(self, max_steps):
+        """
+        Every lookahead searches its pattern, the steps of the searches add up and grow with the length of the value.
+        :return: length of the longest value, whose steps stay within max_steps
+        :rtype: int|float
+        """
+        def get_steps(length):
+            return sum(count * (length + 1) ** degree for degree, count in self.degrees.items())
+
+        if not any(self.degrees):
+            return float('inf') if get_steps(0) <= max_steps else -1
+        # the steps of a value of length max_steps are more than max_steps
+        low, high = -1, max_steps
+        while low + 1 < high:
+            middle = (low + high) // 2
+            if get_steps(middle) <= max_steps:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def _match_groups(self, value, hits):
+        try:
+            matched = set(regex_guard.guard.match_groups(self.regex.pattern, value, ApiConfig.regex_timeout,
+                                                         ApiConfig.regex_quarantine_after))
+            for group, node_index, filter_index in self.groups:
+                hits[node_index][filter_index] = group in matched
+        except regex_guard.PatternTimeout:
+            self.timed_out = True
+
+
+class ResultMatrix:
+    """
+    Memoizes filter evaluations by field, pattern and example value. Rows are the patterns of a field and columns the
+    example values, so after an edit only the new patterns and the new example values are evaluated.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        # summaries of sample columns by field, pattern and column, see summarize_column
+        self.summaries = {}
+        self.size = 0
+        self.sweep_size = ApiConfig.matrix_sweep_size
+
+    def get(self, filter, value):
+        row = self.rows.get((filter.field, filter.pattern))
+        return None if row is None else row.get(value)
+
+    def set(self, filter, value, hit):
+        row = self.rows.setdefault((filter.field, filter.pattern), {})
+        if value not in row:
+            self.size += 1
+        row[value] = hit
+
+    def hits(self, filter, value):
+        row = self.rows.setdefault((filter.field, filter.pattern), {})
+        hit = row.get(value)
+        if hit is None:
+            count_evaluations['matrix']()
+            try:
+                hit = row[value] = filter.hits(value)
+            except regex_guard.PatternTimeout:
+                # not memoized, the match and miss reports evaluate it again and report the timeout
+                return None
+            self.size += 1
+        return hit
+
+    def hits_column(self, filter, values):
+        """
+        Evaluates a filter on a column of samples, the values without a memoized result are evaluated in one batch.
+        :type values: list(str)
+        :return: hits in the order of the values, None for missing values
+        :rtype: list(bool)
+        :raises PatternTimeout: if the pattern ran out of time or is quarantined
+        """
+        row = self.rows.setdefault((filter.field, filter.pattern), {})
+        missing = [value for value in dict.fromkeys(values) if value is not None and value not in row]
+        if missing:
+            count_evaluations['samples'](len(missing))
+            row.update(zip(missing, filter.hits_many(missing)))
+            self.size += len(missing)
+        return [None if value is None else row[value] for value in values]
+
+    def summarize_column(self, filter, column):
+        """
+        Counts the hits of a filter on a column of samples. Columns aren't changed once they belong to a node, so the
+        summary is memoized per column.
+        :type column: list(str)
+        :return: number of hits, number of values and the indices of the first values hit and missed
+        :rtype: tuple(int, int, tuple(int), tuple(int))
+        :raises PatternTimeout: if the pattern ran out of time or is quarantined
+        """
+        key = (filter.field, filter.pattern, id(column))
+        summary = self.summaries.get(key)
+        # the column is kept with its summary, so its id isn't reused
+        if summary is not None and summary[0] is column:
+            return summary[1]
+        hits = self.hits_column(filter, column)
+        hit_indices = [index for index, hit in enumerate(hits) if hit]
+        miss_indices = [index for index, hit in enumerate(hits) if hit is False]
+        result = (len(hit_indices), len(hit_indices) + len(miss_indices),
+                  tuple(hit_indices[:ApiConfig.reported_samples]), tuple(miss_indices[:ApiConfig.reported_samples]))
+        self.summaries[key] = (column, result)
+        return result
+
+    def sweep(self, nodes):
+        """
+        Drops the results of patterns and example values no node depends on anymore.
+        :param nodes: all nodes of the config
+        :type nodes: iterable(LogTree)
+        """
+        patterns = set()
+        values = {}
+        columns = set()
+        for node in nodes:
+            patterns.update((filter.field, filter.pattern) for filter in node.filters)
+            for field, value in node.example.items():
+                values.setdefault(field, set()).add(value)
+            for field, column in node.samples.columns.items():
+                values.setdefault(field, set()).update(column)
+                columns.add(id(column))
+
+        rows = {}
+        size = 0
+        for key, row in self.rows.items():
+            if key in patterns:
+                field_values = values.get(key[0], ())
+                rows[key] = {value: hit for value, hit in row.items() if value in field_values}
+                size += len(rows[key])
+        self.rows = rows
+        self.summaries = {key: summary for key, summary in self.summaries.items()
+                          if key[:2] in patterns and key[2] in columns}
+        self.size = size
+        self.sweep_size = max(ApiConfig.matrix_sweep_size, 2 * size)
+
+
 class ReportBySource:
+    """
+    Reports by their source, e.g. the id of a node or a server. Titles of sources are shown instead of the source.
+    """
+    __slots__ = ('registry', 'titles')
+
     def __init__(self, report=None, source='_default'):
         self.registry = {}
+        self.titles = {}
         if report:
             self.add(report, source)
 
-    def add(self, report, source='_default'):
+    def add(self, report, source='_default', title=None):
         if source not in self.registry:
             self.registry[source] = report
         else:
             self.registry[source] += report
+        if title is not None:
+            self.titles[source] = title
 
     def get_report_with_source(self, source_name):
         report = self.registry[source_name] if source_name in self.registry else None
@@ -353,6 +1806,41 @@ class ReportBySource:
                 self.registry[source] += report_registry.registry[source]
             else:
                 self.registry[source] = report_registry.registry[source]
+        self.titles.update(report_registry.titles)
+
+    def difference(self, other):
+        """
+        Returns the sources whose report differs from the one in the other registry. Sources missing in this registry
+        are returned with an empty report.
+        :type other: ReportBySource
+        :rtype: ReportBySource
+        """
+        delta = ReportBySource()
+        for source, report in self.registry.items():
+            previous = other.registry.get(source)
+            if previous is None or previous.entries != report.entries:
+                delta.registry[source] = report
+        for source in other.registry:
+            if source not in self.registry:
+                delta.registry[source] = Report()
+        delta.titles = {source: self.titles.get(source, other.titles.get(source)) for source in delta.registry
+                        if source in self.titles or source in other.titles}
+        return delta
+
+    def get_highest_status_code(self):
+        status = 0
+        for report in self.registry.values():
+            status = max(status, report.get_highest_status_code() or 0)
+        if status:
+            return status
+
+    def count_status_codes(self):
+        counts = {}
+        for report in self.registry.values():
+            for status in Status:
+                if report.counts[status]:
+                    counts[status.name] = counts.get(status.name, 0) + report.counts[status]
+        return counts
 
     def __iadd__(self, other):
         self.extend(other)
@@ -362,42 +1850,80 @@ class ReportBySource:
         return self.registry.__len__()
 
     def encode(self):
-        return [{'source': source, 'messages': report.encode()} for source, report in self.registry.items()]
+        encoded = []
+        for source, report in self.registry.items():
+            if source in self.titles:
+                encoded.append({'source': source, 'title': self.titles[source], 'messages': report.encode()})
+            else:
+                encoded.append({'source': source, 'messages': report.encode()})
+        return encoded
 
 
 class Report:
-
-    def __init__(self, message=None, status=Status.OK):
+    """
+    Messages and filter results with a count of the entries per status. Entries below the level of the report are
+    dropped before they are created.
+    """
+    __slots__ = ('entries', 'level', 'counts')
+    # counts are indexed by the status
+    count_size = max(Status) + 1
+
+    def __init__(self, message=None, status=Status.OK, level=None):
         self.entries = []
+        self.level = level
+        self.counts = [0] * Report.count_size
         if message:
             self.add(message, status)
 
     def add(self, message, status=Status.OK):
-        if status >= ApiConfig.report_level:
-            entry = Message(message, status)
-            self.entries.append(entry)
+        if status >= (self.level or ApiConfig.report_level):
+            self.entries.append(Message(message, status))
+            self.counts[status] += 1
+
+    def add_result(self, check, pattern, value, status):
+        """
+        Adds the result of testing a filter on an example, see FilterResult.
+        """
+        if status >= (self.level or ApiConfig.report_level):
+            self.entries.append(FilterResult(check, pattern, value, status))
+            self.counts[status] += 1
+
+    def add_sample_result(self, check, pattern, hits, total, failing, value, status):
+        """
+        Adds the result of testing a filter on samples, see SampleResult.
+        """
+        if status >= (self.level or ApiConfig.report_level):
+            self.entries.append(SampleResult(check, pattern, hits, total, failing, value, status))
+            self.counts[status] += 1
+
+    def count(self, status):
+        return self.counts[status]
 
     def get_highest_status_code(self):
-        status = 0
-        for entry in self.entries:
-            if entry.status.value > status:
-                status = entry.status.value
-        if status:
-            return status
+        for status in reversed(Status):
+            if self.counts[status]:
+                return status
 
     def get_messages_with_status_code(self, status):
-        report = Report()
-        for entry in self.entries:
-            if entry.status is status:
-                report.add(*entry)
+        report = Report(level=self.level)
+        report.entries = [entry for entry in self.entries if entry.status == status]
+        report.counts[status] = len(report.entries)
         return report
 
     def __iadd__(self, other):
         self.entries += other.entries
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
         return self
 
     def __len__(self):
         return self.entries.__len__()
 
     def encode(self):
-        return [{'message': entry.message, 'status': entry.status.name} for entry in self.entries]
+        encoded = []
+        for entry in self.entries:
+            if isinstance(entry, SampleResult):
+                encoded.append({'message': entry.message, 'status': entry.status.name, 'rate': entry.rate,
+                                'failing': list(entry.failing)})
+            else:
+                encoded.append({'message': entry.message, 'status': entry.status.name})
+        return encoded
@@ -0,0 +1,258 @@
+import re
+
+from collections import OrderedDict, namedtuple
+
+from lefci.model import Classifier
+
+
+# a node of the rendered config: the names of its filters, its destinations, whether it stops the evaluation of its
+# later siblings and its children
+LogPath = namedtuple('LogPath', ['id', 'title', 'filters', 'actions', 'final', 'children'])
+
+# literal characters and escaped punctuation, optionally anchored at the start and end
+LITERAL_PATTERN = re.compile(r'(\^?)((?:[^.^$*+?{}\[\]\\|()]|\\[^A-Za-z0-9])*)(\$?)', re.DOTALL)
+ESCAPE_PATTERN = re.compile(r'\\(.)', re.DOTALL)
+
+
+class Plan:
+    """
+    Filters and log paths of a config in the form they are rendered to syslog-ng. Filter expressions are nested tuples:
+
+    - ('match', field, type, value), type is 'pcre', 'substring' or 'prefix'
+    - ('not', expression)
+    - ('or', [expression, ...])
+    - ('filter', name), a reference to another filter
+    """
+
+    def __init__(self):
+        self.filters = OrderedDict()
+        self.log_paths = []
+
+    def route(self, example):
+        """
+        Routes an example through the log paths the way syslog-ng does.
+        :param example: example with the fields of ApiConfig.allowed_fields, missing fields are empty
+        :type example: dict
+        :return: ids of the nodes the example reaches, in order
+        :rtype: list(str)
+        """
+        reached = []
+        self._route(self.log_paths, example, reached)
+        return reached
+
+    def evaluate(self, expression, example):
+        operator = expression[0]
+        if operator == 'match':
+            _, field, match_type, value = expression
+            field_value = example.get(field, '')
+            if match_type == 'substring':
+                return value in field_value
+            if match_type == 'prefix':
+                return field_value.startswith(value)
+            return re.search(value, field_value) is not None
+        if operator == 'not':
+            return not self.evaluate(expression[1], example)
+        if operator == 'or':
+            return any(self.evaluate(operand, example) for operand in expression[1])
+        return self.evaluate(self.filters[expression[1]], example)
+
+    def _route(self, log_paths, example, reached):
+        for log_path in log_paths:
+            if all(self.evaluate(self.filters[name], example) for name in log_path.filters):
+                reached.append(log_path.id)
+                self._route(log_path.children, example, reached)
+                if log_path.final:
+                    break
+
+
+def get_literal(pattern):
+    """
+    Parses a pattern, which only matches literal text.
+    :type pattern: str
+    :return: the text, whether the pattern is anchored at the start and at the end or None, if the pattern isn't literal
+    :rtype: tuple(str, bool, bool)
+    """
+    match = LITERAL_PATTERN.fullmatch(pattern)
+    if not match:
+        return None
+    start, text, end = match.groups()
+    return ESCAPE_PATTERN.sub(r'\1', text), bool(start), bool(end)
+
+
+def create_match(filter):
+    """
+    Matches literal patterns by string comparison instead of PCRE. Patterns anchored at the end stay PCRE, as $ also
+    matches before a final line break.
+    :type filter: Filter
+    :rtype: tuple
+    """
+    literal = get_literal(filter.pattern)
+    if literal and literal[0] and not literal[2]:
+        return 'match', filter.field, 'prefix' if literal[1] else 'substring', literal[0]
+    return 'match', filter.field, 'pcre', filter.pattern
+
+
+def merge_matches(filters):
+    """
+    Combines the patterns of filters of the same field into one alternation, which syslog-ng evaluates in one pass.
+    Patterns which can't be embedded into another one are kept apart.
+    :type filters: list(Filter)
+    :rtype: list(tuple)
+    """
+    matches = []
+    patterns_by_field = OrderedDict()
+    for filter in filters:
+        if Classifier.standalone_pattern.search(filter.pattern):
+            matches.append(create_match(filter))
+        else:
+            patterns_by_field.setdefault(filter.field, OrderedDict())[filter.pattern] = filter
+
+    for field, patterns in patterns_by_field.items():
+        if len(patterns) == 1:
+            matches.append(create_match(next(iter(patterns.values()))))
+            continue
+        alternation = '|'.join(f'(?:{pattern})' for pattern in patterns)
+        try:
+            re.compile(alternation)
+            matches.append(('match', field, 'pcre', alternation))
+        except re.error:
+            # e.g. group names used by more than one pattern
+            matches += [create_match(filter) for filter in patterns.values()]
+    return matches
+
+
+def get_bounds(filter):
+    """
+    Returns the text a filter anchored at the start requires the value to start with and whether it requires the value
+    to be exactly that text, or None if the filter isn't anchored at the start.
+    """
+    literal = get_literal(filter.pattern)
+    if not literal or not literal[1]:
+        return None
+    return literal[0], literal[2]
+
+
+def are_exclusive(node, other):
+    """
+    Checks whether no message can reach both nodes. Catch-alls only hit if no other filter of the level did, anchored
+    literals exclude each other if neither allows the other's text.
+    :type node: LogTree
+    :type other: LogTree
+    :rtype: bool
+    """
+    for first, second in ((node, other), (other, node)):
+        has_catch_all = any(filter.field == 'unknown' for filter in first.filters)
+        if has_catch_all and any(filter.field != 'unknown' for filter in second.filters):
+            return True
+
+    for filter in node.filters:
+        bounds = get_bounds(filter)
+        if bounds is None:
+            continue
+        for other_filter in other.filters:
+            other_bounds = get_bounds(other_filter)
+            if other_bounds is None or other_filter.field != filter.field:
+                continue
+            if not bounds_overlap(bounds, other_bounds) and not bounds_overlap(other_bounds, bounds):
+                return True
+    return False
+
+
+def bounds_overlap(bounds, other_bounds):
+    text, exact = bounds
+    other_text, other_exact = other_bounds
+    if exact and other_exact:
+        # $ also matches before a final line break
+        return text == other_text or text + '\n' == other_text
+    if exact:
+        return text.startswith(other_text) or (text + '\n').startswith(other_text)
+    if other_exact:
+        return False
+    return text.startswith(other_text)
+
+
+def create_plan(config, optimize=True, hits=None):
+    """
+    Translates a config into the filters and log paths of syslog-ng.
+
+    Unoptimized, every filter is a PCRE and every catch-all repeats all filters of its level. Optimized, literal
+    patterns are string matches, every level has at most one catch-all filter with the patterns of each field merged,
+    and log paths which exclude all of their later siblings stop the evaluation with flags(final).
+    :type config: Config
+    :type optimize: bool
+    :param hits: messages per node id, optimized siblings are ordered by them, so the busiest log paths are evaluated
+                 first. Without flags(final) the order doesn't change the routing and the flags are set for the new
+                 order, so ordering never does either.
+    :type hits: dict
+    :rtype: Plan
+    """
+    plan = Plan()
+    plan.log_paths = create_log_paths(plan, config.log_trees, 'root', optimize, hits if optimize else None)
+    return plan
+
+
+def order_by_hits(nodes, hits):
+    # sorting is stable, nodes without hits keep their order behind the others
+    return sorted(nodes, key=lambda node: -(hits.get(node.id) or 0))
+
+
+def create_log_paths(plan, nodes, level, optimize, hits=None):
+    if hits:
+        nodes = order_by_hits(nodes, hits)
+    level_filters = [filter for node in nodes for filter in node.filters if filter.field != 'unknown']
+    catch_all = None
+    if optimize and level_filters and any(filter.field == 'unknown' for node in nodes for filter in node.filters):
+        catch_all = f'f_{level}_catchall'
+        plan.filters[catch_all] = ('not', ('or', merge_matches(level_filters)))
+
+    log_paths = []
+    for position, node in enumerate(nodes):
+        names = []
+        for index, filter in enumerate(node.filters, 1):
+            name = f'f_{node.id}_{index}'
+            if filter.field != 'unknown':
+                plan.filters[name] = create_match(filter) if optimize else ('match', filter.field, 'pcre', filter.pattern)
+            elif not level_filters:
+                # nothing to fall through, the catch-all hits everything
+                continue
+            elif optimize:
+                name = catch_all
+            else:
+                plan.filters[name] = ('not', ('or', [('filter', f'f_{sibling.id}_{sibling_index}')
+                                                     for sibling in nodes
+                                                     for sibling_index, sibling_filter in enumerate(sibling.filters, 1)
+                                                     if sibling_filter.field != 'unknown']))
+            if name not in names:
+                names.append(name)
+
+        later_siblings = nodes[position + 1:]
+        final = optimize and bool(later_siblings) and all(are_exclusive(node, sibling) for sibling in later_siblings)
+        children = create_log_paths(plan, node.children, node.id, optimize, hits)
+        log_paths.append(LogPath(node.id, node.title, names, node.actions, final, children))
+    return log_paths
+
+
+def quote(value):
+    # single quoted strings keep backslashes of patterns as they are, but can't contain single quotes
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def render_expression(expression):
+    """
+    Renders a filter expression to syslog-ng.
+    :type expression: tuple
+    :rtype: str
+    """
+    operator = expression[0]
+    if operator == 'match':
+        _, field, match_type, value = expression
+        if match_type == 'pcre':
+            return f'{field}({quote(value)})'
+        return f'{field}({quote(value)} type(string) flags({match_type}))'
+    if operator == 'not':
+        return f'not ({render_expression(expression[1])})'
+    if operator == 'or':
+        return ' or '.join(render_expression(operand) for operand in expression[1])
+    return f'filter({expression[1]})'
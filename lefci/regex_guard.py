@@ -0,0 +1,337 @@
+import math
+import multiprocessing
+import os
+import queue
+import re
+import string
+import threading
+
+from functools import lru_cache
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    # before Python 3.11
+    import sre_parse
+    import sre_constants
+
+from lefci import metrics
+
+# both constructs need a group repeated without upper bound
+REPEATED_GROUP = re.compile(r'\)(?:[*+]|\{\d*,\})')
+# quantifiers and back references in the first group, escaped characters and group extensions aren't counted
+REPETITION = re.compile(r'([*+?{]|\\[1-9]|\(\?P=)|\\.|\(\?')
+REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, 'POSSESSIVE_REPEAT', None))
+CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: lambda char: char.isdigit(),
+    sre_constants.CATEGORY_NOT_DIGIT: lambda char: not char.isdigit(),
+    sre_constants.CATEGORY_SPACE: lambda char: char.isspace(),
+    sre_constants.CATEGORY_NOT_SPACE: lambda char: not char.isspace(),
+    sre_constants.CATEGORY_WORD: lambda char: char.isalnum() or char == '_',
+    sre_constants.CATEGORY_NOT_WORD: lambda char: not (char.isalnum() or char == '_'),
+}
+
+
+class PatternTimeout(Exception):
+    pass
+
+
+@lru_cache(maxsize=4096)
+def screen_pattern(pattern):
+    """
+    Looks for constructs, which make the backtracking of a pattern take exponential time on some values: a repetition
+    inside a repetition, which can match the text between the repeated parts, e.g. (a+)+ or (\\w+\\s?)*, and a
+    repetition of alternatives, which can start with the same character, e.g. (a|ab)*. Atomic groups and possessive
+    repetitions don't backtrack and are skipped.
+    :param pattern: a valid regular expression
+    :type pattern: str
+    :return: the reason the pattern is dangerous or None
+    :rtype: str
+    """
+    if not REPEATED_GROUP.search(pattern):
+        return None
+    parsed = sre_parse.parse(pattern)
+    literals = {chr(av) for op, av in _walk(parsed) if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL)}
+    return _screen(parsed, set(string.printable) | literals)
+
+
+def get_degree(pattern):
+    """
+    Estimates the backtracking steps of searching a pattern in a value as (length + 1) ** degree: the start positions
+    times the ways every repetition and back reference can split the value. Every quantifier counts, also optional,
+    lazy and bounded ones and the ones in character sets, which overestimates but needs no parsing. The estimate is
+    only an upper bound for patterns screen_pattern accepts, the degree of the others is infinite.
+    :param pattern: a valid regular expression
+    :type pattern: str
+    :rtype: int or float
+    """
+    if screen_pattern(pattern):
+        return math.inf
+    return sum(1 for repetition in REPETITION.findall(pattern) if repetition) + 1
+
+
+def _walk(items):
+    for op, av in items:
+        yield op, av
+        for children in _get_children(op, av):
+            yield from _walk(children)
+
+
+def _get_children(op, av):
+    if op in REPEATS:
+        return [av[2]]
+    if op is sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op is sre_constants.BRANCH:
+        return av[1]
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    if op is sre_constants.GROUPREF_EXISTS:
+        return [branch for branch in av[1:] if branch]
+    if op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+        return [av]
+    return []
+
+
+def _screen(items, chars, repeated=None):
+    """
+    :param repeated: the items of the enclosing unbounded repetition
+    """
+    for op, av in items:
+        if op is getattr(sre_constants, 'ATOMIC_GROUP', None) or op is getattr(sre_constants, 'POSSESSIVE_REPEAT', None):
+            continue
+        if op in REPEATS and av[1] == sre_constants.MAXREPEAT:
+            body = av[2]
+            if repeated is not None and not _has_separator(repeated, body, chars):
+                return 'a repetition is nested in a repetition'
+            branches = _get_branches(body)
+            for index, branch in enumerate(branches):
+                first = _get_first_chars(branch, chars)
+                if any(first & _get_first_chars(other, chars) for other in branches[index + 1:]):
+                    return 'a repetition of alternatives, which can start with the same character'
+            reason = _screen(body, chars, body)
+        else:
+            reason = None
+            for children in _get_children(op, av):
+                reason = reason or _screen(children, chars, repeated)
+        if reason:
+            return reason
+    return None
+
+
+def _has_separator(repeated, body, chars):
+    # a required literal of the outer repetition, which the inner one can't match, separates the repeated parts
+    body_chars = _get_chars(body, chars)
+    for op, av in _get_sequence(repeated):
+        if op is sre_constants.LITERAL and chr(av) not in body_chars:
+            return True
+    return False
+
+
+def _get_sequence(items):
+    # groups are matched in sequence with the items around them
+    for op, av in items:
+        if op is sre_constants.SUBPATTERN:
+            yield from _get_sequence(av[-1])
+        else:
+            yield op, av
+
+
+def _get_branches(items):
+    while len(items) == 1 and items[0][0] is sre_constants.SUBPATTERN:
+        items = items[0][1][-1]
+    if len(items) == 1 and items[0][0] is sre_constants.BRANCH:
+        return items[0][1][1]
+    return []
+
+
+def _get_first_chars(items, chars):
+    first = set()
+    for op, av in items:
+        if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            continue
+        first |= _get_item_chars(op, av, chars, first_only=True)
+        if not (op in REPEATS and av[0] == 0):
+            break
+    return first
+
+
+def _get_chars(items, chars):
+    result = set()
+    for op, av in items:
+        result |= _get_item_chars(op, av, chars)
+    return result
+
+
+def _get_item_chars(op, av, chars, first_only=False):
+    """
+    Returns the characters of the sample an item can match.
+    """
+    if op is sre_constants.LITERAL:
+        return {chr(av)}
+    if op is sre_constants.NOT_LITERAL:
+        return chars - {chr(av)}
+    if op is sre_constants.ANY:
+        return chars - {'\n'}
+    if op is sre_constants.IN:
+        return {char for char in chars if _in_set(av, char)}
+    if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+        return set(chars)
+    result = set()
+    for children in _get_children(op, av):
+        result |= _get_first_chars(children, chars) if first_only else _get_chars(children, chars)
+    return result
+
+
+def _in_set(items, char):
+    negate = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL and chr(av) == char:
+            return not negate
+        elif op is sre_constants.RANGE and av[0] <= ord(char) <= av[1]:
+            return not negate
+        elif op is sre_constants.CATEGORY and CATEGORIES.get(av, lambda char: True)(char):
+            return not negate
+    return negate
+
+
+def _serve(connection):
+    while True:
+        try:
+            pattern, value, groups = connection.recv()
+        except EOFError:
+            return
+        if groups:
+            regex = re.compile(pattern)
+            if isinstance(value, list):
+                connection.send([_get_groups(regex, item) for item in value])
+            else:
+                connection.send(_get_groups(regex, value))
+        elif isinstance(value, list):
+            search = re.compile(pattern).search
+            connection.send([search(item) is not None for item in value])
+        else:
+            connection.send(re.search(pattern, value) is not None)
+
+
+def _get_groups(regex, value):
+    match = regex.match(value)
+    return [name for name in regex.groupindex if match.start(name) != -1] if match else []
+
+
+class Sandbox:
+    """
+    Process which evaluates patterns for one thread at a time and is killed if a pattern runs out of time.
+    """
+
+    def __init__(self):
+        self.owner = os.getpid()
+        self.connection = None
+        self.process = None
+
+    def search(self, pattern, value, timeout, groups=False):
+        """
+        :param value: a value or a list of values, which are evaluated in one batch under the timeout
+        :param groups: match the pattern at the start of the value and return the names of the groups taking part
+        :return: whether the pattern hits the value, a list of the hits of the values, a list of group names or a list
+                 of the group names of the values
+        """
+        if self.process is None:
+            # forked, so the process starts without importing the application again
+            context = multiprocessing.get_context('fork')
+            self.connection, child_connection = context.Pipe()
+            self.process = context.Process(target=_serve, args=(child_connection,), daemon=True)
+            self.process.start()
+            child_connection.close()
+
+        self.connection.send((pattern, value, groups))
+        if not self.connection.poll(timeout):
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+            self.process = None
+            raise PatternTimeout(f"Filter '{pattern}' ran out of its time budget of {timeout} seconds")
+        return self.connection.recv()
+
+
+class Guard:
+    """
+    Evaluates patterns in sandbox processes under a time budget. A pattern which runs out of time a given number of
+    times is quarantined and not evaluated anymore. Values a pattern already ran out of time on count as another
+    timeout right away, instead of spending the budget again.
+    """
+    timed_out_size = 1024
+
+    def __init__(self):
+        self.timeouts = {}
+        self.timed_out = set()
+        self._sandboxes = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def has_timed_out(self, pattern):
+        return pattern in self.timeouts
+
+    def is_quarantined(self, pattern, limit):
+        return self.timeouts.get(pattern, 0) >= limit
+
+    def search(self, pattern, value, timeout, limit):
+        """
+        :param value: a value or a list of values, which are evaluated in one batch
+        :type value: str or list(str)
+        :param timeout: seconds a single evaluation or batch may take
+        :type timeout: float
+        :param limit: timeouts after which the pattern is quarantined
+        :type limit: int
+        :return: whether the pattern hits the value or a list of the hits of the values
+        :rtype: bool or list(bool)
+        :raises PatternTimeout: if the pattern ran out of time or is quarantined
+        """
+        return self._evaluate(pattern, value, timeout, limit, False)
+
+    def match_groups(self, pattern, value, timeout, limit):
+        """
+        Matches a pattern at the start of a value or of a list of values in one batch, see search.
+        :return: names of the named groups, which took part in the match, or a list of them per value
+        :rtype: list(str) or list(list(str))
+        :raises PatternTimeout: if the pattern ran out of time or is quarantined
+        """
+        return self._evaluate(pattern, value, timeout, limit, True)
+
+    def _evaluate(self, pattern, value, timeout, limit, groups):
+        if self.is_quarantined(pattern, limit):
+            raise PatternTimeout(f"Filter '{pattern}' is quarantined after running out of time {limit} times")
+        # batches aren't remembered, the timeouts of their pattern quarantine it
+        batch = isinstance(value, list)
+        if not batch and (pattern, value) in self.timed_out:
+            self._add_timeout(pattern, value)
+            raise PatternTimeout(f"Filter '{pattern}' ran out of its time budget of {timeout} seconds")
+        try:
+            sandbox = self._sandboxes.get_nowait()
+        except queue.Empty:
+            sandbox = Sandbox()
+        if sandbox.owner != os.getpid():
+            # inherited from the parent of a forked worker
+            sandbox = Sandbox()
+        try:
+            return sandbox.search(pattern, value, timeout, groups)
+        except PatternTimeout:
+            self._add_timeout(pattern, None if batch else value)
+            raise
+        finally:
+            self._sandboxes.put(sandbox)
+
+    def _add_timeout(self, pattern, value):
+        metrics.inc('lefci_regex_timeouts_total')
+        with self._lock:
+            self.timeouts[pattern] = self.timeouts.get(pattern, 0) + 1
+            if value is None:
+                return
+            if len(self.timed_out) >= self.timed_out_size:
+                self.timed_out.clear()
+            self.timed_out.add((pattern, value))
+
+
+guard = Guard()
@@ -0,0 +1,198 @@
+import argparse
+import json
+import mmap
+import re
+import sys
+
+from os.path import isfile
+
+from lefci.model import Config, State
+
+
+# <pri>Mmm dd hh:mm:ss host program[pid]: message, the timestamp may also be ISO 8601
+RFC3164_PATTERN = re.compile(r'(?:<\d{1,3}>)?(?:[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d|\d{4}-\d\d-\d\dT\S+) '
+                             r'(\S+) ([^\s:\[]+)(?:\[[^\]]*\])?: ?(.*)', re.DOTALL)
+# <pri>version timestamp host app procid msgid structured-data message
+RFC5424_PATTERN = re.compile(r'<\d{1,3}>\d{1,2} \S+ (\S+) (\S+) \S+ \S+ (?:-|(?:\[.*?\])+) ?(.*)', re.DOTALL)
+
+
+def parse_line(line):
+    """
+    Splits a syslog line into the fields filters can match on. Lines in an unknown format are taken as message.
+    :type line: str
+    :return: record with the fields of ApiConfig.allowed_fields
+    :rtype: dict
+    """
+    match = RFC3164_PATTERN.match(line) or RFC5424_PATTERN.match(line)
+    if match:
+        host, program, message = match.groups()
+        return {'host': host, 'program': program, 'message': message}
+    return {'host': '', 'program': '', 'message': line}
+
+
+def read_lines(filepath, chunk_size=1 << 24):
+    """
+    Reads a log file through a memory map in chunks, which end at a line break, so only one chunk is held in memory.
+    :type filepath: str
+    :param chunk_size: bytes per chunk
+    :return: decoded lines without line breaks
+    :rtype: generator(str)
+    """
+    with open(filepath, 'rb') as file:
+        try:
+            log_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return
+        with log_map:
+            start = 0
+            size = len(log_map)
+            while start < size:
+                end = log_map.find(b'\n', min(start + chunk_size, size) - 1)
+                end = size if end == -1 else end + 1
+                for line in log_map[start:end].decode('utf-8', 'replace').split('\n'):
+                    line = line.rstrip('\r')
+                    if line:
+                        yield line
+                start = end
+
+
+class ReplayResult:
+
+    def __init__(self):
+        self.lines = 0
+        self.unmatched = 0
+        self.nodes = {}
+
+    def get_counters(self, node):
+        counters = self.nodes.get(node.id)
+        if counters is None:
+            counters = self.nodes[node.id] = {'title': node.title, 'hits': 0, 'fall_through': 0, 'multiple': 0}
+        return counters
+
+    def encode(self):
+        return {
+            'lines': self.lines,
+            'unmatched': self.unmatched,
+            'nodes': [dict(id=uuid, **counters) for uuid, counters in self.nodes.items()],
+        }
+
+
+class Simulator:
+    """
+    Routes log records down the trees of a config the way the rendered syslog-ng configuration does and counts per
+    node the records it caught, the records which fell through all of its children and the records which were also
+    caught by a sibling. Records are routed in batches, a batch is held in memory until it is counted.
+    """
+
+    def __init__(self, config, batch_size=1000):
+        """
+        :param batch_size: records routed together, each level evaluates its patterns on them in one batch
+        :type batch_size: int
+        """
+        self.config = config
+        self.batch_size = batch_size
+        self.result = ReplayResult()
+        # the config doesn't change during a replay, so the classifiers are looked up once
+        self.root_level = (config.log_trees, config.get_classifier(), {})
+        self.levels = {}
+        nodes = list(config.log_trees)
+        while nodes:
+            node = nodes.pop()
+            if node.children:
+                self.levels[node.id] = (node.children, node.get_classifier(), {})
+                nodes += node.children
+
+    def replay_file(self, filepath):
+        return self.replay_lines(read_lines(filepath))
+
+    def replay_lines(self, lines):
+        records = []
+        for line in lines:
+            records.append(parse_line(line))
+            if len(records) >= self.batch_size:
+                self.replay_many(records)
+                records = []
+        if records:
+            self.replay_many(records)
+        return self.result
+
+    def replay(self, record):
+        self.result.lines += 1
+        if not self._route(self.root_level, record):
+            self.result.unmatched += 1
+
+    def replay_many(self, records):
+        """
+        Routes a batch of records level by level, see Classifier.route_many.
+        :type records: list(dict)
+        """
+        self.result.lines += len(records)
+        for indices in self._route_many(self.root_level, records):
+            if not indices:
+                self.result.unmatched += 1
+
+    def _route(self, level, record):
+        nodes, classifier, cache = level
+        indices = classifier.route(record, cache)
+        for index in indices:
+            node = nodes[index]
+            counters = self.result.get_counters(node)
+            counters['hits'] += 1
+            if len(indices) > 1:
+                counters['multiple'] += 1
+            if node.children and not self._route(self.levels[node.id], record):
+                counters['fall_through'] += 1
+        return indices
+
+    def _route_many(self, level, records):
+        nodes, classifier, cache = level
+        routed = classifier.route_many(records, cache)
+        # the records caught by a node with children are routed down together
+        caught = {}
+        for record, indices in zip(records, routed):
+            for index in indices:
+                counters = self.result.get_counters(nodes[index])
+                counters['hits'] += 1
+                if len(indices) > 1:
+                    counters['multiple'] += 1
+                if nodes[index].children:
+                    caught.setdefault(index, []).append(record)
+        for index, node_records in caught.items():
+            node = nodes[index]
+            counters = self.result.get_counters(node)
+            for indices in self._route_many(self.levels[node.id], node_records):
+                if not indices:
+                    counters['fall_through'] += 1
+        return routed
+
+
+def load_config(config):
+    if isfile(config):
+        with open(config, 'r') as file:
+            return Config(**json.load(file))
+    return State().get_config(config)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Routes the lines of a syslog file through a lefci config.')
+    parser.add_argument('config', help='name of a saved config or path to a config file')
+    parser.add_argument('logfile', help='syslog file to replay')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args(args)
+
+    config = load_config(args.config)
+    result = Simulator(config).replay_file(args.logfile)
+    if args.json:
+        print(json.dumps(result.encode()))
+        return
+
+    print(f'{result.lines} lines, {result.unmatched} unmatched')
+    print(f"{'hits':>10} {'fall through':>12} {'multiple':>10}  node")
+    for uuid, counters in result.nodes.items():
+        print(f"{counters['hits']:>10} {counters['fall_through']:>12} {counters['multiple']:>10}  "
+              f"{counters['title']} ({uuid})")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
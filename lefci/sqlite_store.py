@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from uuid import uuid4
+
+from lefci import metrics
+from lefci.model import Config, JsonStore, LogTree
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    config TEXT NOT NULL REFERENCES configs (name) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    parent TEXT,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (config, id)
+);
+CREATE INDEX IF NOT EXISTS nodes_by_parent ON nodes (config, parent, position);
+"""
+
+
+class SqliteStore:
+    """
+    Keeps configs in SQLite with one row per node, so adding, updating or deleting a node only writes the rows of the
+    node, its descendants and the positions of its siblings. Every change runs in one transaction and stores a new
+    version stamp for the config.
+    """
+
+    def __init__(self, path='lefci.db'):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+            columns = [row[1] for row in connection.execute('PRAGMA table_info (configs)')]
+            if 'version' not in columns:
+                connection.execute("ALTER TABLE configs ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA foreign_keys = ON')
+            self._local.connection = connection
+        return connection
+
+    def list_configs(self):
+        return [row[0] for row in self._connect().execute('SELECT name FROM configs ORDER BY rowid')]
+
+    def get_lock_path(self, config_name):
+        directory, file_name = os.path.split(os.path.abspath(self.path))
+        return os.path.join(directory, f'.{file_name}.{config_name.replace(os.sep, "_")}.lock')
+
+    def delete_config(self, config_name):
+        with self._connect() as connection:
+            cursor = connection.execute('DELETE FROM configs WHERE name = ?', (config_name,))
+            if not cursor.rowcount:
+                raise KeyError(f'No config {config_name} saved')
+
+    def save_config(self, config):
+        with self._connect() as connection:
+            self._write_config(connection, config)
+            connection.execute('DELETE FROM nodes WHERE config = ?', (config.name,))
+            rows = []
+            for position, tree in enumerate(config.log_trees):
+                rows += self._get_rows(config, tree, position, subtree=True)
+            connection.executemany('INSERT INTO nodes VALUES (?, ?, ?, ?, ?)', rows)
+            metrics.observe('lefci_save_config_bytes', sum(len(row[4]) for row in rows))
+            return self._write_version(connection, config)
+
+    def save_node(self, config, node, subtree=True, previous_id=None):
+        with self._connect() as connection:
+            if previous_id is not None and previous_id != node.id:
+                # the rows of the descendants still reference the old id, so the whole subtree is written again
+                self._delete_descendants(connection, config, previous_id)
+                connection.execute('DELETE FROM nodes WHERE config = ? AND id = ?', (config.name, previous_id))
+                subtree = True
+            if subtree:
+                # the children in memory may have been replaced, so the persisted descendants are removed
+                self._delete_descendants(connection, config, node.id)
+            siblings = node.parent.children if node.parent else config.log_trees
+            position = siblings.index(node)
+            connection.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)',
+                                   self._get_rows(config, node, position, subtree))
+            self._write_positions(connection, config, siblings)
+            return self._write_version(connection, config)
+
+    def delete_node(self, config, node):
+        with self._connect() as connection:
+            self._delete_descendants(connection, config, node.id)
+            connection.execute('DELETE FROM nodes WHERE config = ? AND id = ?', (config.name, node.id))
+            return self._write_version(connection, config)
+
+    def save_changes(self, config, changes):
+        """
+        Writes the nodes and positions changed by Config.apply_operations in one transaction.
+        :type changes: TreeChanges
+        """
+        with self._connect() as connection:
+            # removed first, a node moved out of a deleted subtree is written again below
+            for uuid in changes.deleted:
+                self._delete_descendants(connection, config, uuid)
+                connection.execute('DELETE FROM nodes WHERE config = ? AND id = ?', (config.name, uuid))
+            rows = []
+            for node, subtree in changes.saved.items():
+                if config.find_tree(node.id) is not node:
+                    continue
+                if subtree:
+                    self._delete_descendants(connection, config, node.id)
+                siblings = node.parent.children if node.parent else config.log_trees
+                rows += self._get_rows(config, node, siblings.index(node), subtree)
+            connection.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)', rows)
+            for parent in changes.levels:
+                if parent is None:
+                    self._write_positions(connection, config, config.log_trees)
+                elif config.find_tree(parent.id) is parent:
+                    self._write_positions(connection, config, parent.children)
+            return self._write_version(connection, config)
+
+    def get_version(self, config_name):
+        row = self._connect().execute('SELECT version FROM configs WHERE name = ?', (config_name,)).fetchone()
+        if row is None:
+            raise KeyError(f'No config {config_name} saved')
+        return row[0]
+
+    def load_config(self, config_name):
+        connection = self._connect()
+        row = connection.execute('SELECT data FROM configs WHERE name = ?', (config_name,)).fetchone()
+        if row is None:
+            raise KeyError(f'No config {config_name} saved')
+
+        nodes = {}
+        children = {}
+        rows = connection.execute('SELECT id, parent, data FROM nodes WHERE config = ? ORDER BY position',
+                                  (config_name,))
+        for uuid, parent, data in rows:
+            nodes[uuid] = LogTree(id=uuid, **json.loads(data))
+            children.setdefault(parent, []).append(nodes[uuid])
+        for parent, nodes_of_parent in children.items():
+            if parent is not None:
+                for node in nodes_of_parent:
+                    nodes[parent].add_tree(node)
+
+        config = Config(name=config_name, **json.loads(row[0]))
+        for tree in children.get(None, []):
+            config.add_tree(tree)
+        return config
+
+    def import_json(self, path='configs'):
+        """
+        Imports all configs of a JSON store directory.
+        :return: names of the imported configs
+        :rtype: list(str)
+        """
+        json_store = JsonStore(path)
+        names = json_store.list_configs()
+        for name in names:
+            self.save_config(json_store.load_config(name))
+        return names
+
+    def _write_config(self, connection, config):
+        data = config.encode()
+        data.pop('name')
+        data.pop('log_trees')
+        connection.execute('INSERT INTO configs (name, data) VALUES (?, ?) '
+                           'ON CONFLICT (name) DO UPDATE SET data = excluded.data', (config.name, json.dumps(data)))
+
+    def _write_version(self, connection, config):
+        version = uuid4().hex
+        connection.execute('UPDATE configs SET version = ? WHERE name = ?', (version, config.name))
+        return version
+
+    def _write_positions(self, connection, config, siblings):
+        connection.executemany('UPDATE nodes SET position = ? WHERE config = ? AND id = ? AND position != ?',
+                               [(position, config.name, node.id, position) for position, node in enumerate(siblings)])
+
+    def _get_rows(self, config, node, position, subtree):
+        data = node.encode(children=False)
+        data.pop('id')
+        rows = [(config.name, node.id, node.parent.id if node.parent else None, position, json.dumps(data))]
+        if subtree:
+            for child_position, child in enumerate(node.children):
+                rows += self._get_rows(config, child, child_position, subtree)
+        return rows
+
+    def _delete_descendants(self, connection, config, uuid):
+        connection.execute('''
+            WITH RECURSIVE descendants (id) AS (
+                SELECT id FROM nodes WHERE config = :config AND parent = :id
+                UNION ALL
+                SELECT nodes.id FROM nodes JOIN descendants ON nodes.parent = descendants.id
+                WHERE nodes.config = :config
+            )
+            DELETE FROM nodes WHERE config = :config AND id IN descendants
+        ''', {'config': config.name, 'id': uuid})
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Imports the JSON configs of lefci into a SQLite database.')
+    parser.add_argument('--configs', default='configs', help='directory of the JSON configs')
+    parser.add_argument('--database', default=os.environ.get('LEFCI_DATABASE', 'lefci.db'), help='SQLite database')
+    args = parser.parse_args(args)
+
+    names = SqliteStore(args.database).import_json(args.configs)
+    print(f'Imported {len(names)} configs into {args.database}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
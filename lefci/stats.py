@@ -0,0 +1,205 @@
+import argparse
+import fcntl
+import json
+import os
+import re
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lefci import deploy
+from lefci.model import ApiConfig, Report, ReportBySource, Status, compact_encoder
+from lefci.optimize import create_plan
+from lefci.replay import load_config
+
+# filters are named f_<node id>_<filter number> or f_<parent id>_catchall
+FILTER_NAME = re.compile(r'f_(.+)_(\d+|catchall)')
+
+
+def parse_stats(text):
+    """
+    Reads the matched counters of the lefci filters from the output of syslog-ng-ctl stats, which has the columns
+    SourceName;SourceId;SourceInstance;State;Type;Number.
+    :type text: str
+    :return: matched messages per filter name
+    :rtype: dict
+    """
+    counters = {}
+    for line in text.splitlines():
+        columns = line.split(';')
+        if len(columns) != 6 or columns[4] != 'matched':
+            continue
+        for name in columns[1:3]:
+            if FILTER_NAME.fullmatch(name):
+                try:
+                    counters[name] = counters.get(name, 0) + int(columns[5])
+                except ValueError:
+                    pass
+                break
+    return counters
+
+
+def map_counters(config, counters):
+    """
+    Maps filter counters to the nodes of a config. A log path evaluates its filters in order, so the counter of its
+    last filter counts the messages the node caught. Catch-alls are shared by the log paths of a level and their
+    counter is split between them.
+    :type config: Config
+    :param counters: matched messages per filter name
+    :type counters: dict
+    :return: caught messages per node id
+    :rtype: dict
+    """
+    plan = create_plan(config, ApiConfig.optimize_filters)
+    log_paths = []
+    references = {}
+    stack = list(plan.log_paths)
+    while stack:
+        log_path = stack.pop()
+        stack += log_path.children
+        if log_path.filters:
+            log_paths.append(log_path)
+            references[log_path.filters[-1]] = references.get(log_path.filters[-1], 0) + 1
+
+    hits = {}
+    for log_path in log_paths:
+        name = log_path.filters[-1]
+        if name in counters:
+            hits[log_path.id] = counters[name] // references[name]
+    return hits
+
+
+def get_rate(series):
+    if len(series) < 2:
+        return None
+    (previous_time, previous_count), (current_time, current_count) = series[-2:]
+    if current_time <= previous_time:
+        return None
+    # counters start over when syslog-ng restarts
+    delta = current_count - previous_count if current_count >= previous_count else current_count
+    return delta / (current_time - previous_time)
+
+
+class StatsStore:
+    """
+    Keeps the hit counters of the nodes of a config as time series per server, one JSON file per config.
+    """
+
+    def __init__(self, path='stats', samples=None):
+        self.path = path
+        self.samples = samples or ApiConfig.stats_samples
+        os.makedirs(path, exist_ok=True)
+
+    def add_sample(self, config_name, server, hits, timestamp=None):
+        """
+        :param hits: caught messages per node id as counted by syslog-ng since its start
+        :type hits: dict
+        :param timestamp: seconds since the epoch, defaults to now
+        :type timestamp: float
+        """
+        timestamp = timestamp or time.time()
+        with self._lock(config_name):
+            nodes = self.load(config_name)
+            for uuid, count in hits.items():
+                series = nodes.setdefault(uuid, {}).setdefault(server, [])
+                series.append([timestamp, count])
+                del series[:-self.samples]
+            filepath = os.path.join(self.path, f'{config_name}.json')
+            tmp_filepath = os.path.join(self.path, f'.{config_name}.{os.getpid()}.tmp')
+            with open(tmp_filepath, 'w') as stats_file:
+                stats_file.write(compact_encoder.encode(nodes))
+            os.replace(tmp_filepath, filepath)
+
+    def load(self, config_name):
+        """
+        :return: per node id and server a list of timestamps and counters
+        :rtype: dict
+        """
+        try:
+            with open(os.path.join(self.path, f'{config_name}.json'), 'r') as stats_file:
+                return json.load(stats_file)
+        except FileNotFoundError:
+            return {}
+
+    def get_summary(self, config_name):
+        """
+        :return: per node id the latest counters summed over all servers and the current rate in messages per second
+        :rtype: dict
+        """
+        summary = {}
+        for uuid, servers in self.load(config_name).items():
+            rates = [get_rate(series) for series in servers.values()]
+            rates = [rate for rate in rates if rate is not None]
+            summary[uuid] = {
+                'hits': sum(series[-1][1] for series in servers.values()),
+                'rate': sum(rates) if rates else None,
+                'series': servers,
+            }
+        return summary
+
+    def get_hit_rates(self, config_name):
+        """
+        :return: messages per second per node id, the latest counters if there is only one sample
+        :rtype: dict
+        """
+        return {uuid: stats['hits'] if stats['rate'] is None else stats['rate']
+                for uuid, stats in self.get_summary(config_name).items()}
+
+    def _lock(self, config_name):
+        lock_file = open(os.path.join(self.path, f'.{config_name}.lock'), 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # closing the file releases the lock
+        return lock_file
+
+
+def collect_stats(config, store, servers=None, timeout=None):
+    """
+    Reads the counters of all servers of a config through the deploy transport.
+    :type config: Config
+    :type store: StatsStore
+    :type servers: list(str)
+    :type timeout: float
+    :rtype: ReportBySource
+    """
+    servers = servers or config.server
+    timeout = timeout or ApiConfig.deploy_timeout
+    reports = ReportBySource()
+    if not servers:
+        return reports
+
+    def collect(server):
+        report = Report(level=Status.OK)
+        try:
+            output = deploy.get_transport(server).run('sudo syslog-ng-ctl stats', timeout=timeout)
+        except deploy.CommandException as e:
+            report.add(f'Reading the stats of {server} failed: {e}', Status.ERROR)
+            return report
+        hits = map_counters(config, parse_stats(output))
+        store.add_sample(config.name, server, hits)
+        report.add(f'Read the counters of {len(hits)} nodes from {server}')
+        return report
+
+    with ThreadPoolExecutor(min(ApiConfig.deploy_workers, len(servers))) as executor:
+        for server, report in zip(servers, executor.map(collect, servers)):
+            reports.add(report, server)
+    return reports
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Imports the output of syslog-ng-ctl stats for a lefci config.')
+    parser.add_argument('config', help='name of a saved config or path to a config file')
+    parser.add_argument('stats', help='file with the output of syslog-ng-ctl stats')
+    parser.add_argument('--server', required=True, help='server the stats were read from')
+    parser.add_argument('--path', default=ApiConfig.stats_path, help='directory of the stats')
+    args = parser.parse_args(args)
+
+    config = load_config(args.config)
+    with open(args.stats, 'r') as stats_file:
+        hits = map_counters(config, parse_stats(stats_file.read()))
+    StatsStore(args.path).add_sample(config.name, args.server, hits)
+    print(f'Imported the counters of {len(hits)} nodes of {config.name} from {args.server}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
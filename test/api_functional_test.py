@@ -0,0 +1,184 @@
+import gzip
+import json
+import threading
+
+import pytest
+from lefci import api, app
+from lefci.model import ApiConfig, Config, JsonStore, State
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    state = State(JsonStore(str(tmp_path / 'configs')))
+    monkeypatch.setattr(api, 'state', state)
+    monkeypatch.setattr(ApiConfig, 'metrics_dir', str(tmp_path / 'metrics'))
+    state.save_config(Config(name='relays', log_trees=[
+        {'id': 'nginx', 'title': 'nginx', 'filters': [{'field': 'program', 'pattern': 'nginx'}], 'children': [
+            {'id': 'errors', 'title': 'errors', 'example': {'program': 'nginx', 'message': 'error'}},
+        ]},
+        {'id': 'postfix', 'title': 'postfix'},
+    ]))
+    return app.test_client()
+
+
+def test_unchanged_config_is_not_modified(client):
+    response = client.get('/v1/configs/relays')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get('/v1/configs/relays', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    response = client.get('/v1/configs/relays/trees/nginx', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    client.put('/v1/configs/relays/trees/postfix', json={'title': 'mail'})
+    response = client.get('/v1/configs/relays', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_gzip_and_identity_bodies_share_a_weak_etag(client):
+    identity = client.get('/v1/configs/relays/trees', headers={'Accept-Encoding': 'identity'})
+    compressed = client.get('/v1/configs/relays/trees', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.data)) == identity.get_json()
+    assert identity.headers['ETag'] == compressed.headers['ETag']
+    assert identity.headers['ETag'].startswith('W/')
+
+    response = client.get('/v1/configs/relays/trees', headers={'Accept-Encoding': 'gzip',
+                                                               'If-None-Match': identity.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_missing_configs_get_no_locks(client, tmp_path):
+    assert client.delete('/v1/configs/anything').status_code == 404
+    assert client.put('/v1/configs/anything/trees/nginx', json={'title': 'web'}).status_code == 404
+    assert client.get('/v1/configs/anything/trees').status_code == 404
+    assert 'anything' not in api.state._locks
+    assert not (tmp_path / 'configs' / '.anything.lock').exists()
+
+    assert client.put('/v1/configs/relays/trees/postfix', json={'title': 'mail'}).status_code == 200
+    assert 'relays' in api.state._locks
+    assert client.delete('/v1/configs/relays').status_code == 200
+    assert 'relays' not in api.state._locks
+
+
+def test_concurrent_edits_are_not_lost(client):
+    statuses = []
+
+    def add_nodes(worker):
+        worker_client = app.test_client()
+        for index in range(10):
+            response = worker_client.post('/v1/configs/relays/trees/postfix', json={'id': f'{worker}-{index}'})
+            statuses.append(response.status_code)
+            response = worker_client.put(f'/v1/configs/relays/trees/{worker}-{index}', json={'title': 'updated'})
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=add_nodes, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert set(statuses) == {200}
+    children = client.get('/v1/configs/relays/trees/postfix').get_json()['children']
+    assert sorted(child['id'] for child in children) == sorted(f'{worker}-{index}' for worker in range(4)
+                                                               for index in range(10))
+    assert {child['title'] for child in children} == {'updated'}
+
+
+def test_operations_are_applied_and_saved_once(client, monkeypatch):
+    saves = []
+    save_changes = api.state.save_changes
+    monkeypatch.setattr(api.state, 'save_changes', lambda config, changes: saves.append(changes) or
+                        save_changes(config, changes))
+    response = client.patch('/v1/configs/relays/trees', json={'operations': [
+        {'op': 'add', 'parent': 'postfix', 'ref': 'bounces', 'tree': {'title': 'bounces'}},
+        {'op': 'move', 'id': 'errors', 'parent': 'bounces'},
+        {'op': 'update', 'id': 'nginx', 'changes': {'title': 'web'}},
+    ]})
+    assert response.status_code == 200
+    data = response.get_json()
+    created = data['created']
+    assert [(entry['operation'], entry['ref']) for entry in created] == [(0, 'bounces')]
+    assert 'reports' in data
+    assert len(saves) == 1
+
+    bounces = client.get(f'/v1/configs/relays/trees/{created[0]["id"]}').get_json()
+    assert bounces['title'] == 'bounces'
+    assert [child['id'] for child in bounces['children']] == ['errors']
+    assert client.get('/v1/configs/relays/trees/nginx').get_json()['title'] == 'web'
+
+
+def test_invalid_operations_are_rejected(client):
+    etag = client.get('/v1/configs/relays').headers['ETag']
+    response = client.patch('/v1/configs/relays/trees', json={'operations': [
+        {'op': 'update', 'id': 'postfix', 'changes': {'title': 'mail'}},
+        {'op': 'delete', 'id': 'missing'},
+    ]})
+    assert response.status_code == 400
+    assert client.patch('/v1/configs/relays/trees', json={'operations': {}}).status_code == 400
+    assert client.patch('/v1/configs/relays/trees/nginx', json={'operations': []}).status_code == 405
+    assert client.patch('/v1/configs/missing/trees', json={'operations': []}).status_code == 404
+    # nothing was saved
+    assert client.get('/v1/configs/relays', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/v1/configs/relays/trees/postfix').get_json()['title'] == 'postfix'
+
+
+def test_added_ids_must_be_unused(client):
+    response = client.post('/v1/configs/relays/trees', json={'id': 'errors'})
+    assert response.status_code == 400
+    response = client.post('/v1/configs/relays/trees/postfix', json={'id': 'bounces', 'children': [{'id': 'nginx'}]})
+    assert response.status_code == 400
+    assert client.get('/v1/configs/relays/trees/postfix').get_json()['children'] == []
+    assert client.post('/v1/configs/relays/trees/postfix', json={'id': 'bounces'}).status_code == 200
+
+
+def test_trees_are_projected(client):
+    response = client.get('/v1/configs/relays/trees?depth=0&fields=id,children_count,children')
+    assert response.status_code == 200
+    assert response.get_json() == [{'id': 'nginx', 'children_count': 1}, {'id': 'postfix', 'children_count': 0}]
+    assert response.headers['ETag'].startswith('W/')
+    response = client.get('/v1/configs/relays/trees/nginx?depth=1&fields=id,children')
+    assert response.get_json() == {'id': 'nginx', 'children': [{'id': 'errors'}]}
+    response = client.get('/v1/configs/relays/trees/errors?fields=example')
+    assert response.get_json() == {'example': {'program': 'nginx', 'message': 'error'}}
+
+
+def test_offset_and_limit_page_the_trees(client):
+    assert client.get('/v1/configs/relays/trees?fields=id&offset=1').get_json() == [{'id': 'postfix'}]
+    assert client.get('/v1/configs/relays/trees?fields=id&limit=1').get_json() == [{'id': 'nginx'}]
+    assert client.get('/v1/configs/relays/trees?fields=id&offset=2&limit=1').get_json() == []
+
+
+@pytest.mark.parametrize('query', ['fields=id,bogus', 'depth=one', 'offset=-1', 'limit=1.5'])
+def test_invalid_projections_are_rejected(client, query):
+    response = client.get(f'/v1/configs/relays/trees?{query}')
+    assert response.status_code == 400
+    assert response.get_json()[0]['messages'][0]['status'] == 'ERROR'
+
+
+def test_stored_dangerous_patterns_load_and_can_be_fixed(client):
+    # screened when sent, a stored pattern loads and is reported by the verification
+    api.state.save_config(Config(name='legacy', log_trees=[
+        {'id': 'words', 'filters': [{'field': 'message', 'pattern': r'(\w+\s?)*$'}], 'example': {'message': 'a b'}},
+    ]))
+    assert client.get('/v1/configs/legacy').status_code == 200
+    dangerous = {'filters': [{'field': 'message', 'pattern': r'(a+)+$'}]}
+    assert client.put('/v1/configs/legacy/trees/words', json=dangerous).status_code == 400
+    assert client.post('/v1/configs/legacy/trees', json=dangerous).status_code == 400
+    response = client.patch('/v1/configs/legacy/trees', json={'operations': [
+        {'op': 'update', 'id': 'words', 'changes': dangerous}]})
+    assert response.status_code == 400
+    response = client.post('/v1/configs', json={'config': {'name': 'copy', 'log_trees': [dangerous]}})
+    assert response.status_code == 400
+
+    response = client.put('/v1/configs/legacy/trees/words', json={'title': 'words'})
+    assert response.status_code == 200
+    assert response.get_json()[0]['messages'][0]['status'] == 'ERROR'
+    response = client.put('/v1/configs/legacy/trees/words', json={'filters': [{'field': 'message', 'pattern': r'\w+'}]})
+    assert response.status_code == 200
+    assert client.delete('/v1/configs/legacy').status_code == 200
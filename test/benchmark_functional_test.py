@@ -0,0 +1,39 @@
+import pytest
+from benchmarks.generator import generate_config
+from benchmarks.load import Recorder
+from benchmarks.run import compare
+
+
+@pytest.mark.parametrize('complexity', ['literal', 'anchored', 'regex', 'complex'])
+def test_generated_examples_match_own_filters(complexity):
+    config = generate_config(50, fan_out=3, filters_per_node=2, complexity=complexity)
+    nodes = [config.find_tree(f'node-{index}') for index in range(50)]
+    assert all(nodes)
+    assert len(config.log_trees) == 3
+    for node in nodes:
+        assert len(node.filters) == 2
+        assert all(filter.hits(node.example[filter.field]) for filter in node.filters)
+
+
+def test_depth_raises_fan_out():
+    config = generate_config(100, depth=2, fan_out=2)
+    assert len(config.log_trees) == 10
+    assert all(not child.children for tree in config.log_trees for child in tree.children)
+
+
+def test_regressions_exceed_threshold():
+    baseline = {'results': {'encode/100': {'median': 1.0}, 'to_json/100': {'median': 1.0}}}
+    results = {'results': {'encode/100': {'median': 1.2}, 'to_json/100': {'median': 1.5}, 'new/100': {'median': 9}}}
+    assert compare(results, baseline, 0.25) == {'to_json/100': 1.5}
+
+
+def test_load_summary_percentiles():
+    recorder = Recorder()
+    for latency in range(1, 101):
+        recorder.record('GET configs', latency / 1000, 200)
+    recorder.record('PUT trees', 0.5, 404)
+    summary = recorder.summarize(10)
+    assert summary['requests'] == 101
+    stats = summary['endpoints']['GET configs']
+    assert (stats['p50'], stats['p95'], stats['p99']) == (0.05, 0.095, 0.099)
+    assert summary['errors'] == {'PUT trees 404': 1}
@@ -0,0 +1,63 @@
+import pytest
+from lefci.model import Classifier, Config, LogTree
+
+
+def create_node(title, *filters, children=()):
+    node = LogTree(title=title, filters=[{'field': field, 'pattern': pattern} for field, pattern in filters])
+    for child in children:
+        node.add_tree(child)
+    return node
+
+
+@pytest.fixture
+def config():
+    config = Config()
+    config.add_tree(create_node('web', ('program', '^nginx'), children=[
+        create_node('errors', ('message', 'error|crit')),
+        create_node('access', ('message', 'GET|POST')),
+        create_node('other', ('unknown', '')),
+    ]))
+    config.add_tree(create_node('mail', ('program', 'postfix'), ('host', '^mx[0-9]+')))
+    return config
+
+
+@pytest.mark.parametrize('patterns', [
+    ['abc', '^a', 'c$', '[0-9]+', 'a*'],
+    ['(?P<name>a)', '(?P<name>b)'],
+    [r'(\w)\1', '(?i)ABC', 'b'],
+])
+def test_evaluate_equals_single_searches(patterns):
+    nodes = [create_node(str(index), ('message', pattern)) for index, pattern in enumerate(patterns)]
+    classifier = Classifier(nodes)
+    for value in ['abc', 'xaab', '123', '', 'ABC']:
+        hits = classifier.evaluate({'message': value})
+        assert hits == [[node.filters[0].hits(value)] for node in nodes]
+
+
+def test_evaluate_without_field():
+    classifier = Classifier([create_node('a', ('host', 'a'), ('message', 'b'))])
+    assert classifier.evaluate({'message': 'b'}) == [[None, True]]
+
+
+def test_route_to_leaf(config):
+    web = config.log_trees[0]
+    assert config.route({'program': 'nginx', 'message': 'GET /'}) == [web.children[1]]
+    assert config.route({'program': 'nginx', 'message': 'crit: GET /'}) == web.children[:2]
+
+
+def test_route_to_catch_all(config):
+    assert config.route({'program': 'nginx', 'message': 'started'}) == [config.log_trees[0].children[2]]
+
+
+def test_route_unmatched(config):
+    assert config.route({'program': 'postfix', 'host': 'relay'}) == []
+    assert config.route({'program': 'postfix', 'host': 'mx1'}) == [config.log_trees[1]]
+
+
+def test_classifier_rebuilt_on_filter_update(config):
+    web = config.log_trees[0]
+    classifier = web.get_classifier()
+    assert web.get_classifier() is classifier
+    web.children[1].update_config(filters=[{'field': 'message', 'pattern': 'PUT'}])
+    assert web.get_classifier() is not classifier
+    assert config.route({'program': 'nginx', 'message': 'PUT /'}) == [web.children[1]]
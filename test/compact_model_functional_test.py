@@ -0,0 +1,42 @@
+import json
+
+from lefci.model import Config, LogTree
+
+
+def test_partial_updates_keep_actions_and_example():
+    tree = LogTree(id='sshd', actions=[{'type': 'file'}], example={'program': 'sshd'})
+    tree.update_config(example={'program': 'cron'})
+    assert tree.actions == [{'type': 'file'}]
+    assert tree.example == {'program': 'cron'}
+    tree.update_config(actions=[])
+    assert tree.actions == []
+    assert tree.example == {'program': 'cron'}
+
+
+def test_example_is_decoded_once_until_it_changes():
+    tree = LogTree(id='sshd', example={'program': 'sshd'})
+    assert tree.example is tree.example
+    tree.example = {'program': 'cron'}
+    assert tree.example == {'program': 'cron'}
+    assert tree.example is tree.example
+
+
+def test_leaves_and_equal_filters_are_shared():
+    config = Config(log_trees=[
+        {'id': 'a', 'filters': [{'field': 'program', 'pattern': '^sshd$'}]},
+        {'id': 'b', 'filters': [{'field': 'program', 'pattern': '^sshd$'}]},
+    ])
+    first, second = config.find_tree('a'), config.find_tree('b')
+    assert first.filters[0] is second.filters[0]
+    assert first.children is second.children
+    assert first._data is LogTree.empty_data
+
+
+def test_to_json_matches_encode():
+    config = Config(log_trees=[
+        {'id': 'sshd', 'title': 'sshd', 'filters': [{'field': 'program', 'pattern': '^sshd$'}],
+         'actions': [{'type': 'file'}], 'example': {'program': 'sshd'},
+         'children': [{'id': 'login', 'example': {'message': 'login'}}]},
+    ])
+    assert json.loads(config.to_json()) == config.encode()
+    assert Config(**json.loads(config.to_json())).encode() == config.encode()
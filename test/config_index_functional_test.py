@@ -0,0 +1,58 @@
+import pytest
+from lefci.model import ApiConfig, Config, LogTree
+
+
+@pytest.fixture(autouse=True)
+def debug_index():
+    ApiConfig.debug = True
+    yield
+    ApiConfig.debug = False
+
+
+@pytest.fixture
+def config():
+    return Config(log_trees=[
+        {'title': 'root', 'children': [{'title': 'child1'}, {'title': 'child2', 'children': [{'title': 'child2_1'}]}]},
+    ])
+
+
+def test_index_built_on_load(config):
+    root = config.log_trees[0]
+    child2_1 = root.children[1].children[0]
+    assert config.find_tree(root.id) is root
+    assert config.find_tree(child2_1.id) is child2_1
+    assert config.find_tree('missing') is None
+
+
+def test_index_follows_added_and_removed_trees(config):
+    root = config.log_trees[0]
+    child = LogTree(title='child3', children=[{'title': 'child3_1'}])
+    root.add_tree(child)
+    assert config.find_tree(child.children[0].id) is child.children[0]
+
+    second_root = LogTree(title='second root')
+    config.add_tree(second_root)
+    assert config.find_tree(second_root.id) is second_root
+
+    root.remove_tree(child)
+    config.remove_tree(second_root)
+    assert config.find_tree(child.id) is None
+    assert config.find_tree(child.children[0].id) is None
+    assert config.find_tree(second_root.id) is None
+
+
+def test_index_follows_replaced_children(config):
+    root = config.log_trees[0]
+    old_child = root.children[0]
+    data = root.encode()
+    data['children'][0]['title'] = 'renamed'
+    root.update_config(**data)
+    assert config.find_tree(old_child.id) is root.children[0]
+    assert config.find_tree(old_child.id) is not old_child
+    assert config.find_tree(old_child.id).title == 'renamed'
+
+
+def test_check_index_detects_bypassed_changes(config):
+    config.log_trees[0].children.append(LogTree(title='unindexed'))
+    with pytest.raises(AssertionError):
+        config.find_tree(config.log_trees[0].id)
@@ -0,0 +1,51 @@
+import time
+import pytest
+from lefci import deploy
+from lefci.model import Config, Status
+
+
+@pytest.fixture
+def deployed(monkeypatch):
+    calls = []
+
+    def deploy_config(filepath, server, key_file=None, timeout=None, force=False, progress=None):
+        calls.append((server, timeout))
+        time.sleep(0.2)
+        if server == 'broken':
+            raise deploy.CommandException('syntax error')
+        if server == 'current':
+            return 'unchanged', ''
+        return 'reloaded', '+filter f_1_1 { program("sshd"); };\n'
+
+    monkeypatch.setattr(deploy, 'deploy_config', deploy_config)
+    monkeypatch.setattr(deploy, 'render_config', lambda config, hits=None: '/tmp/deploy.conf')
+    return calls
+
+
+def test_fleet_deploys_concurrently(deployed):
+    config = Config(server=[f'relay{index}' for index in range(10)])
+    start = time.monotonic()
+    reports = deploy.deploy_fleet(config, max_workers=10, timeout=5)
+    assert time.monotonic() - start < 1
+    assert sorted(server for server, _ in deployed) == sorted(config.server)
+    assert all(timeout == 5 for _, timeout in deployed)
+    assert [entry['source'] for entry in reports.encode()] == config.server
+
+
+def test_fleet_reports_failed_servers(deployed):
+    reports = deploy.deploy_fleet(Config(), ['relay1', 'broken'])
+    assert reports.get_report_with_source('broken').get_highest_status_code() == Status.ERROR
+    assert reports.get_report_with_source('relay1').get_highest_status_code() == Status.OK
+
+
+def test_fleet_reports_skipped_servers_and_diffs(deployed):
+    reports = deploy.deploy_fleet(Config(), ['relay1', 'current'])
+    assert [entry.message for entry in reports.get_report_with_source('relay1').entries] == [
+        'Deployed to relay1, syslog-ng reloaded', '+filter f_1_1 { program("sshd"); };\n']
+    assert [entry.message for entry in reports.get_report_with_source('current').entries] == [
+        'current already runs this config, skipped']
+
+
+def test_run_command_timeout():
+    with pytest.raises(deploy.CommandException):
+        deploy.run_command('sleep 5', shell=True, timeout=0.2)
@@ -0,0 +1,78 @@
+import threading
+import time
+import pytest
+from lefci import deploy
+from lefci.jobs import Job, JobQueue
+from lefci.model import Config
+
+
+@pytest.fixture
+def queue(tmpdir, monkeypatch):
+    running = {}
+    overlaps = []
+    lock = threading.Lock()
+
+    def deploy_config(filepath, server, key_file=None, timeout=None, force=False, progress=None):
+        with lock:
+            if running.get(server):
+                overlaps.append(server)
+            running[server] = True
+        progress('check')
+        time.sleep(0.1)
+        progress('apply')
+        with lock:
+            running[server] = False
+        if server == 'broken':
+            raise deploy.CommandException('syntax error')
+        return 'reloaded', ''
+
+    monkeypatch.setattr(deploy, 'deploy_config', deploy_config)
+    monkeypatch.setattr(deploy, 'render_config', lambda config, hits=None: '/tmp/deploy.conf')
+    queue = JobQueue(max_workers=4, path=str(tmpdir))
+    queue.overlaps = overlaps
+    return queue
+
+
+def wait(job):
+    deadline = time.monotonic() + 5
+    while not job.done and time.monotonic() < deadline:
+        job.wait_events(len(job.events), 1)
+
+
+def test_submit_returns_before_deployment(queue):
+    start = time.monotonic()
+    job = queue.submit(Config(name='test'), ['relay1', 'relay2'])
+    assert time.monotonic() - start < 0.1
+    assert not job.done
+    wait(job)
+    encoded = job.encode()
+    assert encoded['status'] == 'done'
+    assert [server['status'] for server in encoded['servers']] == ['done', 'done']
+    steps = encoded['servers'][0]['steps']
+    assert [step['step'] for step in steps] == ['render', 'lock', 'check', 'apply']
+    assert all(step['duration'] is not None for step in steps)
+    assert steps[2]['duration'] >= 0.1
+
+
+def test_failed_server_fails_job(queue):
+    job = queue.submit(Config(name='test'), ['relay1', 'broken'])
+    wait(job)
+    assert job.status == 'failed'
+    assert [event['status'] for event in job.events if 'report' in event] in (['done', 'failed'], ['failed', 'done'])
+
+
+def test_jobs_of_same_server_are_serialized(queue):
+    jobs = [queue.submit(Config(name='test'), ['relay1']) for _ in range(3)]
+    for job in jobs:
+        wait(job)
+    assert not queue.overlaps
+
+
+def test_snapshot_and_events_of_other_worker(queue):
+    job = queue.submit(Config(name='test'), ['relay1'])
+    wait(job)
+    other_worker = JobQueue(path=queue.path)
+    snapshot = other_worker.get(job.id)
+    assert not isinstance(snapshot, Job)
+    assert snapshot['status'] == 'done'
+    assert [event for event in other_worker.iter_events(job.id)] == job.events
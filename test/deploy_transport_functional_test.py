@@ -0,0 +1,80 @@
+import os
+import stat
+import pytest
+from lefci import deploy
+
+
+def create_executable(directory, name, script):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as file:
+        file.write('#!/bin/sh\n' + script)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def server(tmpdir):
+    bin_path = tmpdir.mkdir('bin')
+    home = tmpdir.mkdir('home')
+    # syslog-ng fails the syntax check of configs containing "broken", sudo logs the restart
+    create_executable(str(bin_path), 'syslog-ng', 'if grep -q broken "$2"; then echo "syntax error" >&2; exit 1; fi\n')
+    create_executable(str(bin_path), 'sudo', f'echo "$@" >> {home}/restarts\n')
+    env = dict(os.environ, PATH=f'{bin_path}:{os.environ["PATH"]}')
+    return deploy.LocalTransport(str(home), env), home
+
+
+def test_deploy_swaps_and_restarts(server, tmpdir):
+    transport, home = server
+    home.join('running-config.conf').write('old')
+    filepath = tmpdir.join('deploy.conf')
+    filepath.write('new')
+    deploy.deploy_config(str(filepath), 'relay', transport=transport)
+    assert home.join('running-config.conf').read() == 'new'
+    assert home.join('running-config.conf.bak').read() == 'old'
+    assert home.join('restarts').read() == 'systemctl restart syslog-ng.service\n'
+
+
+def test_deploy_skips_running_config(server, tmpdir):
+    transport, home = server
+    home.join('running-config.conf').write('@version: 3.24\nfilter f_1_1 { program("sshd"); };\n')
+    filepath = tmpdir.join('deploy.conf')
+    filepath.write('@version: 3.24\nfilter f_1_1 { program("sshd"); };\n')
+    assert deploy.deploy_config(str(filepath), 'relay', transport=transport) == ('unchanged', '')
+    assert not home.join('running-config.conf.bak').check()
+    assert not home.join('restarts').check()
+
+    deploy.deploy_config(str(filepath), 'relay', transport=transport, force=True)
+    assert home.join('restarts').read() == 'systemctl restart syslog-ng.service\n'
+
+
+def test_deploy_reloads_changed_filters(server, tmpdir):
+    transport, home = server
+    home.join('running-config.conf').write('@version: 3.24\nfilter f_1_1 { program("sshd"); };\n')
+    filepath = tmpdir.join('deploy.conf')
+    filepath.write('@version: 3.24\nfilter f_1_1 { program("cron"); };\n')
+    action, diff = deploy.deploy_config(str(filepath), 'relay', transport=transport)
+    assert action == 'reloaded'
+    assert '-filter f_1_1 { program("sshd"); };\n+filter f_1_1 { program("cron"); };' in diff
+    assert home.join('restarts').read() == 'systemctl reload syslog-ng.service\n'
+
+    filepath.write('@version: 4.0\nfilter f_1_1 { program("cron"); };\n')
+    action, diff = deploy.deploy_config(str(filepath), 'relay', transport=transport)
+    assert action == 'restarted'
+
+
+def test_deploy_keeps_running_config_on_syntax_error(server, tmpdir):
+    transport, home = server
+    home.join('running-config.conf').write('old')
+    filepath = tmpdir.join('deploy.conf')
+    filepath.write('broken')
+    with pytest.raises(deploy.CommandException, match='syntax error'):
+        deploy.deploy_config(str(filepath), 'relay', transport=transport)
+    assert home.join('running-config.conf').read() == 'old'
+    assert not home.join('restarts').check()
+
+
+def test_ssh_transport_reuses_connection():
+    transport = deploy.get_transport('relay.example.com')
+    assert deploy.get_transport('relay.example.com') is transport
+    assert 'ControlMaster=auto' in transport.options
+    assert any(option.startswith('ControlPersist=') for option in transport.options)
+    deploy.transports.clear()
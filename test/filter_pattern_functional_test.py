@@ -0,0 +1,37 @@
+import pytest
+from lefci.model import Filter, FilterException, LogTree, Status, compile_pattern
+
+
+def test_identical_patterns_share_compiled_object():
+    first = Filter('message', 'error [0-9]+')
+    second = Filter('host', 'error [0-9]+')
+    assert first.regex is second.regex
+    assert first.regex is compile_pattern('error [0-9]+')
+
+
+def test_match_and_miss_use_same_pattern():
+    log_filter = Filter('message', 'Hello')
+    hit = {'message': 'Hello World'}
+    miss = {'message': 'Goodbye'}
+    assert log_filter.match_example(miss).get_highest_status_code() == Status.WARNING
+    assert log_filter.miss_example(hit).get_highest_status_code() == Status.WARNING
+    assert not log_filter.match_example(hit)
+    assert not log_filter.miss_example(miss)
+
+
+def test_unknown_filter_is_not_compiled():
+    log_filter = Filter('unknown', '')
+    assert log_filter.regex is None
+
+
+def test_invalid_pattern_rejected_on_creation():
+    with pytest.raises(FilterException):
+        LogTree(filters=[{'field': 'message', 'pattern': '(unclosed'}])
+
+
+def test_invalid_pattern_leaves_node_untouched():
+    node = LogTree(title='node', filters=[{'field': 'message', 'pattern': 'ok'}])
+    with pytest.raises(FilterException):
+        node.update_config(title='changed', filters=[{'field': 'message', 'pattern': '[a-'}])
+    assert node.title == 'node'
+    assert node.filters[0].pattern == 'ok'
@@ -0,0 +1,78 @@
+import pytest
+from lefci.model import Config, Filter, LogTree
+
+
+def create_node(title, pattern, example):
+    return LogTree(title=title, filters=[{'field': 'message', 'pattern': pattern}], example={'message': example})
+
+
+@pytest.fixture
+def config():
+    config = Config()
+    root = create_node('root', 'app', 'app started')
+    for index in range(3):
+        root.add_tree(create_node(f'child{index}', f'app {index}', f'app {index}'))
+    config.add_tree(root)
+    return config
+
+
+@pytest.fixture
+def counted_hits(monkeypatch):
+    evaluations = []
+    original = Filter.hits
+
+    def hits(self, value):
+        evaluations.append((self.pattern, value))
+        return original(self, value)
+
+    monkeypatch.setattr(Filter, 'hits', hits)
+    return evaluations
+
+
+def test_unchanged_verification_uses_memoized_results(config, counted_hits):
+    child = config.log_trees[0].children[0]
+    config.verify_node(child)
+    counted_hits.clear()
+    config.verify_node(child)
+    assert counted_hits == []
+
+
+def test_filter_edit_only_evaluates_new_pattern(config, counted_hits):
+    child = config.log_trees[0].children[0]
+    config.verify_node(child)
+    counted_hits.clear()
+    child.update_config(filters=[{'field': 'message', 'pattern': 'app [0]'}])
+    config.verify_node(child)
+    assert {pattern for pattern, _ in counted_hits} == {'app [0]'}
+
+
+def test_example_edit_only_evaluates_new_value(config, counted_hits):
+    child = config.log_trees[0].children[0]
+    config.verify_node(child)
+    counted_hits.clear()
+    child.update_config(example={'message': 'app 0 restarted'})
+    config.verify_node(child)
+    assert {value for _, value in counted_hits} == {'app 0 restarted'}
+
+
+def test_delta_only_holds_changed_sources(config):
+    child = config.log_trees[0].children[0]
+    full = config.verify_node(child, delta=True)
+    assert len(full) == len(config.verify_node(child))
+    assert len(config.verify_node(child, delta=True)) == 0
+
+    child.update_config(example={'message': 'app 0 app 1'})
+    delta = config.verify_node(child, delta=True)
+    assert list(delta.registry) == [config.log_trees[0].children[1].id]
+    assert delta.encode()[0]['title'] == 'child1'
+
+
+def test_sweep_drops_unused_results(config):
+    child = config.log_trees[0].children[0]
+    config.verify_node(child)
+    child.update_config(filters=[{'field': 'message', 'pattern': 'other'}], example={'message': 'other'})
+    config.verify_node(child)
+    size = config._matrix.size
+    config._matrix.sweep(config._index.values())
+    assert config._matrix.size < size
+    assert ('message', 'app 0') not in config._matrix.rows
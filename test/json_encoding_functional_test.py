@@ -0,0 +1,42 @@
+import gzip
+import json
+import pytest
+from lefci.api import buffer_chunks, gzip_chunks
+from lefci.model import Config, JsonStore, iter_json_list
+
+
+@pytest.fixture
+def config():
+    return Config(name='relays', server=['relay1'], log_trees=[
+        {'title': 'nginx', 'filters': [{'field': 'program', 'pattern': 'nginx\\\\d'}], 'children': [
+            {'title': 'errors "quoted"', 'example': {'message': 'Fehler ä'}},
+        ]},
+        {'title': 'postfix', 'actions': [{'action': 'network', 'host': 'collector', 'port': '514'}]},
+    ])
+
+
+def compact(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def test_streamed_config_equals_encoded(config):
+    assert ''.join(config.iter_json()) == compact(config.encode())
+    assert ''.join(Config(name='empty').iter_json()) == compact(Config(name='empty').encode())
+
+
+def test_streamed_trees_equal_encoded(config):
+    assert ''.join(config.log_trees[0].iter_json()) == compact(config.log_trees[0].encode())
+    assert ''.join(iter_json_list(config.log_trees)) == compact([tree.encode() for tree in config.log_trees])
+    assert ''.join(iter_json_list([])) == '[]'
+
+
+def test_compact_and_indented_files(config, tmp_path):
+    JsonStore(str(tmp_path / 'compact')).save_config(config)
+    JsonStore(str(tmp_path / 'indented'), indent=4).save_config(config)
+    assert (tmp_path / 'compact' / 'relays').read_text() == compact(config.encode())
+    assert json.loads((tmp_path / 'indented' / 'relays').read_text()) == config.encode()
+
+
+def test_gzip_chunks(config):
+    body = b''.join(gzip_chunks(buffer_chunks(config.iter_json())))
+    assert json.loads(gzip.decompress(body)) == config.encode()
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import threading
+
+from lefci import metrics
+from lefci.model import Config
+
+
+def test_histograms_render_cumulative_buckets():
+    registry = metrics.Registry()
+    registry.observe('lefci_request_duration_seconds', 0.003, resource='trees', method='GET')
+    registry.observe('lefci_request_duration_seconds', 0.2, resource='trees', method='GET')
+    registry.inc('lefci_state_cache_total', result='hit')
+    text = metrics.render(metrics.merge([registry.snapshot()]))
+    assert '# TYPE lefci_request_duration_seconds histogram' in text
+    assert 'lefci_request_duration_seconds_bucket{method="GET",resource="trees",le="0.0025"} 0' in text
+    assert 'lefci_request_duration_seconds_bucket{method="GET",resource="trees",le="0.005"} 1' in text
+    assert 'lefci_request_duration_seconds_bucket{method="GET",resource="trees",le="+Inf"} 2' in text
+    assert 'lefci_request_duration_seconds_count{method="GET",resource="trees"} 2' in text
+    assert 'lefci_state_cache_total{result="hit"} 1' in text
+
+
+def test_workers_are_merged_and_ended_workers_kept(tmpdir):
+    path = str(tmpdir)
+    worker = metrics.Registry()
+    worker.inc('lefci_state_cache_total', 2, result='miss')
+    worker.flush(path)
+
+    ended = metrics.Registry()
+    ended.inc('lefci_state_cache_total', 3, result='miss')
+    process = subprocess.Popen(['true'])
+    process.wait()
+    # the file of a process which isn't running anymore
+    ended.token = f'{process.pid}-ended'
+    ended.flush(path)
+
+    collector = metrics.Registry()
+    collector.inc('lefci_state_cache_total', result='miss')
+    assert 'lefci_state_cache_total{result="miss"} 6' in metrics.collect(path, collector)
+    assert set(os.listdir(path)) == {'.lock', 'ended.json', f'{worker.token}.json'}
+    # counters of ended workers don't go backwards
+    assert 'lefci_state_cache_total{result="miss"} 6' in metrics.collect(path, collector)
+
+
+def test_threads_flush_one_at_a_time(tmpdir):
+    registry = metrics.Registry()
+    errors = []
+
+    def flush():
+        for _ in range(50):
+            registry.inc('lefci_regex_timeouts_total')
+            try:
+                registry.flush(str(tmpdir))
+            except OSError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=flush) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert os.listdir(str(tmpdir)) == [f'{registry.token}.json']
+
+
+def test_verification_counts_regex_evaluations():
+    config = Config(log_trees=[
+        {'id': 'sshd', 'title': 'sshd', 'filters': [{'field': 'program', 'pattern': '^sshd$'}],
+         'example': {'program': 'sshd'}},
+    ])
+    # histograms are updated in place, so they are copied
+    before = {key: list(value) if isinstance(value, list) else value
+              for key, value in metrics.default_registry.values.items()}
+    config.verify_node(config.find_tree('sshd'))
+    values = metrics.default_registry.values
+
+    evaluations = {key: value - before.get(key, 0) for key, value in values.items()
+                   if key[0] == 'lefci_regex_evaluations_total'}
+    # the filter of the node runs once on its example, the report of the node reuses the result
+    assert sum(evaluations.values()) == 1
+    key = ('lefci_verify_node_duration_seconds', ())
+    assert values[key][-1] - before.get(key, [0])[-1] == 1
@@ -0,0 +1,73 @@
+import random
+import pytest
+from lefci import deploy
+from lefci.model import ApiConfig, Config
+from lefci.optimize import create_plan, get_literal
+
+PATTERNS = {
+    'program': ['^sshd$', '^cron$', 'ssh', '^ss', 'cro', 'd$', r'^(ssh|cron)d?$', r'(\w)\1'],
+    'host': ['^web', '^web1', '^db$', 'web', r'\d', '^db\\.eu'],
+    'message': ['Failed', '^Accepted', 'password', r'^Failed \w+', '(?i)error', 'user root'],
+}
+VALUES = {
+    'program': ['sshd', 'cron', 'ss', 'crond', 'sshdd', 'kernel', ''],
+    'host': ['web1', 'web2', 'db', 'db.eu', 'dbxeu', 'mail', ''],
+    'message': ['Failed password for root', 'Accepted publickey', 'ERROR: disk', 'user root logged in', ''],
+}
+
+
+def create_tree(rng, depth):
+    filters = []
+    for _ in range(rng.choice([0, 1, 1, 1, 2])):
+        field = rng.choice(['program', 'host', 'message', 'unknown'])
+        filters.append({'field': field, 'pattern': '' if field == 'unknown' else rng.choice(PATTERNS[field])})
+    children = [create_tree(rng, depth - 1) for _ in range(rng.randint(0, 4))] if depth else []
+    return {'title': 'node', 'filters': filters, 'children': children}
+
+
+def route(nodes, classifier, example, reached):
+    for index in classifier.route(example):
+        node = nodes[index]
+        reached.append(node.id)
+        if node.children:
+            route(node.children, node.get_classifier(), example, reached)
+    return reached
+
+
+def test_literal_patterns():
+    assert get_literal('sshd') == ('sshd', False, False)
+    assert get_literal(r'^db\.eu$') == ('db.eu', True, True)
+    assert get_literal(r'^\w+') is None
+    assert get_literal('a|b') is None
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_optimized_routing_is_identical(seed):
+    rng = random.Random(seed)
+    config = Config(log_trees=[create_tree(rng, 2) for _ in range(rng.randint(1, 5))])
+    plan = create_plan(config, optimize=False)
+    optimized_plan = create_plan(config)
+    for _ in range(200):
+        example = {field: rng.choice(values) for field, values in VALUES.items() if rng.random() < 0.9}
+        expected = sorted(route(config.log_trees, config.get_classifier(), example, []))
+        assert sorted(plan.route(example)) == expected
+        assert sorted(optimized_plan.route(example)) == expected
+
+
+def test_optimized_rendering(tmpdir, monkeypatch):
+    monkeypatch.setattr(ApiConfig, 'render_cache', str(tmpdir))
+    config = Config(log_trees=[
+        {'title': 'sshd', 'filters': [{'field': 'program', 'pattern': '^sshd$'}]},
+        {'title': 'cron', 'filters': [{'field': 'program', 'pattern': '^cron'}]},
+        {'title': 'failed', 'filters': [{'field': 'message', 'pattern': 'Failed'}]},
+        {'title': 'other', 'filters': [{'field': 'unknown', 'pattern': ''}]},
+    ])
+    syslog_config = deploy.transform_config(config)
+    sshd, cron, failed, other = config.log_trees
+    assert f"filter f_{cron.id}_1 {{ program('cron' type(string) flags(prefix)); }};" in syslog_config
+    assert f"filter f_{failed.id}_1 {{ message('Failed' type(string) flags(substring)); }};" in syslog_config
+    assert "filter f_root_catchall { not (program('(?:^sshd$)|(?:^cron)') or " \
+           "message('Failed' type(string) flags(substring))); };" in syslog_config
+    # only failed excludes all of its later siblings
+    assert syslog_config.count('flags(final)') == 1
+    assert f'f_{other.id}_1' not in syslog_config
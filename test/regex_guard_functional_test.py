@@ -0,0 +1,90 @@
+import time
+
+import pytest
+from lefci import regex_guard
+from lefci.model import ApiConfig, Config, Filter, FilterException, LogTree, Status, screen_trees
+
+
+@pytest.fixture
+def guard(monkeypatch):
+    guard = regex_guard.Guard()
+    monkeypatch.setattr(regex_guard, 'guard', guard)
+    monkeypatch.setattr(ApiConfig, 'regex_timeout', 0.2)
+    monkeypatch.setattr(ApiConfig, 'regex_quarantine_after', 2)
+    return guard
+
+
+@pytest.mark.parametrize('pattern', [r'(a+)+$', r'^(\s*\w+)*$', r'(x+x+)+y', r'(.|\s)*x'])
+def test_exponential_patterns_are_rejected(pattern):
+    with pytest.raises(FilterException, match='exponential'):
+        screen_trees([{'title': 'web', 'children': [{'filters': [{'field': 'message', 'pattern': pattern}]}]}])
+    # stored nodes load and are reported
+    node = LogTree(filters=[{'field': 'message', 'pattern': pattern}], example={'message': 'a'})
+    report = node.get_verify_report()
+    assert report.get_highest_status_code() == Status.ERROR
+    assert any('exponential' in entry.message for entry in report.entries)
+
+
+@pytest.mark.parametrize('pattern', [r'^sshd$', r'(\d+\.)+\d+', r'(?:error|warn(?:ing)?):.*', r'(?>a+)+', r'(\w|\d)+$'])
+def test_linear_patterns_are_accepted(pattern):
+    screen_trees([{'filters': [{'field': 'message', 'pattern': pattern}]}])
+    assert LogTree(filters=[{'field': 'message', 'pattern': pattern}]).filters[0].pattern == pattern
+
+
+def test_timeouts_are_errors_and_quarantined(guard):
+    log_filter = Filter('message', '(a+)+$')
+    example = {'message': 'a' * 40 + '!'}
+    report = log_filter.match_example(example)
+    assert report.get_highest_status_code() == Status.ERROR
+    assert 'time budget' in report.entries[0].message
+    assert log_filter.miss_example(example).get_highest_status_code() == Status.ERROR
+
+    assert guard.is_quarantined('(a+)+$', ApiConfig.regex_quarantine_after)
+    report = log_filter.match_example({'message': 'aaa'})
+    assert 'quarantined' in report.entries[0].message
+    guard.timeouts['slow'] = ApiConfig.regex_quarantine_after
+    with pytest.raises(FilterException, match='quarantined'):
+        screen_trees([{'filters': [{'field': 'message', 'pattern': 'slow'}]}])
+    node = LogTree(filters=[{'field': 'message', 'pattern': 'slow'}], example={'message': 'slow'})
+    assert 'quarantined' in node.get_verify_report().entries[0].message
+    # the sandbox was restarted and evaluates other patterns
+    assert Filter('message', 'aaa').hits('xaaax')
+
+
+def test_sibling_scans_run_under_the_time_budget(guard):
+    # polynomial backtracking passes the screening, but takes seconds on long values without a '='
+    config = Config(name='relays', log_trees=[
+        {'id': 'greedy', 'filters': [{'field': 'message', 'pattern': '.*.*.*.*.*='}]},
+        {'id': 'nginx', 'filters': [{'field': 'program', 'pattern': 'nginx'}], 'children': [
+            {'id': 'errors', 'filters': [{'field': 'message', 'pattern': 'error'}],
+             'example': {'program': 'nginx', 'message': 'error ' + 'x' * 114}},
+        ]},
+    ])
+    start = time.monotonic()
+    reports = config.verify_node(config.find_tree('errors'))
+    assert time.monotonic() - start < 5
+    report = reports.get_report_with_source('greedy')
+    assert report.get_highest_status_code() == Status.ERROR
+    assert 'time budget' in report.entries[0].message
+
+
+def test_cheap_patterns_run_without_the_sandbox(guard):
+    assert regex_guard.get_degree('nginx') == 1
+    assert regex_guard.get_degree(r'error\d*\s?') == 3
+    assert regex_guard.get_degree(r'(?:a|b)\*x') == 1
+    assert regex_guard.get_degree('(a+)+$') == float('inf')
+    assert Filter('message', r'error\d*').hits('an error 42')
+    assert guard._sandboxes.empty()
+    assert not Filter('message', '.*.*.*.*.*=').hits('x' * 40)
+    assert not guard._sandboxes.empty()
+
+
+def test_optional_quantifiers_count(guard):
+    # passes the screening, but every a? doubles the steps of a search on a value of a's
+    pattern = 'a?' * 27 + 'a' * 27
+    assert regex_guard.get_degree(pattern) == 28
+    node = LogTree(filters=[{'field': 'message', 'pattern': pattern}], example={'message': 'a' * 27})
+    start = time.monotonic()
+    report = node.get_verify_report()
+    assert time.monotonic() - start < 5
+    assert 'time budget' in report.entries[0].message
@@ -0,0 +1,47 @@
+import os
+import pytest
+from lefci import deploy
+from lefci.model import ApiConfig, Config
+
+
+@pytest.fixture
+def render_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(ApiConfig, 'render_cache', str(tmpdir.join('render')))
+    return tmpdir.join('render')
+
+
+def create_config(title='sshd'):
+    tree = {'title': title, 'filters': [{'field': 'program', 'pattern': 'sshd'}],
+            'actions': [{'action': 'file', 'filepath': '/var/log/sshd.log'}]}
+    return Config(name='test', log_trees=[tree])
+
+
+def test_render_is_cached_by_content(render_cache, monkeypatch):
+    config = create_config()
+    filepath = deploy.render_config(config)
+    with open(filepath) as syslog_file:
+        assert "program('sshd' type(string) flags(substring))" in syslog_file.read()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('unchanged config rendered again')
+
+    monkeypatch.setattr(deploy.template_environment, 'get_template', fail)
+    assert deploy.render_config(config) == filepath
+    assert deploy.render_config(Config(**config.encode())) == filepath
+
+
+def test_changed_config_renders_again(render_cache):
+    config = create_config()
+    filepath = deploy.render_config(config)
+    config.log_trees[0].update_config(title='sshd logins')
+    changed_filepath = deploy.render_config(config)
+    assert changed_filepath != filepath
+    assert os.path.isfile(filepath) and os.path.isfile(changed_filepath)
+    assert not [name for name in os.listdir(str(render_cache)) if name.endswith('.tmp')]
+
+
+def test_render_cache_is_pruned(render_cache, monkeypatch):
+    monkeypatch.setattr(ApiConfig, 'render_cache_size', 2)
+    for index in range(4):
+        deploy.render_config(create_config(f'tree {index}'))
+    assert len(os.listdir(str(render_cache))) == 2
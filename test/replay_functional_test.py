@@ -0,0 +1,90 @@
+import pytest
+from lefci import regex_guard
+from lefci.model import ApiConfig, Config
+from lefci.replay import Simulator, parse_line, read_lines
+
+
+@pytest.fixture
+def config():
+    return Config(log_trees=[
+        {'title': 'nginx', 'filters': [{'field': 'program', 'pattern': '^nginx$'}], 'children': [
+            {'title': 'errors', 'filters': [{'field': 'message', 'pattern': 'error'}]},
+            {'title': 'upstream', 'filters': [{'field': 'message', 'pattern': 'upstream'}]},
+        ]},
+        {'title': 'web hosts', 'filters': [{'field': 'host', 'pattern': '^web'}]},
+    ])
+
+
+def test_parse_rfc3164():
+    record = parse_line('<13>Oct  7 10:00:00 web1 nginx[123]: GET / 200')
+    assert record == {'host': 'web1', 'program': 'nginx', 'message': 'GET / 200'}
+
+
+def test_parse_rfc5424():
+    record = parse_line('<13>1 2020-10-07T10:00:00Z mx1 postfix 42 - - queued as ABC')
+    assert record == {'host': 'mx1', 'program': 'postfix', 'message': 'queued as ABC'}
+
+
+def test_parse_unknown_format():
+    assert parse_line('free text') == {'host': '', 'program': '', 'message': 'free text'}
+
+
+def test_read_lines_across_chunks(tmp_path):
+    log_file = tmp_path / 'syslog'
+    lines = [f'line {index}' for index in range(100)]
+    log_file.write_text('\n'.join(lines) + '\n')
+    assert list(read_lines(str(log_file), chunk_size=16)) == lines
+
+
+def test_read_empty_file(tmp_path):
+    log_file = tmp_path / 'syslog'
+    log_file.write_text('')
+    assert list(read_lines(str(log_file))) == []
+
+
+def test_replay_counts(config):
+    nginx, web_hosts = config.log_trees
+    errors, upstream = nginx.children
+    result = Simulator(config).replay_lines([
+        'Oct  7 10:00:00 web1 nginx: upstream error',
+        'Oct  7 10:00:01 db1 nginx: upstream timed out',
+        'Oct  7 10:00:02 db1 nginx: started',
+        'Oct  7 10:00:03 db1 cron: job done',
+    ])
+    assert result.lines == 4
+    assert result.unmatched == 1
+    assert result.nodes[nginx.id]['hits'] == 3
+    assert result.nodes[nginx.id]['fall_through'] == 1
+    assert result.nodes[nginx.id]['multiple'] == 1
+    assert result.nodes[web_hosts.id]['multiple'] == 1
+    assert result.nodes[errors.id]['multiple'] == 1
+    assert result.nodes[upstream.id]['hits'] == 2
+
+
+def test_batches_route_like_single_records(config):
+    lines = [f'Oct  7 10:00:{index % 60:02d} {host}1 {program}: {message} {index}'
+             for index, (host, program, message) in enumerate([
+                 ('web', 'nginx', 'upstream error'), ('db', 'nginx', 'upstream timed out'), ('db', 'nginx', 'started'),
+                 ('web', 'cron', 'job done'), ('db', 'cron', 'error')] * 7)]
+    single = Simulator(config)
+    for line in lines:
+        single.replay(parse_line(line))
+    batched = Simulator(config, batch_size=4).replay_lines(lines)
+    assert batched.lines == single.result.lines
+    assert batched.unmatched == single.result.unmatched
+    assert batched.nodes == single.result.nodes
+
+
+def test_sandboxed_patterns_take_one_round_trip_per_batch(config, monkeypatch):
+    # every pattern is evaluated in the sandbox
+    monkeypatch.setattr(ApiConfig, 'regex_inline_steps', 0)
+    calls = []
+    match_groups = regex_guard.guard.match_groups
+    monkeypatch.setattr(regex_guard.guard, 'match_groups', lambda pattern, value, *args: calls.append(value) or
+                        match_groups(pattern, value, *args))
+    result = Simulator(config, batch_size=10).replay_lines([f'Oct  7 10:00:00 db1 nginx: upstream {index}'
+                                                            for index in range(20)])
+    assert result.nodes[config.log_trees[0].children[1].id]['hits'] == 20
+    # the program and the host of the first batch, then the messages of the nginx children per batch
+    assert calls == [['nginx'], ['db1'], [f'upstream {index}' for index in range(10)],
+                     [f'upstream {index}' for index in range(10, 20)]]
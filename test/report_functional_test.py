@@ -0,0 +1,35 @@
+from lefci.model import ApiConfig, Config, Filter, FilterResult, Report, Status
+
+
+def test_results_are_formatted_when_encoded(monkeypatch):
+    report = Filter('message', 'Hello').miss_example({'message': 'Hello World'})
+    assert report.entries == [FilterResult('miss', 'Hello', 'Hello World', Status.WARNING)]
+    monkeypatch.setattr(ApiConfig, 'filter_hit_span_class', 'hit')
+    assert report.encode() == [
+        {'message': "Filter 'Hello' hit example '<span class=hit>Hello World</span>'", 'status': 'WARNING'}]
+
+
+def test_counts_follow_added_entries():
+    report = Report(level=Status.UNKNOWN)
+    report.add('dropped', Status.OK)
+    report.add_result('match', 'a', 'b', Status.WARNING)
+    other = Report('broken', Status.ERROR)
+    assert report.entries == [FilterResult('match', 'a', 'b', Status.WARNING)]
+    assert report.get_highest_status_code() == Status.WARNING
+    report += other
+    assert report.get_highest_status_code() == Status.ERROR
+    assert report.count(Status.ERROR) == 1
+    assert len(report.get_messages_with_status_code(Status.WARNING)) == 1
+
+
+def test_nodes_with_the_same_title_are_kept_apart():
+    config = Config(log_trees=[
+        {'id': 'first', 'title': 'app', 'filters': [{'field': 'program', 'pattern': '^app$'}],
+         'example': {'program': 'app'}},
+        {'id': 'second', 'title': 'app', 'filters': [{'field': 'program', 'pattern': 'app'}],
+         'example': {'program': 'app'}},
+    ])
+    reports = config.verify_node(config.find_tree('first'))
+    assert reports.get_report_with_source('second').get_highest_status_code() == Status.WARNING
+    assert [(report['source'], report['title']) for report in reports.encode()] == [('first', 'app'),
+                                                                                     ('second', 'app')]
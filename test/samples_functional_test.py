@@ -0,0 +1,73 @@
+import json
+import pytest
+from lefci.model import Config, Filter, SampleException, SampleResult, Samples, Status
+
+
+def create_config():
+    return Config(log_trees=[
+        {'id': 'sshd', 'title': 'sshd', 'filters': [{'field': 'program', 'pattern': '^sshd$'},
+                                                    {'field': 'message', 'pattern': 'Accepted'}],
+         'example': {'program': 'sshd', 'message': 'Accepted publickey'},
+         'samples': {'program': ['sshd', 'sshd', 'sshd', None],
+                     'message': ['Accepted publickey', 'Accepted password', 'Failed password', 'Accepted key']}},
+        {'id': 'cron', 'title': 'cron', 'filters': [{'field': 'program', 'pattern': 'd$'}],
+         'example': {'program': 'crond'}},
+    ])
+
+
+@pytest.fixture
+def counted_batches(monkeypatch):
+    batches = []
+    original = Filter.hits_many
+
+    def hits_many(self, values):
+        batches.append((self.pattern, values))
+        return original(self, values)
+
+    monkeypatch.setattr(Filter, 'hits_many', hits_many)
+    return batches
+
+
+def test_samples_are_stored_as_columns():
+    config = create_config()
+    sshd = config.find_tree('sshd')
+    assert len(sshd.samples) == 4
+    assert Config(**json.loads(config.to_json())).encode() == config.encode()
+    assert 'samples' not in config.find_tree('cron').encode()
+    assert Samples.from_records([{'host': 'a'}, {'program': 'b'}]).encode() == {'host': ['a', None],
+                                                                                 'program': [None, 'b']}
+
+
+def test_invalid_samples_are_rejected():
+    config = create_config()
+    with pytest.raises(SampleException, match='different lengths'):
+        config.find_tree('sshd').update_config(samples={'program': ['a'], 'message': []})
+    with pytest.raises(SampleException, match='unknown field'):
+        config.find_tree('sshd').update_config(samples={'pid': ['1']})
+
+
+def test_verification_reports_rates_and_failing_samples():
+    config = create_config()
+    reports = config.verify_node(config.find_tree('sshd'))
+    own = reports.get_report_with_source('sshd').encode()
+    assert {'message': "Filter 'Accepted' matched 3 of 4 samples (75%), e.g. it didn't match 'Failed password'",
+            'status': 'WARNING', 'rate': 0.75, 'failing': [2]} in own
+    # the filter of the sibling hits the program of the samples
+    sibling = reports.get_report_with_source('cron')
+    assert sibling.get_highest_status_code() == Status.WARNING
+    assert [entry.failing for entry in sibling.entries if isinstance(entry, SampleResult)][0] == (0, 1, 2)
+
+
+def test_columns_are_evaluated_once_per_filter(counted_batches):
+    config = create_config()
+    sshd = config.find_tree('sshd')
+    config.verify_node(sshd)
+    # values of the examples are already evaluated, the others of a column in one batch
+    assert counted_batches == [('Accepted', ['Accepted password', 'Failed password', 'Accepted key'])]
+
+    counted_batches.clear()
+    config.verify_node(sshd)
+    assert counted_batches == []
+    sshd.update_config(filters=[{'field': 'message', 'pattern': r'Accepted \w+'}])
+    config.verify_node(sshd)
+    assert counted_batches == [(r'Accepted \w+', ['Accepted password', 'Failed password', 'Accepted key'])]
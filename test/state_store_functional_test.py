@@ -0,0 +1,129 @@
+import json
+import pytest
+from lefci.model import Config, JsonStore, LogTree, State
+from lefci.sqlite_store import SqliteStore
+
+
+def create_config():
+    return Config(name='relays', server=['relay1'], log_trees=[
+        {'title': 'nginx', 'filters': [{'field': 'program', 'pattern': 'nginx'}], 'children': [
+            {'title': 'errors', 'example': {'message': 'error'}},
+            {'title': 'access', 'actions': [{'action': 'file', 'filepath': '/var/log/access'}]},
+        ]},
+        {'title': 'postfix'},
+    ])
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def state(request, tmp_path):
+    if request.param == 'sqlite':
+        return State(SqliteStore(str(tmp_path / 'lefci.db')))
+    return State(JsonStore(str(tmp_path / 'configs')))
+
+
+def reload(state, name):
+    return State(state.store).get_config(name)
+
+
+def test_save_and_load(state):
+    config = create_config()
+    state.save_config(config)
+    assert state.saved_configs == ['relays']
+    assert reload(state, 'relays').encode() == config.encode()
+
+
+def test_add_update_and_delete_nodes(state):
+    config = create_config()
+    state.save_config(config)
+    nginx, postfix = config.log_trees
+
+    child = LogTree(title='upstream', children=[{'title': 'timeouts'}])
+    nginx.add_tree(child, 1)
+    state.save_node(config, child)
+    assert reload(state, 'relays').encode() == config.encode()
+
+    postfix.update_config(title='mail', filters=[{'field': 'program', 'pattern': 'postfix'}])
+    state.save_node(config, postfix, subtree=False)
+    assert reload(state, 'relays').encode() == config.encode()
+
+    nginx.update_config(children=[{'title': 'all'}])
+    state.save_node(config, nginx)
+    assert reload(state, 'relays').encode() == config.encode()
+
+    config.remove_tree(nginx)
+    state.delete_node(config, nginx)
+    assert reload(state, 'relays').encode() == config.encode()
+
+
+def test_rename_node(state):
+    config = create_config()
+    state.save_config(config)
+    nginx = config.log_trees[0]
+    uuid = nginx.id
+
+    nginx.update_config(id='web', title='web')
+    state.save_node(config, nginx, subtree=False, previous_id=uuid)
+    reloaded = reload(state, 'relays')
+    assert reloaded.encode() == config.encode()
+    assert reloaded.find_tree(uuid) is None
+    assert [child.title for child in reloaded.find_tree('web').children] == ['errors', 'access']
+
+
+def test_delete_config(state):
+    state.save_config(create_config())
+    state.delete_config('relays')
+    assert state.saved_configs == []
+    assert State(state.store).saved_configs == []
+
+
+def test_sqlite_node_update_only_writes_node_rows(tmp_path):
+    store = SqliteStore(str(tmp_path / 'lefci.db'))
+    config = create_config()
+    store.save_config(config)
+    connection = store._connect()
+    changes = connection.total_changes
+    config.log_trees[1].update_config(title='mail')
+    store.save_node(config, config.log_trees[1], subtree=False)
+    # the row of the node and the version of the config
+    assert connection.total_changes - changes == 2
+
+
+def test_import_json(tmp_path):
+    json_store = JsonStore(str(tmp_path / 'configs'))
+    config = create_config()
+    json_store.save_config(config)
+    store = SqliteStore(str(tmp_path / 'lefci.db'))
+    assert store.import_json(json_store.path) == ['relays']
+    assert store.load_config('relays').encode() == config.encode()
+
+
+def test_json_store_leaves_no_temporary_files(tmp_path):
+    json_store = JsonStore(str(tmp_path / 'configs'))
+    json_store.save_config(create_config())
+    assert [path.name for path in (tmp_path / 'configs').iterdir()] == ['relays']
+    assert json.loads((tmp_path / 'configs' / 'relays').read_text())['name'] == 'relays'
+
+
+def test_changes_of_other_workers_are_loaded(state):
+    state.save_config(create_config())
+    other_worker = State(state.store)
+    cached = state.get_config('relays')
+    assert state.get_config('relays') is cached
+
+    config = other_worker.get_config('relays')
+    config.log_trees[1].update_config(title='mail')
+    other_worker.save_node(config, config.log_trees[1], subtree=False)
+
+    reloaded = state.get_config('relays')
+    assert reloaded is not cached
+    assert reloaded.log_trees[1].title == 'mail'
+    assert state.get_version('relays') == other_worker.get_version('relays')
+
+
+def test_deleted_config_is_dropped_from_cache(state):
+    state.save_config(create_config())
+    state.get_config('relays')
+    State(state.store).delete_config('relays')
+    with pytest.raises(Exception):
+        state.get_config('relays')
+    assert 'relays' not in state.configs_cache
@@ -0,0 +1,67 @@
+import pytest
+from lefci.model import Config
+from lefci.optimize import create_plan
+from lefci.stats import StatsStore, get_rate, map_counters, parse_stats
+
+
+@pytest.fixture
+def config():
+    return Config(name='relays', log_trees=[
+        {'id': 'sshd', 'title': 'sshd', 'filters': [{'field': 'program', 'pattern': '^sshd$'}], 'children': [
+            {'id': 'failed', 'title': 'failed', 'filters': [{'field': 'message', 'pattern': 'Failed'},
+                                                            {'field': 'message', 'pattern': 'root'}]},
+            {'id': 'other', 'title': 'other', 'filters': [{'field': 'unknown', 'pattern': ''}]},
+        ]},
+        {'id': 'cron', 'title': 'cron', 'filters': [{'field': 'program', 'pattern': '^cron$'}]},
+    ])
+
+
+def test_counters_map_to_nodes(config):
+    counters = parse_stats('\n'.join([
+        'SourceName;SourceId;SourceInstance;State;Type;Number',
+        'center;;received;a;processed;1000',
+        'filter;f_sshd_1;;a;matched;600',
+        'filter;f_sshd_1;;a;not_matched;400',
+        'filter;f_failed_1;;a;matched;50',
+        'filter;f_failed_2;;a;matched;20',
+        'filter;f_sshd_catchall;;a;matched;550',
+        'filter;f_cron_1;;a;matched;300',
+    ]))
+    assert counters['f_sshd_1'] == 600
+    assert 'center' not in counters
+    # the last filter of a log path counts what the node caught
+    assert map_counters(config, counters) == {'sshd': 600, 'failed': 20, 'other': 550, 'cron': 300}
+
+
+def test_rates_and_restarts(tmpdir):
+    store = StatsStore(str(tmpdir))
+    store.add_sample('relays', 'relay1', {'sshd': 100}, timestamp=1000)
+    assert store.get_summary('relays')['sshd']['rate'] is None
+    store.add_sample('relays', 'relay1', {'sshd': 400}, timestamp=1100)
+    store.add_sample('relays', 'relay2', {'sshd': 50}, timestamp=1000)
+    store.add_sample('relays', 'relay2', {'sshd': 150}, timestamp=1010)
+    summary = store.get_summary('relays')['sshd']
+    assert summary['hits'] == 550
+    assert summary['rate'] == 3 + 10
+    assert summary['series']['relay1'] == [[1000, 100], [1100, 400]]
+    # syslog-ng started over
+    assert get_rate([[1000, 400], [1010, 20]]) == 2
+
+
+def test_samples_are_limited(tmpdir):
+    store = StatsStore(str(tmpdir), samples=3)
+    for timestamp in range(5):
+        store.add_sample('relays', 'relay1', {'sshd': timestamp}, timestamp=timestamp + 1)
+    assert [count for _, count in store.load('relays')['sshd']['relay1']] == [2, 3, 4]
+
+
+def test_log_paths_ordered_by_hits(config):
+    plan = create_plan(config, hits={'cron': 1000, 'sshd': 10, 'other': 5, 'failed': 1})
+    assert [log_path.id for log_path in plan.log_paths] == ['cron', 'sshd']
+    assert [log_path.id for log_path in plan.log_paths[1].children] == ['other', 'failed']
+    # the catch-all excludes the later sibling, failed stays without flags(final) as last log path
+    assert [log_path.final for log_path in plan.log_paths[1].children] == [True, False]
+    unordered_plan = create_plan(config)
+    for example in [{'program': 'sshd', 'message': 'Failed password for root'}, {'program': 'sshd'},
+                    {'program': 'cron'}]:
+        assert sorted(plan.route(example)) == sorted(unordered_plan.route(example))
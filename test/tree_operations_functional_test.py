@@ -0,0 +1,84 @@
+import pytest
+from lefci.model import Config, JsonStore, LogTree, OperationException, State
+from lefci.sqlite_store import SqliteStore
+
+
+def create_config():
+    return Config(name='relays', log_trees=[
+        {'id': 'nginx', 'title': 'nginx', 'filters': [{'field': 'program', 'pattern': 'nginx'}], 'children': [
+            {'id': 'errors', 'title': 'errors', 'example': {'message': 'error'}},
+            {'id': 'access', 'title': 'access'},
+        ]},
+        {'id': 'postfix', 'title': 'postfix'},
+    ])
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def state(request, tmp_path):
+    if request.param == 'sqlite':
+        return State(SqliteStore(str(tmp_path / 'lefci.db')))
+    return State(JsonStore(str(tmp_path / 'configs')))
+
+
+def test_operations_are_applied_in_order_and_saved_once(state):
+    config = create_config()
+    state.save_config(config)
+    changes = config.apply_operations([
+        {'op': 'add', 'parent': 'postfix', 'ref': 'new', 'tree': {'title': 'bounces'}},
+        {'op': 'move', 'id': 'errors', 'parent': 'new'},
+        {'op': 'update', 'id': 'access', 'changes': {'title': 'requests'}},
+        {'op': 'reorder', 'parent': None, 'order': ['postfix', 'nginx']},
+        {'op': 'delete', 'id': 'nginx'},
+    ])
+    state.save_changes(config, changes)
+    new_id = changes.created[0]['id']
+    assert changes.created == [{'operation': 0, 'ref': 'new', 'id': new_id}]
+    assert [node.id for node in changes.get_affected_nodes(config)] == [new_id, 'errors']
+
+    config.check_index()
+    assert [tree.id for tree in config.log_trees] == ['postfix']
+    assert config.find_tree('errors').parent.id == new_id
+    assert State(state.store).get_config('relays').encode() == config.encode()
+
+
+def test_node_moved_out_of_a_deleted_subtree_keeps_its_children(state):
+    config = create_config()
+    config.find_tree('errors').add_tree(LogTree(id='timeouts', title='timeouts'))
+    state.save_config(config)
+    changes = config.apply_operations([
+        {'op': 'move', 'id': 'errors', 'parent': 'postfix'},
+        {'op': 'delete', 'id': 'nginx'},
+    ])
+    state.save_changes(config, changes)
+    loaded = State(state.store).get_config('relays')
+    assert [child.id for child in loaded.find_tree('errors').children] == ['timeouts']
+    assert loaded.encode() == config.encode()
+
+
+def test_failed_operation_undoes_the_batch(state):
+    config = create_config()
+    state.save_config(config)
+    encoded = config.encode()
+    with pytest.raises(OperationException, match='Operation 5'):
+        config.apply_operations([
+            {'op': 'add', 'ref': 'cron', 'tree': {'title': 'cron'}},
+            {'op': 'update', 'id': 'errors', 'changes': {'samples': {'message': ['error', 'warning']}}},
+            {'op': 'update', 'id': 'nginx', 'changes': {'id': 'web', 'children': []}},
+            {'op': 'move', 'id': 'postfix', 'parent': 'web', 'position': 0},
+            {'op': 'delete', 'id': 'cron'},
+            {'op': 'move', 'id': 'web', 'parent': 'postfix'},
+        ])
+    config.check_index()
+    assert config.encode() == encoded
+
+
+def test_invalid_operations_are_rejected():
+    config = create_config()
+    with pytest.raises(OperationException, match='No node with missing'):
+        config.apply_operations([{'op': 'delete', 'id': 'missing'}])
+    with pytest.raises(OperationException, match='all children'):
+        config.apply_operations([{'op': 'reorder', 'parent': 'nginx', 'order': ['access']}])
+    with pytest.raises(OperationException, match='already used'):
+        config.apply_operations([{'op': 'add', 'tree': {'id': 'access'}}])
+    with pytest.raises(OperationException, match='misses'):
+        config.apply_operations([{'op': 'update', 'id': 'access'}])
@@ -0,0 +1,34 @@
+from lefci.model import Config, project_trees
+
+
+def create_config():
+    return Config(log_trees=[
+        {'id': 'nginx', 'title': 'nginx', 'example': {'program': 'nginx'}, 'children': [
+            {'id': 'errors', 'title': 'errors', 'children': [{'id': 'timeouts', 'title': 'timeouts'}]},
+            {'id': 'access', 'title': 'access'},
+            {'id': 'upstream', 'title': 'upstream'},
+        ]},
+        {'id': 'postfix', 'title': 'postfix'},
+    ])
+
+
+def test_fields_and_depth():
+    config = create_config()
+    fields = ['id', 'children_count', 'children']
+    assert project_trees(config.log_trees, fields, depth=0) == [
+        {'id': 'nginx', 'children_count': 3}, {'id': 'postfix', 'children_count': 0}]
+    nginx = config.find_tree('nginx').project(fields, depth=1)
+    assert nginx['children'][0] == {'id': 'errors', 'children_count': 1}
+    assert config.find_tree('nginx').project(['example']) == {'example': {'program': 'nginx'}}
+
+
+def test_offset_and_limit_select_the_first_level():
+    config = create_config()
+    nginx = config.find_tree('nginx').project(['id', 'children'], offset=0, limit=1)
+    assert nginx == {'id': 'nginx', 'children': [{'id': 'errors', 'children': [{'id': 'timeouts', 'children': []}]}]}
+    assert [tree['id'] for tree in project_trees(config.log_trees, ['id'], offset=1)] == ['postfix']
+
+
+def test_without_arguments_equals_encode():
+    config = create_config()
+    assert project_trees(config.log_trees) == [tree.encode() for tree in config.log_trees]
@@ -0,0 +1,59 @@
+import pytest
+from lefci.model import ApiConfig, Config, ReportBySource, Status
+
+
+def create_tree(name, width):
+    return {
+        'title': name,
+        'filters': [{'field': 'program', 'pattern': name}],
+        'example': {'program': name},
+        'children': [{
+            'title': f'{name} {index}',
+            'filters': [{'field': 'message', 'pattern': f'{index}'}],
+            'example': {'program': name, 'message': f'event {index}'},
+        } for index in range(width)],
+    }
+
+
+@pytest.fixture
+def config():
+    return Config(log_trees=[create_tree('nginx', 3), create_tree('postfix', 2), create_tree('sshd', 4)])
+
+
+@pytest.fixture
+def parallel():
+    parallel_verify_size = ApiConfig.parallel_verify_size
+    ApiConfig.parallel_verify_size = 0
+    yield
+    ApiConfig.parallel_verify_size = parallel_verify_size
+
+
+def expected_reports(config):
+    reports = ReportBySource()
+    for tree in config.log_trees:
+        for node in [tree] + tree.children:
+            reports += config.verify_node(node)
+    return reports.encode()
+
+
+def test_verify_all_in_process(config):
+    assert config.verify_all(processes=1).encode() == expected_reports(config)
+
+
+def test_verify_all_in_pool(config, parallel):
+    assert config.verify_all(processes=2).encode() == expected_reports(config)
+
+
+def test_verify_all_fail_fast(config, parallel):
+    # the example of the first child of the second tree misses its own filter
+    config.log_trees[1].children[0].update_config(example={'program': 'postfix', 'message': 'event'})
+    reports = config.verify_all(fail_fast=True, processes=1)
+    assert reports.get_highest_status_code() == Status.ERROR
+    assert len(reports) < len(expected_reports(config))
+    assert config.verify_all(fail_fast=True, processes=2).get_highest_status_code() == Status.ERROR
+
+
+def test_status_counts(config):
+    config.log_trees[0].children[0].update_config(example={'program': 'nginx', 'message': 'event 1'})
+    reports = config.verify_all(processes=1)
+    assert reports.count_status_codes()['ERROR'] == 1
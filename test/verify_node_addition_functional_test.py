@@ -1,5 +1,5 @@
 import pytest
-from lefci.model import Config, LogTree, Status, Report, ReportBySource
+from lefci.model import ApiConfig, Config, LogTree, Status, Report, ReportBySource
 
 
 def create_filter(pattern, field='message'):
@@ -18,6 +18,12 @@ def create_example(message=None, host=None, program=None):
     return example
 
 
+@pytest.fixture(autouse=True)
+def report_all(monkeypatch):
+    # the tests count the successful checks too
+    monkeypatch.setattr(ApiConfig, 'report_level', Status.OK)
+
+
 @pytest.fixture
 def config_with_one_child():
     root_config = {